@@ -3,17 +3,19 @@ import shutil
 import hashlib
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, simpledialog, scrolledtext
-from datetime import datetime, timedelta
+from datetime import datetime
 import webbrowser
 import sqlite3
 import numpy as np
 import time
+import threading
+import queue
 from PIL import Image, ImageTk, ImageOps, ImageFilter
 from sklearn.cluster import KMeans
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
 import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from mpl_toolkits.mplot3d import Axes3D
 import pyautogui
 import pygame
@@ -23,8 +25,30 @@ import json
 from difflib import SequenceMatcher
 import warnings
 import re
-from collections import defaultdict
+from collections import defaultdict, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED, ALL_COMPLETED
 import heapq
+import zipfile
+import tarfile
+import contextlib
+import multiprocessing
+import operator
+import bisect
+import errno
+from array import array
+import sys
+import stat
+import select
+import struct
+import ctypes
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+try:
+    import zstandard
+except ImportError:  # Optional: .tar.zst archives
+    zstandard = None
 warnings.filterwarnings('ignore')
 
 # ========== CONSTANTS AND CONFIGURATIONS ==========
@@ -96,84 +120,3902 @@ THEMES = {
     }
 }
 
+# Local database for caches and indexes, kept next to the config file
+DATABASE_FILE = 'filemanager_data.db'
+IGNORE_FILE = '.smartarrangeignore'
+DEFAULT_IGNORE_RULES = ['.git/', '.hg/', '.svn/', 'node_modules/', '__pycache__/', '.venv/',
+                        '.tox/', '.mypy_cache/', '.pytest_cache/', '.cache/']
+DEFAULT_ORGANIZE_RULES = ['* -> {category}']
+
 # ========== HELPER CLASSES ==========
 class FileAnalyzer:
     @staticmethod
-    def get_similar_files(target_file, folder_path, threshold=0.7):
-        """Find similar files based on content or name"""
+    def get_similar_files(target_file, folder_path, threshold=0.7):
+        """Find similar files based on content or name"""
+        try:
+            files = [f for f in os.listdir(folder_path) if os.path.isfile(os.path.join(folder_path, f))]
+            if not files:
+                return []
+            
+            # Compare filenames
+            similar = []
+            target_name = os.path.basename(target_file)
+            for f in files:
+                ratio = SequenceMatcher(None, target_name, f).ratio()
+                if ratio > threshold and f != target_name:
+                    similar.append(f)
+            
+            # Compare content for text files
+            if target_file.endswith(('.txt', '.pdf', '.docx')):
+                try:
+                    contents = []
+                    valid_files = [target_file]
+                    
+                    for f in files:
+                        if f.endswith(('.txt', '.pdf', '.docx')):
+                            valid_files.append(os.path.join(folder_path, f))
+                    
+                    vectorizer = TfidfVectorizer()
+                    for f in valid_files:
+                        with open(f, 'r', encoding='utf-8', errors='ignore') as file:
+                            contents.append(file.read())
+                    
+                    tfidf = vectorizer.fit_transform(contents)
+                    similarities = cosine_similarity(tfidf[0:1], tfidf)[0]
+                    
+                    for i, sim in enumerate(similarities[1:], 1):
+                        if sim > threshold:
+                            similar.append(os.path.basename(valid_files[i]))
+                except Exception:
+                    pass
+            
+            return list(set(similar))
+        except Exception:
+            return []
+
+class OperationCancelled(Exception):
+    """Raised inside long-running work when the user cancelled it"""
+
+class FileEntry:
+    """A directory entry together with the stat fields the views need"""
+    __slots__ = ('name', 'path', 'is_file', 'size', 'mtime', 'ctime', 'atime', 'ext', 'category',
+                 'dev', 'ino', 'mtime_ns', 'blocks', 'links')
+
+    def __init__(self, name, path, is_file, size=0, mtime=0.0, ctime=0.0, atime=0.0,
+                 dev=0, ino=0, mtime_ns=0, blocks=None, links=1):
+        self.name = name
+        self.path = path
+        self.is_file = is_file
+        self.size = size
+        self.mtime = mtime
+        self.ctime = ctime
+        self.atime = atime
+        self.dev = dev
+        self.ino = ino
+        self.mtime_ns = mtime_ns
+        self.blocks = blocks
+        self.links = links
+        self.ext = os.path.splitext(name)[1].lower() if is_file else ''
+        self.category = EXTENSION_FOLDERS.get(self.ext, 'Other') if is_file else 'Folder'
+
+    @classmethod
+    def from_dir_entry(cls, entry):
+        """Build from an os.DirEntry, reusing the stat result scandir caches"""
+        try:
+            is_file = entry.is_file()
+        except OSError:
+            is_file = False
+        if not is_file:
+            return cls(entry.name, entry.path, False)
+        try:
+            st = entry.stat()
+        except OSError:
+            return cls(entry.name, entry.path, True)
+        return cls(entry.name, entry.path, True, st.st_size, st.st_mtime, st.st_ctime, st.st_atime,
+                   st.st_dev, st.st_ino, st.st_mtime_ns, getattr(st, 'st_blocks', None), st.st_nlink)
+
+    @classmethod
+    def from_path(cls, path):
+        """Build by stat-ing path; raises OSError if it does not exist"""
+        st = os.stat(path)
+        name = os.path.basename(path)
+        if not stat.S_ISREG(st.st_mode):
+            return cls(name, path, False)
+        return cls(name, path, True, st.st_size, st.st_mtime, st.st_ctime, st.st_atime,
+                   st.st_dev, st.st_ino, st.st_mtime_ns, getattr(st, 'st_blocks', None), st.st_nlink)
+
+    @property
+    def inode(self):
+        """(device, inode) identifying the file's data, or None if unknown"""
+        return (self.dev, self.ino) if self.ino else None
+
+    @property
+    def allocated(self):
+        """Bytes the file takes on disk; the apparent size where blocks are unknown"""
+        return self.blocks * 512 if self.blocks is not None else self.size
+
+class IgnoreRules:
+    """gitignore-style rules deciding which folders and files a walk skips
+
+    Patterns follow .gitignore: blank lines and '#' comments are skipped,
+    '!' re-includes, a trailing '/' only matches folders, and '*', '?',
+    '[...]' and '**' are wildcards. The last matching pattern wins. The
+    patterns of one rule set are compiled into a single regex (one for
+    folders, one for files) whose alternatives run from the last rule to
+    the first, so the first alternative that matches is the winning rule.
+
+    Configured rules apply at any depth. An IGNORE_FILE in a folder adds
+    rules for its subtree, taking precedence over the ones above it; its
+    patterns that contain a '/' are anchored to that folder, so '/build/'
+    there skips its own build folder but not a nested one. enter()
+    returns the rules in effect inside a folder.
+    """
+    def __init__(self, patterns=(), base=None, parent=None, mtime_ns=0, max_scopes=100000):
+        self.base = base
+        self.parent = parent
+        self.mtime_ns = mtime_ns
+        self.max_scopes = max_scopes
+        self._scopes = OrderedDict()
+        self._scopes_lock = threading.Lock()
+        rules = [rule for rule in map(self._parse, patterns) if rule]
+        self._negated = {f'r{i}': rule[0] for i, rule in enumerate(rules)}
+        self._dir_regex = self._combine((i, rule) for i, rule in enumerate(rules))
+        self._file_regex = self._combine((i, rule) for i, rule in enumerate(rules) if not rule[1])
+
+    def _parse(self, line):
+        """Return (negated, dir_only, regex) for one pattern line, or None"""
+        line = line.rstrip('\r\n')
+        if not line.strip() or line.startswith('#'):
+            return None
+        line = line.rstrip(' ') if not line.endswith('\\ ') else line
+        negated = line.startswith('!')
+        if negated:
+            line = line[1:]
+        elif line.startswith('\\!') or line.startswith('\\#'):
+            line = line[1:]
+        dir_only = line.endswith('/')
+        # Only the trailing slash goes here; a leading one still anchors below
+        line = line.rstrip('/') if dir_only else line
+        anchored = self.base is not None and '/' in line
+        line = line.lstrip('/')
+        if not line:
+            return None
+        body = self._translate(line)
+        return negated, dir_only, body if anchored else '(?:.*/)?' + body
+
+    @staticmethod
+    def _translate(pattern):
+        out = []
+        i = 0
+        while i < len(pattern):
+            c = pattern[i]
+            if pattern.startswith('**/', i):
+                out.append('(?:.*/)?')
+                i += 3
+                continue
+            if pattern.startswith('**', i):
+                out.append('.*')
+                i += 2
+                continue
+            if c == '*':
+                out.append('[^/]*')
+            elif c == '?':
+                out.append('[^/]')
+            elif c == '[' and pattern.find(']', i + 2) != -1:
+                end = pattern.find(']', i + 2)
+                chars = pattern[i + 1:end].replace('\\', '\\\\')
+                out.append('[' + ('^' + chars[1:] if chars.startswith('!') else chars) + ']')
+                i = end
+            elif c == '\\' and i + 1 < len(pattern):
+                i += 1
+                out.append(re.escape(pattern[i]))
+            else:
+                out.append(re.escape(c))
+            i += 1
+        return ''.join(out)
+
+    @staticmethod
+    def _combine(rules):
+        alternatives = [f'(?P<r{i}>{rule[2]})' for i, rule in rules]
+        if not alternatives:
+            return None
+        return re.compile('|'.join(reversed(alternatives)), re.DOTALL)
+
+    def ignored(self, path, is_dir):
+        """Whether path (a folder if is_dir) is excluded by these rules"""
+        if os.sep != '/':
+            path = path.replace(os.sep, '/')
+        scope = self
+        while scope is not None:
+            regex = scope._dir_regex if is_dir else scope._file_regex
+            if regex is not None:
+                relative = path
+                if scope.base is not None:
+                    relative = path[len(scope.base) + 1:]
+                match = regex.fullmatch(relative)
+                if match:
+                    return not scope._negated[match.lastgroup]
+            scope = scope.parent
+        return False
+
+    def enter(self, folder, has_file=None):
+        """Return the rules in effect inside folder
+
+        has_file tells whether folder holds an IGNORE_FILE; when it is None
+        the disk is checked. Results are cached for the max_scopes folders
+        used most recently, and a rules file is read again only when its
+        mtime changes.
+        """
+        folder = folder.replace(os.sep, '/') if os.sep != '/' else folder
+        path = os.path.join(folder, IGNORE_FILE)
+        cached = self._cached(folder)
+        if has_file is None:
+            if cached is not False:
+                return cached or self._ancestor_scope(folder)
+            has_file = os.path.isfile(path)
+        if not has_file:
+            self._cache(folder, None)
+            return self._ancestor_scope(folder)
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+            if cached and cached.mtime_ns == mtime_ns:
+                return cached
+            with open(path, encoding='utf-8', errors='replace') as f:
+                patterns = f.readlines()
+        except OSError:
+            self._cache(folder, None)
+            return self._ancestor_scope(folder)
+        scope = IgnoreRules(patterns, folder, self._ancestor_scope(folder), mtime_ns)
+        self._cache(folder, scope)
+        return scope
+
+    def _cached(self, folder):
+        """Cached rules of folder: a scope, None if it has none, False if not known"""
+        with self._scopes_lock:
+            scope = self._scopes.get(folder, False)
+            if scope is not False:
+                self._scopes.move_to_end(folder)
+            return scope
+
+    def _cache(self, folder, scope):
+        with self._scopes_lock:
+            self._scopes[folder] = scope
+            self._scopes.move_to_end(folder)
+            while len(self._scopes) > self.max_scopes:
+                self._scopes.popitem(last=False)
+
+    def _ancestor_scope(self, folder):
+        """Rules of the nearest folder above folder that has its own rules"""
+        parent = os.path.dirname(folder)
+        while parent != folder:
+            scope = self._cached(parent)
+            if scope is False:
+                return self.enter(parent)
+            if scope is not None:
+                return scope
+            folder, parent = parent, os.path.dirname(parent)
+        return self
+
+class TreeWalker:
+    """Recursive listing of one or more folder trees"""
+    @staticmethod
+    def scan_folder(folder, rules=None, links=None, others=None):
+        """Return ([FileEntry for files], [subfolder paths]) of one folder
+
+        Symbolic links are skipped, so a walk never leaves the trees or
+        reports the same data twice through a link. Entries excluded by
+        rules (IgnoreRules) are dropped before they are stat-ed. If the
+        lists links and others are given, the paths of symbolic links and
+        of entries that are neither files nor folders are appended to them.
+        """
+        with os.scandir(folder) as it:
+            dir_entries = list(it)
+        if rules is not None:
+            rules = rules.enter(folder, any(e.name == IGNORE_FILE for e in dir_entries))
+        files = []
+        subdirs = []
+        for dir_entry in dir_entries:
+            try:
+                if dir_entry.is_symlink():
+                    if links is not None and not (rules and rules.ignored(dir_entry.path,
+                                                                         dir_entry.is_dir())):
+                        links.append(dir_entry.path)
+                    continue
+                if dir_entry.is_dir():
+                    if not (rules and rules.ignored(dir_entry.path, True)):
+                        subdirs.append(dir_entry.path)
+                    continue
+            except OSError:
+                if others is not None:
+                    others.append(dir_entry.path)
+                continue
+            if rules and rules.ignored(dir_entry.path, False):
+                continue
+            entry = FileEntry.from_dir_entry(dir_entry)
+            if entry.is_file:
+                files.append(entry)
+            elif others is not None:
+                others.append(dir_entry.path)
+        return files, subdirs
+
+    @staticmethod
+    def walk_tree(root, cancelled=None, workers=None, rules=None, onerror=None):
+        """Yield (folder, subfolders, files, links, others) for root and every folder below it
+
+        Folders come in depth-first order, parents first. Unlike iter_files
+        this leaves out only ignored entries: empty folders are reported,
+        symbolic links are listed in links without being followed and
+        pipes, devices and the like in others (both as paths). A folder
+        that cannot be read is passed to onerror(OSError) and not yielded.
+        """
+        def visit(folder):
+            links, others = [], []
+            try:
+                files, subdirs = TreeWalker.scan_folder(folder, rules, links, others)
+            except OSError as e:
+                return (e, None), []
+            return (None, (subdirs, files, links, others)), subdirs
+
+        walker = ParallelWalker(workers, cancelled)
+        for folder, (error, listing) in walker.walk([root], visit, ordered=True):
+            if error is not None:
+                if onerror:
+                    onerror(error)
+                continue
+            yield (folder,) + listing
+
+    @staticmethod
+    def iter_files(roots, recursive=True, cancelled=None, workers=None, rules=None, ordered=True):
+        """Yield a freshly stat-ed FileEntry for every regular file below the roots
+
+        Folders are listed in parallel but reported in depth-first order, so
+        the result does not depend on thread timing. With ordered=False each
+        folder is reported as soon as it was listed instead.
+        """
+        def visit(folder):
+            try:
+                files, subdirs = TreeWalker.scan_folder(folder, rules)
+            except OSError:
+                # Unreadable folders are skipped rather than aborting the walk
+                return [], []
+            return files, subdirs if recursive else []
+
+        walker = ParallelWalker(workers, cancelled)
+        for _, files in walker.walk(roots, visit, ordered=ordered):
+            yield from files
+
+class ParallelWalker:
+    """Walk folder trees with several threads listing folders at once
+
+    On network mounts every readdir and stat waits for a round trip, so a
+    walk is bound by latency rather than bandwidth; keeping many folders in
+    flight hides it. Each worker keeps its own deque of folders and works
+    depth first from its tail. A worker that runs dry steals from the head
+    of another worker's deque, where the largest untouched subtrees are.
+
+    visit(folder) runs on the worker threads and returns (result,
+    subfolders). walk() yields (folder, result) on the calling thread,
+    either as folders complete or, with ordered=True, in the order of a
+    sequential depth-first walk.
+    """
+    def __init__(self, workers=None, cancelled=None):
+        self.workers = max(1, workers or 8)
+        self.cancelled = cancelled
+
+    def walk(self, roots, visit, ordered=False):
+        roots = list(dict.fromkeys(roots))
+        if not roots:
+            return
+        count = self.workers
+        deques = [deque() for _ in range(count)]
+        for i, root in enumerate(reversed(roots)):
+            deques[i % count].append(root)
+        results = queue.Queue()
+        stop = threading.Event()
+        idle = threading.Condition()
+        pending = [len(roots)]
+
+        def steal(me):
+            for i in range(1, count):
+                try:
+                    return deques[(me + i) % count].popleft()
+                except IndexError:
+                    pass
+            return None
+
+        def work(me):
+            own = deques[me]
+            while not stop.is_set():
+                try:
+                    folder = own.pop()
+                except IndexError:
+                    folder = steal(me)
+                if folder is None:
+                    with idle:
+                        if pending[0] == 0:
+                            return
+                        idle.wait(0.05)
+                    continue
+                try:
+                    result, subdirs = visit(folder)
+                except BaseException as e:
+                    results.put((None, e, None))
+                    return
+                own.extend(reversed(subdirs))
+                with idle:
+                    pending[0] += len(subdirs) - 1
+                    if subdirs or pending[0] == 0:
+                        idle.notify_all()
+                results.put((folder, result, subdirs))
+
+        threads = [threading.Thread(target=work, args=(i,), daemon=True) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        try:
+            remaining = len(roots)
+            cursor = list(reversed(roots))
+            done = {}
+            while remaining:
+                if self.cancelled is not None and self.cancelled.is_set():
+                    raise OperationCancelled()
+                try:
+                    folder, result, subdirs = results.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if folder is None:
+                    raise result
+                remaining += len(subdirs) - 1
+                if not ordered:
+                    yield folder, result
+                    continue
+                # Hold results back until every folder before them was reported
+                done.setdefault(folder, deque()).append((result, subdirs))
+                while cursor and cursor[-1] in done:
+                    folder = cursor.pop()
+                    result, subdirs = done[folder].popleft()
+                    if not done[folder]:
+                        del done[folder]
+                    cursor.extend(reversed(subdirs))
+                    yield folder, result
+        finally:
+            stop.set()
+            with idle:
+                idle.notify_all()
+
+class IncrementalWalker:
+    """Recursive rescan that skips folders whose st_mtime_ns is unchanged
+
+    The walker keeps no state of its own. It works against a store that
+    remembers, for every folder, the mtime seen at its last scan and its
+    subfolders:
+
+        get_folder(path) -> (mtime_ns, [subfolder paths]) or None
+        put_folder(path, mtime_ns, files, subfolders)
+        forget_tree(path)
+
+    An unchanged folder costs a single stat; only folders whose entries were
+    added, removed or renamed are listed again. Files modified in place do
+    not change their folder's mtime, so their cached stats can lag behind.
+    on_unchanged, if given, is called with every folder that was skipped.
+    With rules (IgnoreRules), excluded subtrees are never opened and ones
+    that became excluded are dropped from the store; file patterns take
+    effect the next time a folder is read. With one_device, like du -x,
+    folders on another file system than the root (mounts, /proc, /sys)
+    are neither listed nor kept in the store.
+
+    Folders are checked on ParallelWalker threads, which call get_folder
+    concurrently; every other store call is made from the calling thread.
+    """
+    def __init__(self, store, on_unchanged=None, workers=None, rules=None, one_device=False):
+        self.store = store
+        self.on_unchanged = on_unchanged
+        self.workers = workers
+        self.rules = rules
+        self.one_device = one_device
+
+    def refresh(self, root, cancelled=None, progress=None):
+        """Bring the store up to date for the tree below root
+
+        progress, if given, is a dict updated with 'dirs' (folders checked)
+        and 'rescanned' (folders re-read) as the walk goes.
+        """
+        progress = progress if progress is not None else {}
+        progress.update(dirs=0, rescanned=0)
+        root = os.path.abspath(root)
+        device = None
+        if self.one_device:
+            try:
+                device = os.stat(root).st_dev
+            except OSError:
+                pass
+        walker = ParallelWalker(self.workers, cancelled)
+        check = lambda folder: self._check_folder(folder, device)
+        for folder, (state, scan) in walker.walk([root], check):
+            progress['dirs'] += 1
+            if state == 'unchanged':
+                for subdir in scan:
+                    self.store.forget_tree(subdir)
+                if self.on_unchanged:
+                    self.on_unchanged(folder)
+            elif state in ('gone', 'foreign'):
+                self.store.forget_tree(folder)
+            else:
+                mtime_ns, files, subdirs, known = scan
+                progress['rescanned'] += 1
+                if known is not None:
+                    for gone in set(known[1]) - set(subdirs):
+                        self.store.forget_tree(gone)
+                self.store.put_folder(folder, mtime_ns, files, subdirs)
+        return progress
+
+    def _check_folder(self, folder, device=None):
+        """Stat one folder and list it again if it changed (walker thread)"""
+        try:
+            st = os.stat(folder)
+        except OSError:
+            return ('gone', None), []
+        if device is not None and st.st_dev != device:
+            return ('foreign', None), []
+        mtime_ns = st.st_mtime_ns
+        known = self.store.get_folder(folder)
+        if known is not None and known[0] == mtime_ns:
+            subdirs = known[1]
+            ignored = []
+            if self.rules is not None:
+                scope = self.rules.enter(folder)
+                ignored = [d for d in subdirs if scope.ignored(d, True)]
+                subdirs = [d for d in subdirs if d not in ignored] if ignored else subdirs
+            return ('unchanged', ignored), subdirs
+        try:
+            files, subdirs = TreeWalker.scan_folder(folder, self.rules)
+        except OSError:
+            return ('gone', None), []
+        return ('changed', (mtime_ns, files, subdirs, known)), subdirs
+
+class TreeModel:
+    """In-memory model of folder trees, kept current by IncrementalWalker
+
+    Once the model holds more than max_folders, the trees refreshed least
+    recently are forgotten. The tree just refreshed is always kept whole.
+    """
+    def __init__(self, max_folders=200000):
+        self.max_folders = max_folders
+        self.folders = {}
+        self._roots = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get_folder(self, path):
+        with self._lock:
+            node = self.folders.get(path)
+        return (node[0], node[2]) if node else None
+
+    def put_folder(self, path, mtime_ns, files, subdirs):
+        with self._lock:
+            self.folders[path] = (mtime_ns, files, subdirs)
+
+    def forget_tree(self, path):
+        with self._lock:
+            node = self.folders.pop(path, None)
+            if node:
+                for subdir in node[2]:
+                    self.forget_tree(subdir)
+
+    def refresh(self, root, cancelled=None, progress=None, workers=None, rules=None, one_device=False):
+        """Rescan whatever changed below root since the last refresh"""
+        root = os.path.abspath(root)
+        walker = IncrementalWalker(self, workers=workers, rules=rules, one_device=one_device)
+        progress = walker.refresh(root, cancelled, progress)
+        self._trim(root)
+        return progress
+
+    def _trim(self, keep):
+        """Forget the least recently refreshed trees other than keep while over max_folders"""
+        prefix = os.path.join(keep, '')
+        with self._lock:
+            self._roots[keep] = True
+            self._roots.move_to_end(keep)
+            for root in list(self._roots):
+                if len(self.folders) <= self.max_folders:
+                    break
+                if root == keep or keep.startswith(os.path.join(root, '')):
+                    # Forgetting an ancestor would take keep with it
+                    continue
+                del self._roots[root]
+                if not root.startswith(prefix):
+                    self.forget_tree(root)
+
+    def apply(self, update):
+        """Patch a folder already in the model with a FolderUpdate"""
+        with self._lock:
+            node = self.folders.get(update.path)
+            if node is None:
+                return
+            touched = update.names
+            files = [entry for entry in node[1] if entry.name not in touched]
+            files.extend(entry for entry in update.changed if entry.is_file)
+            subdirs = [d for d in node[2] if os.path.basename(d) not in touched]
+            subdirs.extend(update.subdirs)
+            for name in update.removed:
+                self.forget_tree(os.path.join(update.path, name))
+            self.folders[update.path] = (update.mtime_ns, files, subdirs)
+
+    def nodes(self, root):
+        """List (path, files, subfolders) for root and every folder below it, parents first"""
+        result = []
+        stack = [os.path.abspath(root)]
+        with self._lock:
+            while stack:
+                path = stack.pop()
+                node = self.folders.get(path)
+                if node:
+                    result.append((path, node[1], node[2]))
+                    stack.extend(reversed(node[2]))
+        return result
+
+    def iter_files(self, root):
+        """Yield the cached FileEntry objects below root"""
+        stack = [os.path.abspath(root)]
+        while stack:
+            with self._lock:
+                node = self.folders.get(stack.pop())
+            if node:
+                yield from node[1]
+                stack.extend(reversed(node[2]))
+
+    def walk_files(self, roots, cancelled=None, workers=None, rules=None):
+        """Refresh each root incrementally, then yield every file below them"""
+        for root in roots:
+            self.refresh(root, cancelled, workers=workers, rules=rules)
+            yield from self.iter_files(root)
+
+class FolderSizes:
+    """du-style recursive folder totals over a TreeModel
+
+    For every folder it keeps (apparent bytes, allocated bytes, files) of
+    the folder and everything below it; like du, a file with several hard
+    links is counted once. A folder's own files are summed again only when
+    TreeModel replaced its file list, so after an incremental refresh just
+    the re-read folders touch their files; the roll-up to the parents then
+    costs one addition per folder.
+    """
+    def __init__(self, model):
+        self.model = model
+        self.totals = {}
+        self._own = {}
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """(apparent, allocated, files) below path, or None if not computed yet"""
+        with self._lock:
+            return self.totals.get(path)
+
+    @staticmethod
+    def _sum_files(files):
+        """(files, apparent, allocated, count, {inode: (size, allocated)} of hard links)"""
+        apparent = allocated = 0
+        linked = {}
+        for entry in files:
+            if entry.links > 1 and entry.ino:
+                linked[entry.inode] = (entry.size, entry.allocated)
+            else:
+                apparent += entry.size
+                allocated += entry.allocated
+        return files, apparent, allocated, len(files), linked
+
+    def update(self, root):
+        """Recompute the totals below root from the model; returns the root's totals"""
+        root = os.path.abspath(root)
+        nodes = self.model.nodes(root)
+        totals = {}
+        own_sums = {}
+        # Sums without hard-linked files, and those files by inode, per folder
+        plain = {}
+        links = {}
+        for path, files, subdirs in reversed(nodes):
+            own = self._own.get(path)
+            if own is None or own[0] is not files:
+                own = self._sum_files(files)
+            own_sums[path] = own
+            apparent, allocated, count = own[1:4]
+            linked = dict(own[4]) if own[4] else None
+            for subdir in subdirs:
+                child = plain.get(subdir)
+                if child:
+                    apparent += child[0]
+                    allocated += child[1]
+                    count += child[2]
+                child_links = links.pop(subdir, None)
+                if child_links:
+                    if linked is None:
+                        linked = child_links
+                    else:
+                        linked.update(child_links)
+            plain[path] = (apparent, allocated, count)
+            if linked:
+                links[path] = linked
+                apparent += sum(size for size, _ in linked.values())
+                allocated += sum(alloc for _, alloc in linked.values())
+            totals[path] = (apparent, allocated, count)
+        prefix = os.path.join(root, '')
+        with self._lock:
+            # Drop folders below root and any the model has forgotten since
+            for cache in (self.totals, self._own):
+                for path in [p for p in cache if p == root or p.startswith(prefix)
+                             or self.model.get_folder(p) is None]:
+                    del cache[path]
+            self.totals.update(totals)
+            self._own.update(own_sums)
+        return totals.get(root)
+
+    def breakdown(self, path):
+        """[(path, apparent, allocated, is_folder)] for the subfolders of path and
+        one entry (path itself, is_folder False) for the files directly in it"""
+        nodes = self.model.nodes(path)
+        if not nodes:
+            return []
+        folder, files, subdirs = nodes[0]
+        parts = []
+        with self._lock:
+            for subdir in subdirs:
+                totals = self.totals.get(subdir)
+                if totals:
+                    parts.append((subdir, totals[0], totals[1], True))
+        parts.append((folder, sum(e.size for e in files), sum(e.allocated for e in files), False))
+        return parts
+
+class Treemap:
+    """Squarified treemap layout (Bruls, Huizing and van Wijk)"""
+    @staticmethod
+    def squarify(values, x, y, width, height):
+        """Split the rectangle into one (x, y, w, h) per value, sorted largest first
+
+        values must be positive and in descending order; areas are
+        proportional to them and laid out in rows whose aspect ratios stay
+        close to 1.
+        """
+        total = float(sum(values))
+        if total <= 0 or width <= 0 or height <= 0:
+            return []
+        scale = width * height / total
+        areas = [v * scale for v in values]
+        rects = []
+        i = 0
+        while i < len(areas):
+            side = min(width, height)
+            row_sum = largest = smallest = areas[i]
+            worst = max(side * side * largest / (row_sum * row_sum), row_sum * row_sum / (side * side * smallest))
+            j = i + 1
+            # Grow the row while that improves its worst aspect ratio
+            while j < len(areas):
+                s = row_sum + areas[j]
+                low = min(smallest, areas[j])
+                ratio = max(side * side * largest / (s * s), s * s / (side * side * low))
+                if ratio > worst:
+                    break
+                row_sum, smallest, worst = s, low, ratio
+                j += 1
+            if width >= height:
+                column = row_sum / height
+                top = y
+                for area in areas[i:j]:
+                    rects.append((x, top, column, area / column))
+                    top += area / column
+                x += column
+                width -= column
+            else:
+                row = row_sum / width
+                left = x
+                for area in areas[i:j]:
+                    rects.append((left, y, area / row, row))
+                    left += area / row
+                y += row
+                height -= row
+            i = j
+        return rects
+
+class DirectorySnapshot:
+    """Listing of one folder built with a single os.scandir pass"""
+    def __init__(self, path, entries, mtime_ns=0):
+        self.path = path
+        self.entries = entries
+        self.mtime_ns = mtime_ns
+        self.files = [e for e in entries if e.is_file]
+        self.folders = [e for e in entries if not e.is_file]
+        self.total_size = sum(e.size for e in self.files)
+
+    @classmethod
+    def scan(cls, path, on_batch=None, cancelled=None, first_batch=100, batch_size=1000):
+        """List the folder once and keep the stat results of every entry
+        
+        When on_batch is given it receives the entries in small batches while
+        the scan is still running. Returns None if cancelled is set midway.
+        """
+        # Read the directory mtime first so a change during the scan
+        # invalidates the snapshot on the next lookup
+        mtime_ns = os.stat(path).st_mtime_ns
+        entries = []
+        batch_start = 0
+        limit = first_batch
+        with os.scandir(path) as it:
+            for dir_entry in it:
+                entries.append(FileEntry.from_dir_entry(dir_entry))
+                if len(entries) - batch_start >= limit:
+                    if cancelled is not None and cancelled.is_set():
+                        return None
+                    if on_batch:
+                        on_batch(entries[batch_start:])
+                    batch_start = len(entries)
+                    limit = batch_size
+        if on_batch and batch_start < len(entries):
+            on_batch(entries[batch_start:])
+        return cls(path, entries, mtime_ns)
+
+    def updated(self, update):
+        """Return a copy of the snapshot with a FolderUpdate applied"""
+        touched = update.names
+        entries = [entry for entry in self.entries if entry.name not in touched]
+        entries.extend(update.changed)
+        return DirectorySnapshot(self.path, entries, update.mtime_ns)
+
+class SnapshotCache:
+    """Per-folder snapshot cache invalidated by the directory's st_mtime_ns"""
+    def __init__(self, max_folders=16):
+        self.max_folders = max_folders
+        self._snapshots = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, path):
+        """Return the cached snapshot of path if it is still current, else None"""
+        mtime_ns = os.stat(path).st_mtime_ns
+        with self._lock:
+            snapshot = self._snapshots.get(path)
+            if snapshot is None or snapshot.mtime_ns != mtime_ns:
+                return None
+            self._snapshots.move_to_end(path)
+            return snapshot
+
+    def get(self, path):
+        """Return a snapshot of path, rescanning only if the folder changed"""
+        snapshot = self.lookup(path)
+        if snapshot is None:
+            snapshot = DirectorySnapshot.scan(path)
+            self.put(snapshot)
+        return snapshot
+
+    def put(self, snapshot):
+        """Store a snapshot, evicting the least recently used folder"""
+        with self._lock:
+            self._snapshots[snapshot.path] = snapshot
+            self._snapshots.move_to_end(snapshot.path)
+            while len(self._snapshots) > self.max_folders:
+                self._snapshots.popitem(last=False)
+
+    def apply(self, update):
+        """Patch the cached snapshot of a folder instead of dropping it"""
+        with self._lock:
+            snapshot = self._snapshots.get(update.path)
+            if snapshot is not None:
+                self._snapshots[update.path] = snapshot.updated(update)
+
+    def invalidate(self, path=None):
+        """Drop the snapshot for path, or all snapshots"""
+        with self._lock:
+            if path is None:
+                self._snapshots.clear()
+            else:
+                self._snapshots.pop(path, None)
+
+class TrigramIndex:
+    """Substring index over short lowercased strings, built from trigrams
+
+    Every key gets an integer id and every trigram maps to the ids of the
+    keys containing it, kept as a sorted array('I'); ids only ever grow, so
+    adding a key keeps the arrays sorted. A query intersects the posting
+    lists of its trigrams, rarest first, and only compares the surviving
+    candidates with the pattern. Removed keys leave a hole that queries
+    skip; the postings are compacted once a quarter of their ids are dead.
+    """
+    def __init__(self, keys=()):
+        self.keys = []
+        self.postings = {}
+        self.live = 0
+        self.stale = 0
+        for key in keys:
+            self.add(key)
+
+    def __len__(self):
+        return self.live
+
+    @staticmethod
+    def grams(text):
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
+    @staticmethod
+    def matcher(pattern):
+        """Return a predicate telling whether a key contains pattern
+
+        pattern may use * (any run of characters) and ? (any one character).
+        """
+        if '*' not in pattern and '?' not in pattern:
+            return lambda key: pattern in key
+        regex = re.compile(''.join('.*' if c == '*' else '.' if c == '?' else re.escape(c)
+                                   for c in pattern), re.DOTALL)
+        return lambda key: regex.search(key) is not None
+
+    def add(self, key):
+        """Index key and return its id"""
+        doc = len(self.keys)
+        self.keys.append(key)
+        postings = self.postings
+        for gram in self.grams(key):
+            posting = postings.get(gram)
+            if posting is None:
+                posting = postings[gram] = array('I')
+            posting.append(doc)
+        self.live += 1
+        return doc
+
+    def remove(self, doc):
+        """Drop the key with the given id"""
+        if self.keys[doc] is None:
+            return
+        self.keys[doc] = None
+        self.live -= 1
+        self.stale += 1
+        if self.stale * 4 > len(self.keys):
+            self.compact()
+
+    def compact(self):
+        """Strip the ids of removed keys from the posting lists"""
+        alive = np.fromiter((key is not None for key in self.keys), dtype=bool, count=len(self.keys))
+        postings = {}
+        for gram, posting in self.postings.items():
+            ids = np.frombuffer(posting, dtype=np.uint32)
+            ids = ids[alive[ids]]
+            if len(ids):
+                postings[gram] = array('I', ids.tobytes())
+        self.postings = postings
+        self.stale = 0
+
+    def candidates(self, pattern):
+        """Ids holding every trigram of pattern, or None if it has no trigram"""
+        grams = set()
+        for fragment in re.split(r'[*?]', pattern):
+            grams |= self.grams(fragment)
+        if not grams:
+            return None
+        lists = []
+        for gram in grams:
+            posting = self.postings.get(gram)
+            if posting is None:
+                return []
+            lists.append(np.frombuffer(posting, dtype=np.uint32))
+        lists.sort(key=len)
+        result = lists[0]
+        for other in lists[1:]:
+            if not len(result):
+                break
+            # Binary-search every remaining candidate in the longer list
+            pos = np.minimum(np.searchsorted(other, result), len(other) - 1)
+            result = result[other[pos] == result]
+        return result.tolist()
+
+    def search(self, pattern, candidates=None):
+        """Return the ids of the keys containing pattern, in id order
+
+        candidates, when given, restricts the check to those ids instead of
+        looking the pattern's trigrams up.
+        """
+        if candidates is None:
+            candidates = self.candidates(pattern)
+        if candidates is None:
+            candidates = range(len(self.keys))
+        keys = self.keys
+        match = self.matcher(pattern)
+        return [doc for doc in candidates if keys[doc] is not None and match(keys[doc])]
+
+class NameFilter:
+    """Substring filter over folder entries that narrows as the query grows
+
+    Lowercased names are held in a TrigramIndex, so a query of three or more
+    characters starts from its trigram postings instead of a scan. The
+    matches of recent queries are kept on a stack: a query that extends the
+    previous one only rechecks its matches, and deleting characters goes
+    back to an earlier result. Queries may use * and ? wildcards.
+    """
+    def __init__(self, entries=()):
+        self.entries = []
+        self.ids = {}
+        self.index = TrigramIndex()
+        for entry in entries:
+            self._add(entry)
+        self._stack = [('', None)]
+
+    def __len__(self):
+        return len(self.index)
+
+    def _add(self, entry):
+        self.ids[entry.name] = self.index.add(entry.name.lower())
+        self.entries.append(entry)
+
+    def apply(self, update):
+        """Follow a FolderUpdate without rebuilding the index"""
+        for name in update.names:
+            doc = self.ids.pop(name, None)
+            if doc is not None:
+                self.index.remove(doc)
+                self.entries[doc] = None
+        for entry in update.changed:
+            self._add(entry)
+        self._stack = [('', None)]
+
+    def filter(self, query):
+        """Return the entries whose lowercased name contains query"""
+        query = query.lower()
+        # Every name containing query also contains any substring of it
+        while self._stack[-1][0] not in query:
+            self._stack.pop()
+        last_query, docs = self._stack[-1]
+        if last_query != query:
+            docs = self.index.search(query, docs)
+            self._stack.append((query, docs))
+            del self._stack[1:-8]
+        if docs is None:
+            return [entry for entry in self.entries if entry is not None]
+        return [self.entries[doc] for doc in docs]
+
+class FolderUpdate:
+    """Entries of one folder that changed, stat-ed again after the change
+
+    changed holds a FileEntry for every entry that was added or modified,
+    removed the names of entries that are gone and subdirs the paths of
+    changed entries that are real (non-link) folders.
+    """
+    def __init__(self, path, mtime_ns, changed, removed, subdirs=()):
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.changed = changed
+        self.removed = removed
+        self.subdirs = list(subdirs)
+
+    @classmethod
+    def resolve(cls, path, names):
+        """Stat the named entries of path and sort them into changed and removed"""
+        mtime_ns = os.stat(path).st_mtime_ns
+        changed = []
+        removed = []
+        subdirs = []
+        for name in names:
+            full_path = os.path.join(path, name)
+            try:
+                entry = FileEntry.from_path(full_path)
+            except OSError:
+                removed.append(name)
+                continue
+            changed.append(entry)
+            if not entry.is_file and os.path.isdir(full_path) and not os.path.islink(full_path):
+                subdirs.append(full_path)
+        return cls(path, mtime_ns, changed, removed, subdirs)
+
+    @property
+    def names(self):
+        """Every entry name the update touches"""
+        return {entry.name for entry in self.changed} | set(self.removed)
+
+class FolderWatcher:
+    """Report which entries of one folder change, from a worker thread
+
+    On Linux the folder is watched with inotify. Elsewhere, or when inotify
+    is unavailable, it is polled: the listing is only compared again when
+    the folder's st_mtime_ns moved, and every few polls to catch files that
+    were edited in place. on_changes receives the set of entry names touched
+    by a burst of events, or None when events were lost and the folder has
+    to be reloaded as a whole.
+    """
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+                  IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+    LOST_MASK = IN_Q_OVERFLOW | IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED
+    EVENT = struct.Struct('iIII')
+
+    def __init__(self, path, since_mtime_ns=None, poll_interval=2.0, settle=0.1, full_poll_every=5):
+        self.path = path
+        self.since_mtime_ns = since_mtime_ns
+        self.poll_interval = poll_interval
+        self.settle = settle
+        self.full_poll_every = full_poll_every
+
+    def run(self, cancelled, on_changes):
+        """Watch until cancelled is set (blocks the calling thread)"""
+        fd = self._inotify_open(self.path)
+        if fd is None:
+            self._poll(cancelled, on_changes)
+            return
+        try:
+            self._check_since(os.stat(self.path).st_mtime_ns, on_changes)
+            self._watch(fd, cancelled, on_changes)
+        finally:
+            os.close(fd)
+
+    def _check_since(self, mtime_ns, on_changes):
+        # Changes made between the listing and the start of the watch would
+        # otherwise go unnoticed
+        if self.since_mtime_ns is not None and mtime_ns != self.since_mtime_ns:
+            on_changes(None)
+
+    @classmethod
+    def _inotify_open(cls, path):
+        """Return an inotify descriptor watching path, or None if unsupported"""
+        if not sys.platform.startswith('linux'):
+            return None
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        if libc.inotify_add_watch(fd, os.fsencode(path), cls.WATCH_MASK) < 0:
+            # Out of watches or unsupported file system: fall back to polling
+            os.close(fd)
+            return None
+        return fd
+
+    def _watch(self, fd, cancelled, on_changes):
+        pending = set()
+        lost = False
+        deadline = None
+        while not cancelled.is_set():
+            timeout = 0.5 if deadline is None else max(0.0, deadline - time.monotonic())
+            readable, _, _ = select.select([fd], [], [], timeout)
+            if readable:
+                try:
+                    data = os.read(fd, 65536)
+                except BlockingIOError:
+                    data = b''
+                for mask, name in self._parse(data):
+                    if mask & self.LOST_MASK:
+                        lost = True
+                    elif name:
+                        pending.add(name)
+                if deadline is None and (pending or lost):
+                    # Coalesce a burst of events into one report
+                    deadline = time.monotonic() + self.settle
+            elif deadline is not None and time.monotonic() >= deadline:
+                on_changes(None if lost else pending)
+                pending = set()
+                lost = False
+                deadline = None
+
+    @classmethod
+    def _parse(cls, data):
+        """Yield (mask, name) for the inotify events in a read buffer"""
+        offset = 0
+        while offset + cls.EVENT.size <= len(data):
+            _, mask, _, length = cls.EVENT.unpack_from(data, offset)
+            offset += cls.EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            yield mask, os.fsdecode(name)
+
+    def _poll(self, cancelled, on_changes):
+        try:
+            listing, mtime_ns = self._list()
+        except OSError:
+            on_changes(None)
+            return
+        self._check_since(mtime_ns, on_changes)
+        polls = 0
+        while not cancelled.wait(self.poll_interval):
+            polls += 1
+            try:
+                if os.stat(self.path).st_mtime_ns == mtime_ns and polls % self.full_poll_every:
+                    continue
+                current, mtime_ns = self._list()
+            except OSError:
+                on_changes(None)
+                return
+            changed = {name for name in listing.keys() | current.keys()
+                       if listing.get(name) != current.get(name)}
+            listing = current
+            if changed:
+                on_changes(changed)
+
+    def _list(self):
+        """Return ({name: (is_file, size, mtime_ns)}, folder mtime_ns)"""
+        mtime_ns = os.stat(self.path).st_mtime_ns
+        listing = {}
+        with os.scandir(self.path) as it:
+            for dir_entry in it:
+                entry = FileEntry.from_dir_entry(dir_entry)
+                listing[entry.name] = (entry.is_file, entry.size, entry.mtime_ns)
+        return listing, mtime_ns
+
+class BackgroundJob:
+    """Run work on a daemon thread and hand its messages to the Tk loop
+    
+    The target is called with the job and reports back through post(); the
+    messages are delivered to on_message on the main thread via after().
+    Messages posted after cancel() are dropped.
+    """
+    def __init__(self, widget, target, on_message, interval=20, budget=0.05):
+        self.widget = widget
+        self.target = target
+        self.on_message = on_message
+        self.interval = interval
+        self.budget = budget
+        self.messages = queue.Queue()
+        self.cancelled = threading.Event()
+        self.finished = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        """Start the worker thread and begin polling for messages"""
+        self.thread.start()
+        self.widget.after(self.interval, self._poll)
+        return self
+
+    def post(self, kind, payload=None):
+        """Queue a message for the main thread (safe to call from the worker)"""
+        self.messages.put((kind, payload))
+
+    def cancel(self):
+        """Ask the worker to stop and stop delivering its messages"""
+        self.cancelled.set()
+
+    @property
+    def is_cancelled(self):
+        return self.cancelled.is_set()
+
+    def _run(self):
+        try:
+            self.target(self)
+        except Exception as e:
+            self.post('error', e)
+        finally:
+            self.post('done')
+
+    def _poll(self):
+        # Deliver messages until the time budget is spent so a chatty worker
+        # cannot starve the event loop
+        deadline = time.perf_counter() + self.budget
+        while time.perf_counter() < deadline:
+            try:
+                kind, payload = self.messages.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'done':
+                self.finished = True
+            if self.is_cancelled:
+                if self.finished:
+                    return
+                continue
+            try:
+                self.on_message(kind, payload)
+            except tk.TclError:
+                # The receiving widget was destroyed
+                self.cancel()
+            if self.finished:
+                return
+        try:
+            self.widget.after(self.interval, self._poll)
+        except tk.TclError:
+            self.cancel()
+
+class VirtualFileList(ttk.Treeview):
+    """Treeview that only materializes the rows currently on screen
+
+    Rows live in an in-memory model and the Tk widget holds just the visible
+    window plus a small buffer, re-filled as the view scrolls. Model rows are
+    either value tuples or objects turned into values by row_values, so
+    formatting only happens for rows that are actually shown.
+
+    The methods the application uses from ttk.Treeview are mirrored on top of
+    the model. Item ids are row indexes, so they change when rows are inserted
+    or deleted above them. Selection, scrolling and keyboard navigation are
+    handled here; <<TreeviewSelect>> is only delivered for real selection
+    changes, not for rows being re-rendered.
+    """
+    def __init__(self, master=None, row_values=None, buffer=10, **kw):
+        self._yscrollcommand = kw.pop('yscrollcommand', None)
+        super().__init__(master, **kw)
+        self.row_values = row_values or (lambda row: row)
+        self.buffer = buffer
+        self._rows = []
+        self._row_tags = {}
+        self._selected = set()
+        self._anchor = None
+        self._focus = None
+        self._top = 0
+        self._rendered = range(0)
+        self._render_pending = False
+        self._notifying = False
+
+        # Our own bindtag runs before the widget and class bindings so it can
+        # take over input that would otherwise scroll the Tk widget natively
+        tag = f"VirtualFileList{id(self)}"
+        self.bindtags((tag,) + self.bindtags())
+        self.bind_class(tag, '<<TreeviewSelect>>', self._on_select_event)
+        self.bind_class(tag, '<Configure>', lambda e: self._schedule_render())
+        self.bind_class(tag, '<ButtonPress-1>', lambda e: self._on_click(e, 'set'))
+        self.bind_class(tag, '<Control-ButtonPress-1>', lambda e: self._on_click(e, 'toggle'))
+        self.bind_class(tag, '<Shift-ButtonPress-1>', lambda e: self._on_click(e, 'range'))
+        self.bind_class(tag, '<MouseWheel>', self._on_mousewheel)
+        self.bind_class(tag, '<Button-4>', lambda e: self._scroll_by(-3))
+        self.bind_class(tag, '<Button-5>', lambda e: self._scroll_by(3))
+        for key, step in (('Up', -1), ('Down', 1), ('Prior', 'page-'), ('Next', 'page+'),
+                          ('Home', 'home'), ('End', 'end')):
+            self.bind_class(tag, f'<{key}>', lambda e, s=step: self._on_key(s, False))
+            self.bind_class(tag, f'<Shift-{key}>', lambda e, s=step: self._on_key(s, True))
+
+    # ----- Treeview compatible API -----
+    def configure(self, cnf=None, **kw):
+        if 'yscrollcommand' in kw:
+            self._yscrollcommand = kw.pop('yscrollcommand')
+            self._update_scrollbar()
+            if cnf is None and not kw:
+                return None
+        return super().configure(cnf, **kw)
+
+    config = configure
+
+    def get_children(self, item=None):
+        return tuple(str(i) for i in range(len(self._rows)))
+
+    @property
+    def rows(self):
+        """The model rows in display order (do not modify)"""
+        return self._rows
+
+    def set_row(self, item, row):
+        """Replace the model row behind item, redrawing it if it is on screen"""
+        idx = int(item)
+        self._rows[idx] = row
+        if idx in self._rendered:
+            super().item(str(idx), values=self.row_values(row), tags=self._row_tags.get(idx, ()))
+
+    def insert(self, parent, index, iid=None, **kw):
+        row = tuple(kw.get('values', ()))
+        if index == tk.END or index == 'end' or int(index) >= len(self._rows):
+            idx = len(self._rows)
+            self._rows.append(row)
+        else:
+            idx = max(0, int(index))
+            self._rows.insert(idx, row)
+            self._remap(lambda i: i + 1 if i >= idx else i)
+        if kw.get('tags'):
+            self._row_tags[idx] = self._as_tags(kw['tags'])
+        self._schedule_render()
+        return str(idx)
+
+    def extend(self, rows):
+        """Append many model rows at once"""
+        self._rows.extend(rows)
+        self._schedule_render()
+
+    def clear(self):
+        """Remove every row"""
+        had_selection = bool(self._selected)
+        self._rows = []
+        self._row_tags = {}
+        self._selected = set()
+        self._anchor = self._focus = None
+        self._top = 0
+        self._schedule_render()
+        if had_selection:
+            self.after_idle(self._notify)
+
+    def delete(self, *items):
+        indexes = sorted({int(i) for i in items})
+        if not indexes:
+            return
+        if len(indexes) == len(self._rows):
+            self.clear()
+            return
+        had_selection = any(i in self._selected for i in indexes)
+        removed = set(indexes)
+        self._rows = [row for i, row in enumerate(self._rows) if i not in removed]
+        self._remap(lambda i: None if i in removed else i - bisect.bisect_left(indexes, i))
+        self._schedule_render()
+        if had_selection:
+            self.after_idle(self._notify)
+
+    def exists(self, item):
+        try:
+            return 0 <= int(item) < len(self._rows)
+        except (TypeError, ValueError):
+            return False
+
+    def index(self, item):
+        return int(item)
+
+    def item(self, item, option=None, **kw):
+        idx = int(item)
+        if kw:
+            if 'values' in kw:
+                self._rows[idx] = tuple(kw['values'])
+            if 'tags' in kw:
+                self._set_tags(idx, kw['tags'])
+            if idx in self._rendered:
+                super().item(str(idx), values=self.row_values(self._rows[idx]),
+                             tags=self._row_tags.get(idx, ()))
+            return None
+        info = {'text': '', 'image': '', 'open': 0,
+                'values': list(self.row_values(self._rows[idx])),
+                'tags': list(self._row_tags.get(idx, ()))}
+        return info[option] if option else info
+
+    def see(self, item):
+        idx = int(item)
+        page = self._page_size()
+        if idx < self._top:
+            self._top = idx
+        elif idx >= self._top + page:
+            self._top = idx - page + 1
+        self._render()
+
+    def focus(self, item=None):
+        if item is None:
+            return '' if self._focus is None else str(self._focus)
+        self._focus = int(item)
+        if self._focus in self._rendered:
+            super().focus(item)
+
+    def selection(self):
+        return tuple(str(i) for i in sorted(self._selected))
+
+    def selection_set(self, *items):
+        self._change_selection(set(self._flatten(items)))
+
+    def selection_add(self, *items):
+        self._change_selection(self._selected | set(self._flatten(items)))
+
+    def selection_remove(self, *items):
+        self._change_selection(self._selected - set(self._flatten(items)))
+
+    def selection_toggle(self, *items):
+        self._change_selection(self._selected ^ set(self._flatten(items)))
+
+    def tag_has(self, tagname, item=None):
+        if item is None:
+            return tuple(str(i) for i, tags in sorted(self._row_tags.items()) if tagname in tags)
+        return tagname in self._row_tags.get(int(item), ())
+
+    def yview(self, *args):
+        total = len(self._rows)
+        if not args:
+            return self._fractions()
+        page = self._page_size()
+        if args[0] == 'moveto':
+            self._top = int(float(args[1]) * total)
+        elif args[0] == 'scroll':
+            amount = int(args[1])
+            if str(args[2]).startswith('page'):
+                amount *= page
+            self._top += amount
+        self._render()
+
+    def yview_moveto(self, fraction):
+        self.yview('moveto', fraction)
+
+    def yview_scroll(self, number, what):
+        self.yview('scroll', number, what)
+
+    # ----- rendering -----
+    def _page_size(self):
+        """Number of rows that fit in the widget"""
+        height = self.winfo_height()
+        if height <= 1:
+            return int(self.cget('height') or 10)
+        try:
+            rowheight = int(ttk.Style().lookup(self.cget('style') or 'Treeview', 'rowheight') or 20)
+        except (ValueError, tk.TclError):
+            rowheight = 20
+        return max(1, (height - 25) // rowheight)
+
+    def _fractions(self):
+        total = len(self._rows)
+        if not total:
+            return (0.0, 1.0)
+        return (self._top / total, min(1.0, (self._top + self._page_size()) / total))
+
+    def _update_scrollbar(self):
+        if self._yscrollcommand:
+            self._yscrollcommand(*self._fractions())
+
+    def _schedule_render(self):
+        if not self._render_pending:
+            self._render_pending = True
+            self.after_idle(self._render)
+
+    def _render(self):
+        """Materialize the visible window of the model"""
+        self._render_pending = False
+        total = len(self._rows)
+        page = self._page_size()
+        self._top = max(0, min(self._top, total - page))
+        self._rendered = range(self._top, min(total, self._top + page + self.buffer))
+        super().delete(*super().get_children())
+        for i in self._rendered:
+            super().insert('', tk.END, iid=str(i), values=self.row_values(self._rows[i]),
+                           tags=self._row_tags.get(i, ()))
+        self._render_selection()
+        super().yview_moveto(0)
+        self._update_scrollbar()
+
+    def _render_selection(self):
+        super().selection_set([str(i) for i in self._rendered if i in self._selected])
+        if self._focus in self._rendered:
+            super().focus(str(self._focus))
+
+    # ----- input handling -----
+    def _notify(self):
+        """Deliver <<TreeviewSelect>> to the application bindings"""
+        self._notifying = True
+        try:
+            self.event_generate('<<TreeviewSelect>>')
+        finally:
+            self._notifying = False
+
+    def _on_select_event(self, event):
+        # Events raised by re-rendering the window are swallowed; real
+        # selection changes go through _notify
+        if not self._notifying:
+            return "break"
+
+    def _change_selection(self, selected, notify=True):
+        selected = {i for i in selected if 0 <= i < len(self._rows)}
+        changed = selected != self._selected
+        self._selected = selected
+        self._render_selection()
+        if changed and notify:
+            self.after_idle(self._notify)
+
+    def _on_click(self, event, mode):
+        if super().identify_region(event.x, event.y) not in ('cell', 'tree'):
+            return None
+        row = super().identify_row(event.y)
+        if not row:
+            return None
+        idx = int(row)
+        self.focus_set()
+        if str(self.cget('selectmode')) != 'extended':
+            mode = 'set'
+        if mode == 'toggle':
+            selected = self._selected ^ {idx}
+            self._anchor = idx
+        elif mode == 'range' and self._anchor is not None:
+            low, high = sorted((self._anchor, idx))
+            selected = set(range(low, high + 1))
+        else:
+            selected = {idx}
+            self._anchor = idx
+        self._focus = idx
+        self._selected = selected
+        self._render_selection()
+        self._notify()
+        return "break"
+
+    def _on_key(self, step, extend):
+        total = len(self._rows)
+        if not total:
+            return "break"
+        current = self._focus if self._focus is not None else self._top
+        page = self._page_size()
+        if step == 'home':
+            idx = 0
+        elif step == 'end':
+            idx = total - 1
+        elif step == 'page-':
+            idx = current - page
+        elif step == 'page+':
+            idx = current + page
+        else:
+            idx = current + step
+        idx = max(0, min(total - 1, idx))
+        if extend and self._anchor is not None and str(self.cget('selectmode')) == 'extended':
+            low, high = sorted((self._anchor, idx))
+            self._selected = set(range(low, high + 1))
+        else:
+            self._selected = {idx}
+            self._anchor = idx
+        self._focus = idx
+        self.see(str(idx))
+        self._notify()
+        return "break"
+
+    def _on_mousewheel(self, event):
+        if event.delta:
+            step = -event.delta // 120 if abs(event.delta) >= 120 else -event.delta
+            self._scroll_by(step * 3)
+        return "break"
+
+    def _scroll_by(self, rows):
+        self._top += rows
+        self._render()
+        return "break"
+
+    # ----- model bookkeeping -----
+    def _remap(self, mapping):
+        """Move selection and row tags after rows were inserted or removed"""
+        self._selected = {j for j in map(mapping, self._selected) if j is not None}
+        self._row_tags = {mapping(i): tags for i, tags in self._row_tags.items()
+                          if mapping(i) is not None}
+        if self._anchor is not None:
+            self._anchor = mapping(self._anchor)
+        if self._focus is not None:
+            self._focus = mapping(self._focus)
+
+    def _set_tags(self, idx, tags):
+        tags = self._as_tags(tags)
+        if tags:
+            self._row_tags[idx] = tags
+        else:
+            self._row_tags.pop(idx, None)
+
+    @staticmethod
+    def _as_tags(tags):
+        return (tags,) if isinstance(tags, str) else tuple(tags)
+
+    @staticmethod
+    def _flatten(items):
+        result = []
+        for item in items:
+            if isinstance(item, (list, tuple)):
+                result.extend(int(i) for i in item)
+            else:
+                result.extend(int(i) for i in str(item).split())
+        return result
+
+class HashCache:
+    """Persistent content-hash cache keyed by (device, inode, size, mtime_ns)
+
+    Entries live in a local SQLite database in WAL mode. Writes are buffered
+    and committed in batches; the connection is shared by the hashing threads
+    behind a lock.
+    """
+    TABLE = 'file_hashes'
+
+    def __init__(self, db_path=DATABASE_FILE, batch_size=500):
+        self.batch_size = batch_size
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(f'''CREATE TABLE IF NOT EXISTS {self.TABLE} (
+                                 dev INTEGER, ino INTEGER, size INTEGER, mtime_ns INTEGER,
+                                 kind TEXT, digest BLOB,
+                                 PRIMARY KEY (dev, ino, size, mtime_ns, kind)
+                             ) WITHOUT ROWID''')
+        self.conn.commit()
+
+    @staticmethod
+    def key_for(path):
+        """Cache key for the file's current identity and version"""
+        st = os.stat(path)
+        return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def get(self, key, kind):
+        """Return the cached digest or None"""
+        with self._lock:
+            digest = self._pending.get(key + (kind,))
+            if digest is not None:
+                return digest
+            row = self.conn.execute(f'SELECT digest FROM {self.TABLE} WHERE dev=? AND ino=? AND size=? '
+                                    'AND mtime_ns=? AND kind=?', key + (kind,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key, kind, digest):
+        """Remember a digest; written out with the next batch"""
+        with self._lock:
+            self._pending[key + (kind,)] = digest
+            if len(self._pending) >= self.batch_size:
+                self._flush_locked()
+
+    def flush(self):
+        """Write all buffered digests in one transaction"""
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._pending:
+            return
+        with self.conn:
+            self.conn.executemany(f'INSERT OR REPLACE INTO {self.TABLE} VALUES (?, ?, ?, ?, ?, ?)',
+                                  [key + (digest,) for key, digest in self._pending.items()])
+        self._pending.clear()
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+class MetadataCache(HashCache):
+    """Persistent cache of metadata read from inside files, such as photo dates
+
+    Values are keyed like HashCache entries, so a file is read again only
+    after it changed. Files without the value are cached too (as ''), so
+    they are not opened again either.
+    """
+    TABLE = 'file_metadata'
+    EXIF_EXTENSIONS = {'.jpg', '.jpeg', '.tif', '.tiff', '.png', '.webp'}
+    # EXIF tags: the Exif sub-IFD, DateTimeOriginal inside it, and DateTime
+    EXIF_IFD, DATE_TAKEN, DATE_TIME = 0x8769, 36867, 306
+
+    @classmethod
+    def read_exif_date(cls, path):
+        """Timestamp of when a photo was taken, from its EXIF data, or None"""
+        try:
+            with Image.open(path) as img:
+                exif = img.getexif()
+                value = exif.get_ifd(cls.EXIF_IFD).get(cls.DATE_TAKEN) or exif.get(cls.DATE_TIME)
+            return time.mktime(time.strptime(str(value).strip('\0 ')[:19], '%Y:%m:%d %H:%M:%S'))
+        except Exception:
+            # No EXIF data, an unreadable file or a malformed date
+            return None
+
+    def exif_dates(self, entries, workers=8, cancelled=None, progress=None):
+        """Map the paths of photo entries to when they were taken (None if unknown)
+
+        Entries are FileEntry objects; uncached files are read on a thread
+        pool. progress, if given, is a dict updated with 'done' and 'total'.
+        """
+        dates = {}
+        missing = []
+        for entry in entries:
+            if entry.ext not in self.EXIF_EXTENSIONS:
+                continue
+            key = (entry.dev, entry.ino, entry.size, entry.mtime_ns)
+            value = self.get(key, 'exif_date') if entry.ino else None
+            if value is None:
+                missing.append((key, entry))
+            else:
+                dates[entry.path] = value if value != '' else None
+        if progress is not None:
+            progress.update(done=0, total=len(missing))
+        with ThreadPoolExecutor(max(1, int(workers))) as pool:
+            for (key, entry), value in zip(missing, pool.map(
+                    lambda item: self.read_exif_date(item[1].path), missing)):
+                if cancelled is not None and cancelled.is_set():
+                    pool.shutdown(cancel_futures=True)
+                    raise OperationCancelled()
+                dates[entry.path] = value
+                if entry.ino:
+                    self.put(key, 'exif_date', '' if value is None else value)
+                if progress is not None:
+                    progress['done'] += 1
+        self.flush()
+        return dates
+
+class AccessHistory:
+    """Persistent record of when files were last opened from the app
+
+    Keyed by full path in the local SQLite database, so a whole tree can be
+    read back with one range query on the primary key.
+    """
+    def __init__(self, db_path=DATABASE_FILE):
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS file_access (
+                                 path TEXT PRIMARY KEY, opened REAL, count INTEGER
+                             ) WITHOUT ROWID''')
+        self.conn.commit()
+
+    def record(self, path, when=None):
+        """Remember that path was opened now (or at when)"""
+        when = time.time() if when is None else when
+        with self._lock, self.conn:
+            self.conn.execute('INSERT INTO file_access VALUES (?, ?, 1) ON CONFLICT(path) '
+                              'DO UPDATE SET opened=excluded.opened, count=count+1',
+                              (os.path.abspath(path), when))
+
+    def forget(self, paths):
+        """Drop the history of files that were deleted or moved away"""
+        with self._lock, self.conn:
+            self.conn.executemany('DELETE FROM file_access WHERE path=?',
+                                  [(os.path.abspath(path),) for path in paths])
+
+    def below(self, folder):
+        """Map the path of every recorded file below folder to when it was opened"""
+        prefix = os.path.join(os.path.abspath(folder), '')
+        # Every path below the folder sorts between the prefix and the prefix
+        # with its trailing separator bumped to the next character
+        end = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        with self._lock:
+            rows = self.conn.execute('SELECT path, opened FROM file_access WHERE path >= ? AND path < ?',
+                                     (prefix, end)).fetchall()
+        return dict(rows)
+
+    def close(self):
+        self.conn.close()
+
+class FileIndex:
+    """Persistent metadata index of folder trees, searchable by name
+
+    File metadata is stored in SQLite with an FTS5 table over file names
+    (trigram tokens where available, so any substring can be matched).
+    The index is an IncrementalWalker store: every indexed folder records
+    its st_mtime_ns, so refresh() only re-reads folders whose mtime changed
+    and drops folders that disappeared, while apply() patches single rows
+    from a FolderUpdate. The crawler writes through its own connection
+    while searches read through others, so queries stay fast during a
+    refresh. Updates that arrive while a refresh runs are queued and
+    applied once it finished. A root only counts as indexed once a refresh
+    of it completed.
+    """
+    def __init__(self, db_path=DATABASE_FILE, commit_every=200):
+        self.db_path = db_path
+        self.commit_every = commit_every
+        self._pending_folders = 0
+        self._on_files = None
+        self._queued = deque()
+        self._write_lock = threading.Lock()
+        self._db_lock = threading.RLock()
+        self.writer = sqlite3.connect(db_path, check_same_thread=False)
+        self.writer.execute('PRAGMA journal_mode=WAL')
+        self.writer.execute('PRAGMA synchronous=NORMAL')
+        self.writer.executescript('''
+            CREATE TABLE IF NOT EXISTS indexed_files (
+                id INTEGER PRIMARY KEY, path TEXT UNIQUE, parent TEXT, name TEXT,
+                ext TEXT, category TEXT, size INTEGER, mtime REAL, atime REAL);
+            CREATE INDEX IF NOT EXISTS indexed_files_parent ON indexed_files(parent);
+            CREATE TABLE IF NOT EXISTS indexed_dirs (
+                path TEXT PRIMARY KEY, parent TEXT, mtime_ns INTEGER);
+            CREATE INDEX IF NOT EXISTS indexed_dirs_parent ON indexed_dirs(parent);
+            CREATE TABLE IF NOT EXISTS indexed_roots (path TEXT PRIMARY KEY, refreshed REAL);
+        ''')
+        try:
+            self._create_fts('trigram')
+            self.substring_tokens = True
+        except sqlite3.OperationalError:
+            # SQLite older than 3.34 has no trigram tokenizer
+            self._create_fts('unicode61')
+            self.substring_tokens = False
+        self.writer.commit()
+        # Shared by the UI and worker threads, one statement at a time
+        self.reader = sqlite3.connect(db_path, check_same_thread=False)
+        self._read_lock = threading.Lock()
+
+    def _create_fts(self, tokenizer):
+        self.writer.executescript(f'''
+            CREATE VIRTUAL TABLE IF NOT EXISTS indexed_names USING fts5(
+                name, content='indexed_files', content_rowid='id', tokenize='{tokenizer}');
+            CREATE TRIGGER IF NOT EXISTS indexed_files_ai AFTER INSERT ON indexed_files BEGIN
+                INSERT INTO indexed_names(rowid, name) VALUES (new.id, new.name);
+            END;
+            CREATE TRIGGER IF NOT EXISTS indexed_files_ad AFTER DELETE ON indexed_files BEGIN
+                INSERT INTO indexed_names(indexed_names, rowid, name) VALUES ('delete', old.id, old.name);
+            END;
+        ''')
+
+    def is_indexed(self, root):
+        """Whether root lies in a tree that was crawled completely before"""
+        root = os.path.abspath(root)
+        with self._read_lock:
+            roots = self.reader.execute('SELECT path FROM indexed_roots').fetchall()
+        for (path,) in roots:
+            if root == path or root.startswith(os.path.join(path, '')):
+                return True
+        return False
+
+    def refresh(self, root, cancelled=None, progress=None, on_files=None, workers=None,
+                rules=None):
+        """Bring the index of root up to date, re-reading only changed folders
+
+        on_files, if given, is called with (folder, files) for every folder
+        of the tree as the walk reaches it, whether it was read from disk or
+        taken from the index.
+        """
+        root = os.path.abspath(root)
+        try:
+            with self._write_lock:
+                self._pending_folders = 0
+                self._on_files = on_files
+                walker = IncrementalWalker(self, self._report_indexed if on_files else None,
+                                           workers, rules)
+                try:
+                    result = walker.refresh(root, cancelled, progress)
+                    self.writer.execute('INSERT OR REPLACE INTO indexed_roots VALUES (?, ?)',
+                                        (root, time.time()))
+                    return result
+                finally:
+                    self._on_files = None
+                    self.writer.commit()
+        finally:
+            self._apply_queued()
+
+    # ----- IncrementalWalker store -----
+    # Walker threads read through get_folder while the refreshing thread
+    # writes, so every use of the writer connection below takes _db_lock
+    def get_folder(self, path):
+        with self._db_lock:
+            db = self.writer
+            known = db.execute('SELECT mtime_ns FROM indexed_dirs WHERE path=?', (path,)).fetchone()
+            if known is None:
+                return None
+            subdirs = [row[0] for row in db.execute('SELECT path FROM indexed_dirs WHERE parent=?',
+                                                    (path,))]
+        return known[0], subdirs
+
+    def apply(self, update):
+        """Patch an indexed folder with a FolderUpdate, one row per entry
+
+        Never waits for a running refresh; the update is queued instead and
+        applied by whichever thread holds the index next.
+        """
+        self._queued.append(update)
+        self._apply_queued()
+
+    def _apply_queued(self):
+        while self._queued:
+            if not self._write_lock.acquire(blocking=False):
+                # The holder applies the queue when it releases the lock
+                return
+            try:
+                while self._queued:
+                    self._apply(self._queued.popleft())
+            finally:
+                self._write_lock.release()
+
+    def _apply(self, update):
+        db = self.writer
+        if db.execute('SELECT 1 FROM indexed_dirs WHERE path=?', (update.path,)).fetchone() is None:
+            return
+        db.executemany('DELETE FROM indexed_files WHERE path=?',
+                       [(os.path.join(update.path, name),) for name in update.names])
+        for name in update.removed:
+            self.forget_tree(os.path.join(update.path, name))
+        self._insert_files(update.path, [entry for entry in update.changed if entry.is_file])
+        db.executemany('INSERT OR IGNORE INTO indexed_dirs VALUES (?, ?, 0)',
+                       [(subdir, update.path) for subdir in update.subdirs])
+        db.execute('UPDATE indexed_dirs SET mtime_ns=? WHERE path=?', (update.mtime_ns, update.path))
+        db.commit()
+
+    def put_folder(self, path, mtime_ns, files, subdirs):
+        with self._db_lock:
+            db = self.writer
+            db.execute('DELETE FROM indexed_files WHERE parent=?', (path,))
+            self._insert_files(path, files)
+            db.execute('INSERT OR REPLACE INTO indexed_dirs VALUES (?, ?, ?)',
+                       (path, os.path.dirname(path), mtime_ns))
+            # Subfolders are recorded right away (mtime 0 until crawled) so a
+            # refresh that was interrupted resumes below this folder
+            db.executemany('INSERT OR IGNORE INTO indexed_dirs VALUES (?, ?, 0)',
+                           [(subdir, path) for subdir in subdirs])
+            self._pending_folders += 1
+            if self._pending_folders % self.commit_every == 0:
+                db.commit()
+        if self._on_files:
+            self._on_files(path, files)
+
+    def _report_indexed(self, folder):
+        """Hand the indexed files of an unchanged folder to the on_files callback"""
+        with self._db_lock:
+            rows = self.writer.execute('SELECT path, name, size, mtime, atime FROM indexed_files '
+                                       'WHERE parent=?', (folder,)).fetchall()
+        self._on_files(folder, [FileEntry(name, path, True, size, mtime, atime=atime)
+                                for path, name, size, mtime, atime in rows])
+
+    def _insert_files(self, parent, files):
+        self.writer.executemany('INSERT OR REPLACE INTO indexed_files (path, parent, name, ext, '
+                                'category, size, mtime, atime) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                [(entry.path, parent, entry.name, entry.ext, entry.category,
+                                  entry.size, entry.mtime, entry.atime) for entry in files])
+
+    def forget_tree(self, path):
+        """Drop a folder and everything below it from the index"""
+        low, high = self._prefix_range(path)
+        with self._db_lock:
+            for table in ('indexed_dirs', 'indexed_roots'):
+                self.writer.execute(f'DELETE FROM {table} WHERE path=? OR (path >= ? AND path < ?)',
+                                    (path, low, high))
+            self.writer.execute('DELETE FROM indexed_files WHERE parent=? OR (path >= ? AND path < ?)',
+                                (path, low, high))
+
+    @staticmethod
+    def _prefix_range(folder):
+        """Bounds of every path strictly below folder, for range queries"""
+        low = os.path.join(folder, '')
+        return low, low[:-1] + chr(ord(low[-1]) + 1)
+
+    @staticmethod
+    def entry_matcher(name=None, category=None, min_size=None, max_size=None):
+        """Return a predicate applying the criteria of search() to a FileEntry"""
+        name_match = TrigramIndex.matcher(name.lower()) if name else None
+
+        def match(entry):
+            return ((name_match is None or name_match(entry.name.lower())) and
+                    (not category or entry.category == category) and
+                    (min_size is None or entry.size >= min_size) and
+                    (max_size is None or entry.size <= max_size))
+        return match
+
+    def count(self, root):
+        """Number of indexed files below root"""
+        low, high = self._prefix_range(os.path.abspath(root))
+        with self._read_lock:
+            return self.reader.execute('SELECT COUNT(*) FROM indexed_files WHERE path >= ? AND path < ?',
+                                       (low, high)).fetchone()[0]
+
+    def search(self, root, name=None, category=None, min_size=None, max_size=None, limit=None):
+        """Return [(path, name, size, category)] for indexed files below root"""
+        return list(self.iter_search(root, name, category, min_size, max_size, limit))
+
+    def iter_search(self, root, name=None, category=None, min_size=None, max_size=None,
+                    limit=None, batch_size=500):
+        """Yield (path, name, size, category) for indexed files below root
+
+        name matches anywhere in the file name and may use * and ? wildcards.
+        Rows are fetched in batches through a connection of their own, so
+        the generator can be consumed from a worker thread.
+        """
+        low, high = self._prefix_range(os.path.abspath(root))
+        clauses = ['f.path >= ? AND f.path < ?']
+        params = [low, high]
+        join = ''
+        if name:
+            # Literal runs of a wildcard pattern narrow the rows through the
+            # trigram postings; LIKE then checks the pattern as a whole
+            wildcard = '*' in name or '?' in name
+            fragments = [f for f in re.split(r'[*?]', name) if len(f) >= 3]
+            if self.substring_tokens and fragments:
+                join = 'JOIN indexed_names n ON n.rowid = f.id'
+                clauses.append('indexed_names MATCH ?')
+                params.append(' AND '.join('"' + f.replace('"', '""') + '"' for f in fragments))
+            if wildcard or not (self.substring_tokens and fragments):
+                pattern = re.sub(r'([%_\\])', r'\\\1', name).replace('*', '%').replace('?', '_')
+                clauses.append("f.name LIKE ? ESCAPE '\\'")
+                params.append('%' + pattern + '%')
+        if category:
+            clauses.append('f.category = ?')
+            params.append(category)
+        if min_size is not None:
+            clauses.append('f.size >= ?')
+            params.append(min_size)
+        if max_size is not None:
+            clauses.append('f.size <= ?')
+            params.append(max_size)
+        sql = (f'SELECT f.path, f.name, f.size, f.category FROM indexed_files f {join} '
+               f'WHERE {" AND ".join(clauses)}')
+        if limit:
+            sql += f' LIMIT {int(limit)}'
+        db = sqlite3.connect(self.db_path)
+        try:
+            cursor = db.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            db.close()
+
+    def close(self):
+        with self._read_lock:
+            self.reader.close()
+        self.writer.close()
+
+class DuplicateGroup:
+    """Files with identical content
+
+    copies holds one list of paths per distinct inode, so hardlinks that
+    already share their data are listed together and count once.
+    """
+    def __init__(self, size, copies, signatures=None):
+        self.size = size
+        self.copies = copies
+        self.signatures = signatures or {}
+
+    @property
+    def paths(self):
+        return [path for copy in self.copies for path in copy]
+
+    @property
+    def reclaimable(self):
+        """Bytes freed by keeping a single copy of the data"""
+        return self.size * (len(self.copies) - 1)
+
+    def discard(self, path):
+        """Forget a path that was deleted; a copy without paths left goes too"""
+        self.copies = [[p for p in copy if p != path] for copy in self.copies]
+        self.copies = [copy for copy in self.copies if copy]
+        self.signatures.pop(path, None)
+
+    def reclaim(self, mode='auto'):
+        """Replace every copy but the first with a link to it
+
+        mode is 'hardlink', 'reflink' or 'auto' (reflink where the filesystem
+        supports it, hardlink otherwise). Files that changed since the scan
+        are left alone. Returns the number of bytes freed.
+        """
+        original = self.copies[0][0]
+        self._check_unchanged(original)
+        freed = 0
+        for copy in self.copies[1:]:
+            for path in copy:
+                self._check_unchanged(path)
+                LinkReclaimer.replace_with_link(original, path, mode)
+            freed += self.size
+        return freed
+
+    def _check_unchanged(self, path):
+        expected = self.signatures.get(path)
+        if expected is None:
+            return
+        st = os.stat(path)
+        if (st.st_size, st.st_mtime_ns) != expected:
+            raise OSError(f"'{path}' changed since it was scanned")
+
+class LinkReclaimer:
+    """Replace duplicate files with hardlinks or reflinks to one original"""
+    # ioctl request that clones a file's extents on Linux (btrfs, XFS, ...)
+    FICLONE = 0x40049409
+
+    @staticmethod
+    def clone_file(source, target):
+        """Create target as a reflink (copy-on-write clone) of source"""
+        if fcntl is None:
+            raise OSError(errno.EOPNOTSUPP, "Reflinks are not supported on this system")
+        with open(source, 'rb') as src, open(target, 'xb') as dst:
+            fcntl.ioctl(dst.fileno(), LinkReclaimer.FICLONE, src.fileno())
+
+    @staticmethod
+    def replace_with_link(source, target, mode='auto'):
+        """Atomically replace target with a link to source; returns the kind used"""
+        temp = os.path.join(os.path.dirname(target),
+                            f".{os.path.basename(target)}.smartarrange-tmp")
+        if mode in ('reflink', 'auto'):
+            try:
+                LinkReclaimer.clone_file(source, temp)
+                shutil.copystat(target, temp)
+                os.replace(temp, target)
+                return 'reflink'
+            except OSError:
+                if os.path.exists(temp):
+                    os.remove(temp)
+                if mode == 'reflink':
+                    raise
+        os.link(source, temp)
+        try:
+            os.replace(temp, target)
+        except OSError:
+            os.remove(temp)
+            raise
+        return 'hardlink'
+
+class StaleFileScan:
+    """Recursive search for files that were not used since a cutoff
+
+    clock picks the time that counts as the last use: 'mtime', 'atime',
+    'ctime', or 'opened' for the AccessHistory of the app (newer of that and
+    mtime, since a file written by another program is in use too). The
+    times come from the scandir stats of the walk, so no file is stat-ed
+    twice. The same pass counts every file and its bytes into AGE_BUCKETS.
+    """
+    CLOCKS = {'mtime': 'Modified', 'atime': 'Accessed', 'ctime': 'Changed',
+              'opened': 'Opened in this app'}
+    # (upper bound in days, label); the last bucket is open ended
+    AGE_BUCKETS = ((7, '< 1 week'), (30, '1-4 weeks'), (91, '1-3 months'), (182, '3-6 months'),
+                   (365, '6-12 months'), (730, '1-2 years'), (1826, '2-5 years'),
+                   (None, '> 5 years'))
+
+    def __init__(self, days, clock='mtime', opened=None, now=None):
+        if clock not in self.CLOCKS:
+            raise ValueError(f"Unknown clock {clock!r}")
+        self.now = time.time() if now is None else now
+        self.cutoff = self.now - days * 86400
+        self.clock = clock
+        self.opened = opened or {}
+        self._edges = np.array([days for days, _ in self.AGE_BUCKETS[:-1]], dtype=np.float64) * 86400
+        self.counts = np.zeros(len(self.AGE_BUCKETS), dtype=np.int64)
+        self.sizes = np.zeros(len(self.AGE_BUCKETS), dtype=np.int64)
+        self.files_seen = 0
+        self.stale_count = 0
+        self.stale_size = 0
+
+    def last_used(self, entry):
+        """The time entry counts as last used"""
+        if self.clock == 'opened':
+            return max(self.opened.get(entry.path, 0.0), entry.mtime)
+        return getattr(entry, self.clock)
+
+    def add(self, entries):
+        """Count FileEntry objects into the histogram; return the stale ones
+
+        The result is a list of (entry, last used) pairs.
+        """
+        if not entries:
+            return []
+        n = len(entries)
+        if self.clock == 'opened':
+            used = np.fromiter(map(self.last_used, entries), dtype=np.float64, count=n)
+        else:
+            used = np.fromiter(map(operator.attrgetter(self.clock), entries), dtype=np.float64, count=n)
+        sizes = np.fromiter(map(operator.attrgetter('size'), entries), dtype=np.int64, count=n)
+        buckets = np.searchsorted(self._edges, self.now - used, side='right')
+        self.counts += np.bincount(buckets, minlength=len(self.counts))
+        self.sizes += np.bincount(buckets, weights=sizes, minlength=len(self.sizes)).astype(np.int64)
+        self.files_seen += n
+        stale = np.flatnonzero(used < self.cutoff)
+        self.stale_count += len(stale)
+        self.stale_size += int(sizes[stale].sum())
+        return [(entries[i], t) for i, t in zip(stale.tolist(), used[stale].tolist())]
+
+    def scan(self, roots, recursive=True, cancelled=None, workers=None, rules=None, batch_size=2000):
+        """Walk the roots and yield the stale files in batches as they are found
+
+        A batch may be empty; the histogram is up to date after each one.
+        """
+        # Absolute paths, to match the keys of the access history
+        roots = [os.path.abspath(root) for root in roots]
+        batch = []
+        for entry in TreeWalker.iter_files(roots, recursive, cancelled, workers, rules, ordered=False):
+            batch.append(entry)
+            if len(batch) >= batch_size:
+                yield self.add(batch)
+                batch = []
+        yield self.add(batch)
+
+class TransferEngine:
+    """Copy or move files between file systems as fast as the devices allow
+
+    Data is copied inside the kernel with os.copy_file_range where it can
+    be (which also lets file systems clone or copy server-side), then with
+    os.sendfile, and only as a last resort through a large user-space
+    buffer. Small files are copied on a thread pool so that their open,
+    create and close round trips overlap; large files go through a smaller
+    pool of their own in big chunks, so they stream sequentially instead of
+    fighting over the disk head. Each copy is written under a temporary name,
+    compared with its source when verify is set, and only then renamed into
+    place; a move deletes the source after that.
+
+    progress, if given, is a dict updated with 'files_done', 'files_total',
+    'bytes_done', 'bytes_total' and 'started' (a time.monotonic() value);
+    it can be read from another thread, see throughput().
+    """
+    CHUNK_SIZE = 8 * 1024 * 1024
+    LARGE_FILE = 16 * 1024 * 1024
+    # Errors meaning a kernel copy path is not available for these two files
+    UNSUPPORTED = {errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP,
+                   errno.EBADF, errno.ENOTSUP}
+
+    def __init__(self, workers=8, large_workers=2, verify=True, cancelled=None, walk_workers=None,
+                 rules=None):
+        self.workers = max(1, int(workers))
+        self.large_workers = max(1, int(large_workers))
+        self.verify = verify
+        self.cancelled = cancelled
+        self.walk_workers = walk_workers
+        self.rules = rules
+        self._lock = threading.Lock()
+        self._progress = {}
+
+    @staticmethod
+    def throughput(progress):
+        """Bytes per second copied so far"""
+        elapsed = time.monotonic() - progress.get('started', time.monotonic())
+        return progress.get('bytes_done', 0) / elapsed if elapsed > 0 else 0.0
+
+    @staticmethod
+    def is_copy(source, target):
+        """Whether target looks like a finished copy of source on another device
+
+        Copies keep their source's size and modification time, which lets an
+        interrupted move tell a copy whose source was not yet deleted apart
+        from an unrelated file of the same name.
+        """
+        try:
+            a, b = os.stat(source), os.stat(target)
+        except OSError:
+            return False
+        return (a.st_dev != b.st_dev and a.st_size == b.st_size
+                and a.st_mtime_ns == b.st_mtime_ns)
+
+    def is_verified_copy(self, source, target):
+        """Whether target is a copy of the file source on another device, byte for byte
+
+        is_copy only compares metadata, which an unrelated file can share;
+        this also compares the contents before anyone deletes source.
+        """
+        return (self.is_copy(source, target) and os.path.isfile(source) and not os.path.islink(source)
+                and self._same_data(source, target))
+
+    def transfer(self, pairs, move=False, progress=None):
+        """Copy or move (source, target) pairs; returns {source: OSError} for failures
+
+        A source may be a folder. A move within one file system renames it
+        as a whole; otherwise everything below it that rules (IgnoreRules)
+        do not exclude is transferred, empty subfolders and symbolic links
+        included, and a move leaves the ignored entries and the folders
+        holding them in place. Targets must not exist yet. Anything that
+        could not be read or transferred is reported in the result.
+        """
+        self._progress = progress if progress is not None else {}
+        self._progress.setdefault('started', time.monotonic())
+        for key in ('files_done', 'files_total', 'bytes_done', 'bytes_total'):
+            self._progress.setdefault(key, 0)
+        errors = {}
+        jobs = []
+        moved_folders = []
+        for source, target in pairs:
+            try:
+                if os.path.lexists(target):
+                    raise FileExistsError(errno.EEXIST, "Target already exists", target)
+                if move and self._rename(source, target):
+                    self._add(files_total=1, files_done=1)
+                    continue
+                if os.path.islink(source):
+                    self._copy_link(source, target, move)
+                elif os.path.isdir(source):
+                    folders = self._expand(source, target, move, jobs, errors)
+                    if move:
+                        moved_folders.extend(folders)
+                else:
+                    jobs.append((source, target, os.stat(source).st_size))
+            except OSError as e:
+                errors[source] = e
+        self._add(files_total=len(jobs), bytes_total=sum(size for _, _, size in jobs))
+
+        with ThreadPoolExecutor(self.workers) as small_pool, \
+                ThreadPoolExecutor(self.large_workers) as large_pool:
+            futures = {}
+            # Largest first, so the long copies are not left running alone at the end
+            for source, target, size in sorted(jobs, key=lambda job: -job[2]):
+                pool = large_pool if size >= self.LARGE_FILE else small_pool
+                futures[pool.submit(self.transfer_file, source, target, move)] = source
+            try:
+                pending = set(futures)
+                while pending:
+                    done, pending = wait(pending, timeout=0.25, return_when=FIRST_COMPLETED)
+                    self._check_cancelled()
+                    for future in done:
+                        try:
+                            future.result()
+                        except OSError as e:
+                            errors[futures[future]] = e
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+
+        self._remove_empty(moved_folders)
+        return errors
+
+    def _expand(self, source, target, move, jobs, errors):
+        """Recreate the tree of folder source at target and queue its files
+
+        Subfolders, empty ones too, are created and symbolic links copied as
+        links right away; regular files are appended to jobs. Folders that
+        cannot be read and entries that cannot be transferred (such as
+        devices or pipes) go into errors. Returns the folders walked,
+        parents first.
+        """
+        def on_error(e):
+            errors[e.filename or source] = e
+
+        os.makedirs(target)
+        folders = []
+        for folder, subdirs, files, links, others in TreeWalker.walk_tree(
+                source, self.cancelled, self.walk_workers, self.rules, on_error):
+            folders.append(folder)
+            dest = os.path.join(target, os.path.relpath(folder, source))
+            for path in subdirs:
+                try:
+                    os.mkdir(os.path.join(dest, os.path.basename(path)))
+                except OSError as e:
+                    errors[path] = e
+            for path in links:
+                try:
+                    self._copy_link(path, os.path.join(dest, os.path.basename(path)), move)
+                except OSError as e:
+                    errors[path] = e
+            for path in others:
+                errors[path] = OSError(errno.EINVAL, "Not a regular file", path)
+            jobs.extend((entry.path, os.path.join(dest, entry.name), entry.size) for entry in files)
+        return folders
+
+    @staticmethod
+    def _copy_link(source, target, move=False):
+        """Recreate the symbolic link source at target (the link, not what it points to)"""
+        os.symlink(os.readlink(source), target, target_is_directory=os.path.isdir(source))
+        if move:
+            os.remove(source)
+
+    def transfer_file(self, source, target, move=False):
+        """Copy or move a single file, verifying the copy before the source goes"""
+        self._check_cancelled()
+        folder = os.path.dirname(target)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        if move and self._rename(source, target):
+            self._add(files_done=1, bytes_done=os.stat(target).st_size)
+            return
+        self.copy_file(source, target)
+        if move:
+            os.remove(source)
+        self._add(files_done=1)
+
+    def copy_file(self, source, target):
+        """Copy source to target with its metadata; target must not exist"""
+        temp = os.path.join(os.path.dirname(target), f".{os.path.basename(target)}.smartarrange-tmp")
+        try:
+            with open(source, 'rb', buffering=0) as src, open(temp, 'xb', buffering=0) as dst:
+                self._copy_data(src.fileno(), dst.fileno())
+            shutil.copystat(source, temp)
+            if self.verify and not self._same_data(source, temp):
+                raise OSError(errno.EIO, "Copy does not match its source", source)
+            if os.path.lexists(target):
+                raise FileExistsError(errno.EEXIST, "Target already exists", target)
+            os.replace(temp, target)
+        except BaseException:
+            if os.path.lexists(temp):
+                os.remove(temp)
+            raise
+
+    def _copy_data(self, in_fd, out_fd):
+        copied = 0
+        if hasattr(os, 'copy_file_range'):
+            try:
+                while True:
+                    n = os.copy_file_range(in_fd, out_fd, self.CHUNK_SIZE)
+                    if not n:
+                        return
+                    copied += n
+                    self._add(bytes_done=n)
+                    self._check_cancelled()
+            except OSError as e:
+                # Only fall back before anything was written
+                if copied or e.errno not in self.UNSUPPORTED:
+                    raise
+        if hasattr(os, 'sendfile') and sys.platform.startswith('linux'):
+            try:
+                while True:
+                    n = os.sendfile(out_fd, in_fd, None, self.CHUNK_SIZE)
+                    if not n:
+                        return
+                    copied += n
+                    self._add(bytes_done=n)
+                    self._check_cancelled()
+            except OSError as e:
+                if copied or e.errno not in self.UNSUPPORTED:
+                    raise
+        buf = bytearray(self.CHUNK_SIZE)
+        view = memoryview(buf)
+        while True:
+            n = os.readv(in_fd, [buf])
+            if not n:
+                return
+            written = 0
+            while written < n:
+                written += os.write(out_fd, view[written:n])
+            self._add(bytes_done=n)
+            self._check_cancelled()
+
+    def _same_data(self, a, b):
+        """Compare two files chunk by chunk"""
+        if os.path.getsize(a) != os.path.getsize(b):
+            return False
+        with open(a, 'rb', buffering=0) as fa, open(b, 'rb', buffering=0) as fb:
+            while True:
+                self._check_cancelled()
+                chunk = fa.read(self.CHUNK_SIZE)
+                if chunk != fb.read(self.CHUNK_SIZE):
+                    return False
+                if not chunk:
+                    return True
+
+    @staticmethod
+    def _rename(source, target):
+        """Rename source if it is on the target's file system; False if not"""
+        try:
+            os.rename(source, target)
+            return True
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            return False
+
+    @staticmethod
+    def _remove_empty(folders):
+        """Remove the walked folders of a move, deepest first, once they are empty"""
+        for folder in reversed(folders):
+            try:
+                os.rmdir(folder)
+            except OSError:
+                # Still holds something that was not moved
+                pass
+
+    def _add(self, **counts):
+        with self._lock:
+            for key, n in counts.items():
+                self._progress[key] = self._progress.get(key, 0) + n
+
+    def _check_cancelled(self):
+        if self.cancelled is not None and self.cancelled.is_set():
+            raise OperationCancelled()
+
+class ArchiveJob:
+    """Pack files into compressed archives on a process pool
+
+    The files are split into shards, one per worker at most and balanced
+    by size, and every shard becomes its own archive written by a separate
+    process, so compression uses all cores. A worker reads its archive back
+    and compares the hash of every member with the hash taken while writing
+    it; the originals of a shard are only deleted once its archive verified.
+    """
+    FORMATS = ('.tar.xz', '.zip', '.tar.zst')
+    MIN_SHARD = 64 * 1024 * 1024
+    CHUNK_SIZE = 1024 * 1024
+    # Set in each worker process by _init_worker
+    _progress = None
+    _stop = None
+
+    def __init__(self, workers=None, cancelled=None):
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.cancelled = cancelled
+
+    @classmethod
+    def formats(cls):
+        """Archive extensions that can be written here"""
+        return [ext for ext in cls.FORMATS if ext != '.tar.zst' or zstandard is not None]
+
+    @classmethod
+    def format_for(cls, path):
+        """The archive extension path ends with; raises ValueError if unsupported"""
+        for ext in cls.formats():
+            if path.lower().endswith(ext):
+                return ext
+        raise ValueError(f"Unsupported archive type: {os.path.basename(path)}")
+
+    def shards(self, files):
+        """Split (path, name, size) tuples into groups of about equal size"""
+        total = sum(size for _, _, size in files)
+        count = max(1, min(self.workers, len(files), -(-total // self.MIN_SHARD)))
+        groups = [[] for _ in range(count)]
+        heap = [(0, i) for i in range(count)]
+        # Largest first, each into the group with the fewest bytes so far
+        for item in sorted(files, key=lambda f: f[2], reverse=True):
+            load, i = heapq.heappop(heap)
+            groups[i].append(item)
+            heapq.heappush(heap, (load + item[2], i))
+        return groups
+
+    def archive(self, files, target, progress=None):
+        """Pack (path, name in archive) pairs into archives named after target
+
+        target ends with one of formats(); with several shards the archives
+        are named base.part1.tar.xz and so on. Returns a dict with the
+        'archives' written, the 'removed' originals, the 'failed' paths
+        mapped to their errors, the bytes of the removed originals
+        ('packed') and of the archives ('archived'), and 'saved', their
+        difference, which is negative when the data did not compress.
+        Archives are written under temp_name() and only renamed to their
+        final name once they verified. progress, if given,
+        is updated with files_done, files_total, bytes_done and bytes_total.
+        """
+        ext = self.format_for(target)
+        sized = []
+        failed = {}
+        for path, name in files:
+            try:
+                sized.append((path, name, os.stat(path).st_size))
+            except OSError as e:
+                failed[path] = e
+        groups = self.shards(sized) if sized else []
+        base = target[:-len(ext)]
+        names = [target] if len(groups) == 1 else [f"{base}.part{i + 1}{ext}"
+                                                  for i in range(len(groups))]
+        taken = [name for name in names if os.path.lexists(name)]
+        if taken:
+            raise FileExistsError(errno.EEXIST, "Archive already exists", taken[0])
+        if progress is not None:
+            progress.update(files_done=0, files_total=len(sized), bytes_done=0,
+                            bytes_total=sum(size for _, _, size in sized), started=time.monotonic())
+        result = {'archives': [], 'removed': [], 'failed': failed, 'packed': 0, 'archived': 0, 'saved': 0}
+        if not groups:
+            return result
+
+        context = self._context()
+        reports = context.Queue()
+        stop = context.Event()
+        pool = ProcessPoolExecutor(min(self.workers, len(groups)), mp_context=context,
+                                   initializer=ArchiveJob._init_worker, initargs=(reports, stop))
         try:
-            files = [f for f in os.listdir(folder_path) if os.path.isfile(os.path.join(folder_path, f))]
-            if not files:
-                return []
-            
-            # Compare filenames
-            similar = []
-            target_name = os.path.basename(target_file)
-            for f in files:
-                ratio = SequenceMatcher(None, target_name, f).ratio()
-                if ratio > threshold and f != target_name:
-                    similar.append(f)
-            
-            # Compare content for text files
-            if target_file.endswith(('.txt', '.pdf', '.docx')):
+            futures = {pool.submit(ArchiveJob._pack, ext, name, [(p, n) for p, n, _ in group]): (name, group)
+                       for name, group in zip(names, groups)}
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                self._drain(reports, progress)
+                if self.cancelled is not None and self.cancelled.is_set():
+                    stop.set()
+                for future in done:
+                    name, group = futures[future]
+                    try:
+                        future.result()
+                    except Exception as e:
+                        # A worker that died cannot have cleaned up after itself
+                        with contextlib.suppress(OSError):
+                            os.remove(self.temp_name(name))
+                        failed.update((path, e) for path, _, _ in group)
+                        continue
+                    result['archives'].append(name)
+                    packed = 0
+                    for path, _, size in group:
+                        try:
+                            os.remove(path)
+                        except OSError as e:
+                            failed[path] = e
+                        else:
+                            result['removed'].append(path)
+                            packed += size
+                    result['packed'] += packed
+                    result['archived'] += os.path.getsize(name)
+                    result['saved'] = result['packed'] - result['archived']
+        finally:
+            stop.set()
+            pool.shutdown(wait=True, cancel_futures=True)
+        self._drain(reports, progress)
+        if self.cancelled is not None and self.cancelled.is_set():
+            raise OperationCancelled()
+        return result
+
+    @staticmethod
+    def _context():
+        """Process start method for the workers
+
+        Forking the threaded Tk process could copy locks held by other
+        threads into the children, so workers come from a fork server, or
+        are spawned where there is none. Either way each worker imports the
+        app once when the pool starts.
+        """
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            return multiprocessing.get_context('forkserver')
+        return multiprocessing.get_context('spawn')
+
+    @staticmethod
+    def _drain(reports, progress):
+        while True:
+            try:
+                size = reports.get_nowait()
+            except queue.Empty:
+                return
+            if progress is not None:
+                progress['files_done'] += 1
+                progress['bytes_done'] += size
+
+    @staticmethod
+    def _init_worker(reports, stop):
+        ArchiveJob._progress = reports
+        ArchiveJob._stop = stop
+
+    @staticmethod
+    @contextlib.contextmanager
+    def _open(ext, path, mode):
+        """Open an archive for writing ('w') or reading ('r')"""
+        if ext == '.zip':
+            with zipfile.ZipFile(path, mode, zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+                yield archive
+        elif ext == '.tar.xz':
+            with tarfile.open(path, mode + ':xz') as archive:
+                yield archive
+        elif mode == 'w':
+            with open(path, 'wb') as fh, \
+                    zstandard.ZstdCompressor(write_checksum=True).stream_writer(fh) as stream, \
+                    tarfile.open(fileobj=stream, mode='w|') as archive:
+                yield archive
+        else:
+            with open(path, 'rb') as fh, \
+                    zstandard.ZstdDecompressor().stream_reader(fh) as stream, \
+                    tarfile.open(fileobj=stream, mode='r|') as archive:
+                yield archive
+
+    @staticmethod
+    def temp_name(target):
+        """Name an archive is written under until it verified"""
+        return os.path.join(os.path.dirname(target), f".{os.path.basename(target)}.smartarrange-tmp")
+
+    @staticmethod
+    def _pack(ext, target, members):
+        """Write and verify one archive, then move it into place; runs in a worker process"""
+        temp = ArchiveJob.temp_name(target)
+        try:
+            ArchiveJob._write(ext, temp, members)
+            if os.path.lexists(target):
+                raise FileExistsError(errno.EEXIST, "Archive already exists", target)
+            os.replace(temp, target)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(temp)
+            raise
+
+    @staticmethod
+    def _write(ext, target, members):
+        digests = {}
+
+        class HashingReader:
+            def __init__(self, fh):
+                self.fh = fh
+                self.hash = hashlib.blake2b(digest_size=16)
+
+            def read(self, size=-1):
+                data = self.fh.read(size)
+                self.hash.update(data)
+                return data
+
+        with ArchiveJob._open(ext, target, 'w') as archive:
+            for path, name in members:
+                if ArchiveJob._stop.is_set():
+                    raise OperationCancelled()
+                name = name.replace(os.sep, '/')
+                with open(path, 'rb') as fh:
+                    reader = HashingReader(fh)
+                    if ext == '.zip':
+                        info = zipfile.ZipInfo.from_file(path, name)
+                        info.compress_type = zipfile.ZIP_DEFLATED
+                        with archive.open(info, 'w', force_zip64=True) as out:
+                            shutil.copyfileobj(reader, out, ArchiveJob.CHUNK_SIZE)
+                    else:
+                        info = archive.gettarinfo(path, name)
+                        archive.addfile(info, reader)
+                digests[name] = reader.hash.digest()
+                ArchiveJob._progress.put(info.file_size if ext == '.zip' else info.size)
+
+        # Read everything back; zip CRCs and xz/zstd checksums are checked
+        # on the way, the hashes catch anything they would not
+        found = {}
+        with ArchiveJob._open(ext, target, 'r') as archive:
+            if ext == '.zip':
+                entries = ((name, archive.open(name)) for name in archive.namelist())
+            else:
+                entries = ((member.name, archive.extractfile(member)) for member in archive
+                           if member.isfile())
+            for name, fh in entries:
+                if ArchiveJob._stop.is_set():
+                    raise OperationCancelled()
+                digest = hashlib.blake2b(digest_size=16)
+                with fh:
+                    while chunk := fh.read(ArchiveJob.CHUNK_SIZE):
+                        digest.update(chunk)
+                found[name] = digest.digest()
+        if found != digests:
+            raise OSError(f"{os.path.basename(target)} did not verify")
+
+class DuplicateFinder:
+    """Find files with identical content in stages of increasing cost
+
+    Candidates are grouped by size, then by a hash of their first 4 KB, then
+    of their first and last 64 KB, and only what survives is hashed in full.
+    Reads go through fixed-size buffers, so memory use does not depend on how
+    large the files are. Each stage hashes on a thread pool (hashlib releases
+    the GIL while digesting) and the counters below can be read from another
+    thread to show progress.
+
+    Paths that are hardlinks to the same inode are collapsed before hashing
+    and reported together as one copy of the data.
+    """
+    HEAD_SIZE = 4 * 1024
+    EDGE_SIZE = 64 * 1024
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, digest=hashlib.blake2b, workers=4, cancelled=None, cache=None):
+        self.digest = digest
+        self.workers = max(1, int(workers))
+        self.cancelled = cancelled
+        self.cache = cache
+        self.stage = ""
+        self.files_done = 0
+        self.files_total = 0
+        self.bytes_hashed = 0
+        self._lock = threading.Lock()
+
+    def find(self, files, on_group=None):
+        """Return a DuplicateGroup for every set of identical files
+
+        files is an iterable of FileEntry objects. on_group(group) is called
+        from the scanning thread as soon as a group is confirmed. Raises
+        OperationCancelled if the cancelled event gets set.
+        """
+        self.stage = "Grouping by size"
+        links = self.collapse_hardlinks(files)
+        groups = self.group_by_size(entry for entry, paths in links)
+        links = {id(entry): paths for entry, paths in links}
+        confirmed = []
+        stages = (("Comparing headers", self.head_hash),
+                  ("Comparing file edges", self.edge_hash),
+                  ("Hashing full contents", self.full_hash))
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                for name, stage in stages:
+                    self.stage = name
+                    groups = self.refine(groups, stage, pool)
+                    # Groups whose every byte has now been compared are final
+                    settled = [group for group in groups if self.is_final(stage, group[0])]
+                    groups = [group for group in groups if not self.is_final(stage, group[0])]
+                    for size, entries in settled:
+                        group = DuplicateGroup(size, [links[id(entry)] for entry in entries],
+                                               {path: (entry.size, entry.mtime_ns)
+                                                for entry in entries if entry.mtime_ns
+                                                for path in links[id(entry)]})
+                        confirmed.append(group)
+                        if on_group:
+                            on_group(group)
+        finally:
+            if self.cache is not None:
+                self.cache.flush()
+        self.stage = "Done"
+        return confirmed
+
+    def is_final(self, stage, size):
+        """Whether files of this size are fully compared once stage has run"""
+        if stage == self.head_hash:
+            return self.is_settled(self.edge_hash, size)
+        if stage == self.edge_hash:
+            return self.is_settled(self.full_hash, size)
+        return True
+
+    @staticmethod
+    def collapse_hardlinks(files):
+        """Return [(entry, [paths])] with one representative per inode"""
+        by_inode = {}
+        result = []
+        seen = set()
+        for entry in files:
+            if entry.path in seen:
+                continue
+            seen.add(entry.path)
+            inode = entry.inode
+            if inode is not None and inode in by_inode:
+                by_inode[inode].append(entry.path)
+                continue
+            paths = [entry.path]
+            if inode is not None:
+                by_inode[inode] = paths
+            result.append((entry, paths))
+        return result
+
+    @staticmethod
+    def group_by_size(files):
+        """Group entries by size, dropping unique sizes"""
+        size_groups = defaultdict(list)
+        for entry in files:
+            size_groups[entry.size].append(entry)
+        return [(size, entries) for size, entries in size_groups.items() if len(entries) > 1]
+
+    def refine(self, groups, stage, pool):
+        """Split every group by the key stage(path, size) and drop singletons"""
+        keys = [defaultdict(list) for _ in groups]
+        tasks = ((gi, order, entry)
+                 for gi, (size, entries) in enumerate(groups)
+                 for order, entry in enumerate(entries))
+        self.files_done = 0
+        self.files_total = sum(len(entries) for size, entries in groups)
+        in_flight = {}
+        for task in tasks:
+            in_flight[pool.submit(self._cached, stage, task[2])] = task
+            # Keep the number of queued futures bounded for huge scans
+            if len(in_flight) >= self.workers * 4:
+                self._collect(in_flight, keys, return_when=FIRST_COMPLETED)
+        self._collect(in_flight, keys, return_when=ALL_COMPLETED)
+
+        refined = []
+        for (size, entries), by_key in zip(groups, keys):
+            for same in by_key.values():
+                if len(same) > 1:
+                    same.sort(key=lambda item: item[0])
+                    refined.append((size, [entry for order, entry in same]))
+        return refined
+
+    def _collect(self, in_flight, keys, return_when):
+        done, _ = wait(in_flight, return_when=return_when)
+        for future in done:
+            gi, order, entry = in_flight.pop(future)
+            try:
+                keys[gi][future.result()].append((order, entry))
+            except OperationCancelled:
+                pass
+            except OSError:
+                # Unreadable files cannot be confirmed as duplicates
+                pass
+            self.files_done += 1
+        self._check_cancelled()
+
+    def _cached(self, stage, entry):
+        """Run a hashing stage, answering from the persistent cache when possible"""
+        if self.cache is None:
+            return stage(entry.path, entry.size)
+        if entry.ino:
+            key = (entry.dev, entry.ino, entry.size, entry.mtime_ns)
+        else:
+            key = self.cache.key_for(entry.path)
+        kind = f"{self.digest().name}:{stage.__name__}"
+        digest = self.cache.get(key, kind)
+        if digest is None:
+            digest = stage(entry.path, entry.size)
+            self.cache.put(key, kind, digest)
+        return digest
+
+    def _check_cancelled(self):
+        if self.cancelled is not None and self.cancelled.is_set():
+            raise OperationCancelled()
+
+    def _count(self, n):
+        with self._lock:
+            self.bytes_hashed += n
+
+    def is_settled(self, stage, size):
+        """Whether an earlier stage already compared every byte of such files"""
+        if stage == self.edge_hash:
+            return size <= self.HEAD_SIZE
+        if stage == self.full_hash:
+            return size <= 2 * self.EDGE_SIZE
+        return False
+
+    def head_hash(self, path, size):
+        """Hash of the first HEAD_SIZE bytes"""
+        self._check_cancelled()
+        with open(path, 'rb') as f:
+            data = f.read(self.HEAD_SIZE)
+        self._count(len(data))
+        return self.digest(data).digest()
+
+    def edge_hash(self, path, size):
+        """Hash of the first and last EDGE_SIZE bytes"""
+        self._check_cancelled()
+        h = self.digest()
+        with open(path, 'rb') as f:
+            data = f.read(self.EDGE_SIZE)
+            if size > self.EDGE_SIZE:
+                f.seek(max(self.EDGE_SIZE, size - self.EDGE_SIZE))
+                data += f.read(self.EDGE_SIZE)
+        h.update(data)
+        self._count(len(data))
+        return h.digest()
+
+    def full_hash(self, path, size=None):
+        """Hash of the whole file, read in CHUNK_SIZE pieces"""
+        h = self.digest()
+        buf = bytearray(self.CHUNK_SIZE)
+        view = memoryview(buf)
+        with open(path, 'rb', buffering=0) as f:
+            while True:
+                self._check_cancelled()
+                n = f.readinto(buf)
+                if not n:
+                    break
+                h.update(view[:n])
+                self._count(n)
+        return h.digest()
+
+class OrganizeRules:
+    """Rules deciding which folder organize moves each file into
+
+    One rule per line: conditions, '->' and a folder template relative to
+    the folder being organized. The first rule whose conditions all hold
+    decides; files that no rule matches stay where they are. Conditions:
+
+        *                   every file
+        ext:.jpg,.png       extension
+        category:Images     category from EXTENSION_FOLDERS ('Other' if unknown)
+        name:IMG_*,DSC*     glob on the file name
+        path:raw/**/*.cr2   glob on the path below the organized folder
+        regex:^(\\d{4})-     regex searched in the file name
+        size>10M            size (<, <=, >, >=) with a K, M, G or T suffix
+        age>30d             time since modification, in h, d, w, m or y
+
+    Templates can use {category}, {ext}, {name}, {stem}, {year}, {month},
+    {day}, {folder} (the file's folder below the organized one) and the
+    groups of the regex as {1}, {2}... or by name, with an optional format
+    spec such as {1:0>4} or {1:04d}. A numeric spec formats the value as a
+    number; values that are not numbers are used as they are. Matching is
+    case-insensitive.
+
+    Rules are compiled once and applied to all files at once, rule by rule:
+    extension, category, size and age conditions become NumPy masks over
+    the files no earlier rule took, and names are only matched against the
+    files that pass them. Targets that depend on nothing but the extension
+    and date are rendered once per distinct value.
+    """
+    SIZE_UNITS = {'': 1, 'b': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+    AGE_UNITS = {'h': 3600, 'd': 86400, 'w': 7 * 86400, 'm': 30 * 86400, 'y': 365 * 86400}
+    COMPARISON = re.compile(r'(size|age)\s*([<>]=?)\s*(\d+(?:\.\d+)?)\s*([a-z]*)$', re.IGNORECASE)
+    FIELD = re.compile(r'\{(\w+)(?::([^{}]*))?\}')
+    INT_TYPES = 'bcdoxXn'
+    FLOAT_TYPES = 'eEfFgG%'
+    DATE_FIELDS = ('year', 'month', 'day')
+
+    class Rule:
+        __slots__ = ('index', 'exts', 'categories', 'min_size', 'max_size', 'min_mtime',
+                     'max_mtime', 'name', 'path', 'regex', 'fields', 'parts')
+
+    def __init__(self, lines, now=None):
+        self.now = time.time() if now is None else now
+        self.rules = []
+        for number, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                self.rules.append(self._parse(line, len(self.rules)))
+            except (ValueError, re.error) as e:
+                raise ValueError(f"Organize rule {number}: {e}") from None
+        self._dates = {}
+
+    def _parse(self, line, index):
+        conditions, arrow, template = line.rpartition('->')
+        if not arrow:
+            raise ValueError("expected conditions, '->' and a target folder")
+        rule = self.Rule()
+        rule.index = index
+        rule.exts = rule.categories = rule.name = rule.path = rule.regex = None
+        rule.min_size, rule.max_size = 0, float('inf')
+        rule.min_mtime, rule.max_mtime = float('-inf'), float('inf')
+        for condition in conditions.split():
+            key, _, value = condition.partition(':')
+            key = key.lower()
+            comparison = self.COMPARISON.match(condition)
+            if condition == '*':
+                continue
+            elif comparison:
+                self._compare(rule, *comparison.groups())
+            elif key == 'ext' and value:
+                rule.exts = {('.' + e.lstrip('.')).lower() for e in value.split(',') if e}
+            elif key == 'category' and value:
+                rule.categories = {c.lower() for c in value.split(',') if c}
+            elif key in ('name', 'path') and value:
+                regex = re.compile('|'.join(IgnoreRules._translate(glob)
+                                            for glob in value.split(',') if glob),
+                                   re.IGNORECASE | re.DOTALL)
+                setattr(rule, key, regex)
+            elif key == 'regex' and value:
+                rule.regex = re.compile(condition[len('regex:'):], re.IGNORECASE)
+            else:
+                raise ValueError(f"unknown condition '{condition}'")
+        rule.fields, rule.parts = self._compile_template(template.strip(), rule.regex)
+        return rule
+
+    def _compare(self, rule, what, op, number, unit):
+        units = self.SIZE_UNITS if what.lower() == 'size' else self.AGE_UNITS
+        unit = unit.lower()
+        if unit not in units or (what.lower() == 'age' and not unit):
+            raise ValueError(f"unknown unit '{unit}' for {what}")
+        amount = float(number) * units[unit]
+        if what.lower() == 'size':
+            if op.startswith('>'):
+                rule.min_size = amount if op == '>=' else amount + 1
+            else:
+                rule.max_size = amount if op == '<=' else amount - 1
+        elif op.startswith('>'):
+            # Older than amount: modified before now - amount
+            rule.max_mtime = self.now - amount
+        else:
+            rule.min_mtime = self.now - amount
+
+    def _compile_template(self, template, regex):
+        """Split a template into literal text and (field, spec) parts"""
+        template = template.replace('\\', '/').strip('/')
+        if not template:
+            raise ValueError("empty target folder")
+        fields = []
+        parts = []
+        position = 0
+        for match in self.FIELD.finditer(template):
+            parts.append(template[position:match.start()])
+            field, spec = match.group(1), match.group(2) or ''
+            if field.isdigit():
+                if regex is None or int(field) > regex.groups:
+                    raise ValueError(f"no regex group {{{field}}}")
+                field = int(field)
+            elif field not in ('category', 'ext', 'name', 'stem', 'folder') + self.DATE_FIELDS:
+                if regex is None or field not in regex.groupindex:
+                    raise ValueError(f"unknown field {{{field}}}")
+            try:
+                self._format('0', spec)
+            except ValueError:
+                raise ValueError(f"invalid format spec '{spec}' in {{{match.group(1)}}}") from None
+            if field not in fields:
+                fields.append(field)
+            parts.append((fields.index(field), spec))
+            position = match.end()
+        parts.append(template[position:])
+        if any(isinstance(part, str) and ('{' in part or '}' in part) for part in parts):
+            raise ValueError(f"unbalanced braces in '{template}'")
+        return tuple(fields), parts
+
+    def classify(self, root, entries):
+        """Return the target folder of each file entry, None where no rule matches"""
+        root = os.path.abspath(root)
+        n = len(entries)
+        if not n or not self.rules:
+            return [None] * n
+        all_exts = [e.ext for e in entries]
+        exts = list(dict.fromkeys(all_exts))
+        ext_ids = {ext: i for i, ext in enumerate(exts)}
+        ext_codes = np.fromiter(map(ext_ids.__getitem__, all_exts), np.int64, n)
+        sizes = mtimes = None
+        if any(rule.min_size > 0 or rule.max_size != float('inf') for rule in self.rules):
+            sizes = np.array([e.size for e in entries], dtype=np.float64)
+        if any(rule.min_mtime != float('-inf') or rule.max_mtime != float('inf')
+               or set(self.DATE_FIELDS) & set(rule.fields) for rule in self.rules):
+            mtimes = np.array([e.mtime for e in entries], dtype=np.float64)
+        targets = np.full(n, None, dtype=object)
+        unassigned = np.ones(n, dtype=bool)
+        columns = {}
+
+        for rule in self.rules:
+            allowed = np.fromiter((self._allows(rule, ext) for ext in exts), bool, len(exts))
+            mask = unassigned & allowed[ext_codes]
+            if rule.min_size > 0 or rule.max_size != float('inf'):
+                mask &= (sizes >= rule.min_size) & (sizes <= rule.max_size)
+            if rule.min_mtime != float('-inf') or rule.max_mtime != float('inf'):
+                mask &= (mtimes >= rule.min_mtime) & (mtimes <= rule.max_mtime)
+            picked = np.flatnonzero(mask)
+            matches = None
+            if rule.name is not None or rule.path is not None or rule.regex is not None:
+                picked, matches = self._match_names(rule, root, entries, picked, columns)
+            if not len(picked):
+                continue
+            unassigned[picked] = False
+            if matches is None and not {'name', 'stem', 'folder'} & set(rule.fields):
+                targets[picked] = self._grouped_targets(
+                    rule, root, exts, ext_codes[picked], None if mtimes is None else mtimes[picked])
+            else:
+                targets[picked] = self._file_targets(rule, root, entries, picked, matches)
+            if not unassigned.any():
+                break
+        return targets.tolist()
+
+    def _allows(self, rule, ext):
+        return ((rule.exts is None or ext in rule.exts) and
+                (rule.categories is None or
+                 EXTENSION_FOLDERS.get(ext, 'Other').lower() in rule.categories))
+
+    def _match_names(self, rule, root, entries, picked, columns):
+        """Narrow picked to the entries whose names match; also returns regex matches
+
+        The regexes are mapped over object arrays of the names, so the loop
+        runs in C rather than as Python bytecode per file.
+        """
+        def column(key):
+            if key not in columns:
+                skip = len(root) + 1
+                values = ([e.name for e in entries] if key == 'name' else
+                          [e.path[skip:].replace(os.sep, '/') for e in entries])
+                columns[key] = np.array(values, dtype=object)
+            return columns[key]
+
+        def keep(regex, key):
+            found = np.fromiter(map(bool, map(regex, column(key)[picked])), bool, len(picked))
+            return picked[found]
+
+        if rule.name is not None:
+            picked = keep(rule.name.fullmatch, 'name')
+        if rule.path is not None:
+            picked = keep(rule.path.fullmatch, 'path')
+        matches = None
+        if rule.regex is not None:
+            matches = list(map(rule.regex.search, column('name')[picked]))
+            picked = picked[np.fromiter(map(bool, matches), bool, len(matches))]
+            matches = list(filter(None, matches))
+        return picked, matches
+
+    def _grouped_targets(self, rule, root, exts, ext_codes, mtimes):
+        """Targets for fields that only depend on extension and date, rendered once per value"""
+        fields = set(rule.fields)
+        if not fields & {'category', 'ext'}:
+            ext_codes = np.zeros_like(ext_codes)
+        if not fields & set(self.DATE_FIELDS):
+            rendered = np.empty(len(exts), dtype=object)
+            for code in np.flatnonzero(np.bincount(ext_codes, minlength=len(exts))).tolist():
+                values = [self._value(field, exts[code], None, None, None) for field in rule.fields]
+                rendered[code] = os.path.join(root, self._render(rule, values))
+            return rendered[ext_codes]
+
+        days = self._local_days(mtimes)
+        if 'day' in fields:
+            periods = days
+        elif 'month' in fields:
+            periods = days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+        else:
+            periods = days.astype('datetime64[D]').astype('datetime64[Y]').astype(np.int64)
+        periods = periods - periods.min()
+        keys = ext_codes * (int(periods.max()) + 1) + periods
+        # Index of the first file with each key, without sorting
+        first = np.full(int(keys.max()) + 1, -1, dtype=np.int64)
+        first[keys[::-1]] = np.arange(len(keys) - 1, -1, -1)
+        rendered = np.empty(len(first), dtype=object)
+        for key in np.flatnonzero(first >= 0).tolist():
+            i = int(first[key])
+            t = time.gmtime(int(days[i]) * 86400)
+            date = (f"{t.tm_year:04d}", f"{t.tm_mon:02d}", f"{t.tm_mday:02d}")
+            values = [self._value(field, exts[ext_codes[i]], date, None, None)
+                      for field in rule.fields]
+            rendered[key] = os.path.join(root, self._render(rule, values))
+        return rendered[keys]
+
+    @staticmethod
+    def _local_days(mtimes):
+        """Local calendar day (days since 1970-01-01) of each modification time
+
+        The UTC offset is looked up once per day; only files from a day on
+        which it changes (a DST switch) are converted one by one.
+        """
+        utc_days = (mtimes // 86400).astype(np.int64)
+        low = int(utc_days.min())
+        offsets = np.fromiter((time.localtime(day * 86400).tm_gmtoff
+                               for day in range(low, int(utc_days.max()) + 2)), np.int64)
+        index = utc_days - low
+        local = mtimes + offsets[index]
+        switching = np.flatnonzero(offsets[index] != offsets[index + 1])
+        for i in switching.tolist():
+            local[i] = mtimes[i] + time.localtime(mtimes[i]).tm_gmtoff
+        return (local // 86400).astype(np.int64)
+
+    def _file_targets(self, rule, root, entries, picked, matches):
+        skip = len(root) + 1
+        cache = {}
+        out = np.empty(len(picked), dtype=object)
+        for k, i in enumerate(picked.tolist()):
+            entry = entries[i]
+            match = matches[k] if matches is not None else None
+            values = tuple(self._value(field, entry.ext, self._date(entry.mtime), entry, match,
+                                       entry.path[skip:])
+                           for field in rule.fields)
+            target = cache.get(values)
+            if target is None:
+                target = cache[values] = os.path.join(root, self._render(rule, values))
+            out[k] = target
+        return out
+
+    def _value(self, field, ext, date, entry, match, relative=''):
+        if field in self.DATE_FIELDS:
+            return date[self.DATE_FIELDS.index(field)]
+        if field == 'category':
+            return EXTENSION_FOLDERS.get(ext, 'Other')
+        if field == 'ext':
+            return ext[1:] or 'none'
+        if field == 'name':
+            return entry.name
+        if field == 'stem':
+            return os.path.splitext(entry.name)[0]
+        if field == 'folder':
+            return os.path.dirname(relative)
+        return match.group(field) or ''
+
+    def _date(self, mtime):
+        # Local midnight falls on a quarter hour in every time zone, so all
+        # times in one quarter hour share a date
+        bucket = int(mtime // 900)
+        date = self._dates.get(bucket)
+        if date is None:
+            t = time.localtime(bucket * 900)
+            date = self._dates[bucket] = (f"{t.tm_year:04d}", f"{t.tm_mon:02d}", f"{t.tm_mday:02d}")
+        return date
+
+    @staticmethod
+    def _format(value, spec):
+        """Format one field value, a string, as a number if spec asks for one"""
+        kind = spec[-1:]
+        if kind and kind in OrganizeRules.INT_TYPES + OrganizeRules.FLOAT_TYPES:
+            try:
+                value = int(value) if kind in OrganizeRules.INT_TYPES else float(value)
+            except ValueError:
+                return value
+        return format(value, spec)
+
+    @staticmethod
+    def _render(rule, values):
+        text = []
+        for part in rule.parts:
+            if isinstance(part, str):
+                text.append(part)
+            else:
+                index, spec = part
+                value = values[index]
+                if rule.fields[index] != 'folder':
+                    # Only the template and {folder} may add folder levels
+                    value = str(value).replace('/', '_').replace(os.sep, '_')
+                text.append(OrganizeRules._format(value, spec))
+        names = [name for name in ''.join(text).replace(os.sep, '/').split('/')
+                 if name not in ('', '.')]
+        return os.path.join(*['_' if name == '..' else name for name in names] or ['_'])
+
+class MovePlan:
+    """The moves an organize run will make, with name collisions resolved"""
+    def __init__(self, folder):
+        self.folder = folder
+        self.moves = []
+        self.folders = []
+        self.renamed = 0
+        self.skipped = []
+
+    @staticmethod
+    def free_name(name, taken):
+        """Return name, or 'name (n).ext' with the first n not in taken"""
+        if name not in taken:
+            return name
+        stem, ext = os.path.splitext(name)
+        n = 1
+        while f"{stem} ({n}){ext}" in taken:
+            n += 1
+        return f"{stem} ({n}){ext}"
+
+    @classmethod
+    def organize(cls, folder, files, rules=None):
+        """Plan moving files below folder to where OrganizeRules put them
+
+        Without rules each file goes into a subfolder named after its
+        category. Files already in their target folder are left alone.
+        """
+        folder = os.path.abspath(folder)
+        if rules is None:
+            rules = OrganizeRules(DEFAULT_ORGANIZE_RULES)
+        plan = cls(folder)
+        taken = {}
+        created = set()
+        files = files if isinstance(files, list) else list(files)
+        for entry, target_dir in zip(files, rules.classify(folder, files)):
+            if target_dir is None or os.path.dirname(entry.path) == target_dir:
+                continue
+            names = taken.get(target_dir)
+            if names is None:
+                names = taken[target_dir] = cls._target_names(plan, target_dir, created)
+            if names is False:
+                plan.skipped.append(entry.path)
+                continue
+            name = cls.free_name(entry.name, names)
+            if name != entry.name:
+                plan.renamed += 1
+            names.add(name)
+            plan.moves.append((entry.path, os.path.join(target_dir, name)))
+        return plan
+
+    @staticmethod
+    def _target_names(plan, target_dir, created):
+        """Names already in target_dir, planning the folders it needs; False if blocked"""
+        try:
+            return set(os.listdir(target_dir))
+        except FileNotFoundError:
+            pass
+        except OSError:
+            # A file is in the way of the target folder
+            return False
+        missing = []
+        parent = target_dir
+        while parent not in created and not os.path.isdir(parent):
+            if os.path.lexists(parent):
+                return False
+            missing.append(parent)
+            parent = os.path.dirname(parent)
+        for path in reversed(missing):
+            created.add(path)
+            plan.folders.append(path)
+        return set()
+
+class RenamePlan:
+    """A batch of renames inside one folder, checked and ordered up front
+
+    Renames that would give a file an invalid name, give two files the same
+    name, or overwrite a file that is not itself being renamed are left out
+    and reported in conflicts (old name -> reason). The rest are ordered so
+    that a file whose name another file of the batch takes moves out of the
+    way first; cycles (such as swapping two names) are opened by moving one
+    file to a temporary name and renaming it last, so no step ever
+    overwrites a file. moves holds the steps in that order, ready for a
+    MoveJournal, which makes the run resumable and undoable.
+    """
+    TEMP_PREFIX = '.smartarrange-rename-'
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.moves = []
+        self.folders = []
+        self.renames = {}
+        self.conflicts = {}
+        self.cycles = 0
+
+    @staticmethod
+    def invalid(name):
+        """Why name cannot be a file name, or None if it can"""
+        if name in ('', '.', '..'):
+            return "empty name"
+        if '/' in name or os.sep in name or '\0' in name:
+            return "name contains a path separator"
+        if len(name) > 63 and len(os.fsencode(name)) > 255:
+            return "name is too long"
+        return None
+
+    @classmethod
+    def build(cls, folder, new_names, existing=None):
+        """Plan renaming files below folder
+
+        new_names maps paths relative to folder to new names; each file
+        stays in its own subfolder. existing holds the relative paths that
+        are taken, the names in folder if it is not given.
+        """
+        plan = cls(folder)
+        # Names are compared the way the file system does (ignoring case on Windows)
+        key = os.path.normcase if os.path.normcase('A') != 'A' else str
+        prefix = os.path.join(folder, '')
+        if existing is None:
+            existing = os.listdir(folder)
+        existing = {key(name) for name in existing}
+
+        pending = {}
+        by_target = defaultdict(list)
+        for old, new in new_names.items():
+            reason = cls.invalid(new)
+            if reason:
+                plan.conflicts[old] = reason
+                continue
+            subfolder = os.path.dirname(old)
+            new = os.path.join(subfolder, new) if subfolder else new
+            if new != old:
+                pending[old] = new
+                by_target[key(new)].append(old)
+        for olds in by_target.values():
+            if len(olds) > 1:
+                for old in olds:
+                    name = os.path.basename(pending.pop(old))
+                    plan.conflicts[old] = f"{len(olds)} files would be named '{name}'"
+
+        # A file that keeps its name blocks the rename to it, which in turn
+        # keeps that file's name taken
+        moving = {key(old) for old in pending}
+        renamed_to = {key(new): old for old, new in pending.items()}
+        blocked = [old for old, new in pending.items()
+                   if key(new) in existing and key(new) not in moving]
+        while blocked:
+            old = blocked.pop()
+            if old in pending:
+                plan.conflicts[old] = f"'{os.path.basename(pending.pop(old))}' already exists"
+                if renamed_to.get(key(old)) in pending:
+                    blocked.append(renamed_to[key(old)])
+        plan.renames = pending
+
+        # next_of[old] is the file of the batch that holds old's new name and
+        # has to move first. Every file waits on at most one other and is
+        # waited on by at most one, so they form chains, which run from the
+        # end, and cycles, which are opened with one temporary name.
+        source_of = {key(old): old for old in pending}
+        next_of = {old: source_of.get(key(new)) for old, new in pending.items()}
+        done = set()
+
+        def add_chain(chain):
+            for old in reversed(chain):
+                plan.moves.append((prefix + old, prefix + pending[old]))
+                done.add(old)
+
+        for head in pending:
+            if key(head) in renamed_to:
+                continue
+            chain = [head]
+            while next_of[chain[-1]] is not None:
+                chain.append(next_of[chain[-1]])
+            add_chain(chain)
+        for start in pending:
+            if start in done:
+                continue
+            plan.cycles += 1
+            temp = os.path.join(os.path.dirname(prefix + start),
+                                f"{cls.TEMP_PREFIX}{os.urandom(4).hex()}-{plan.cycles}")
+            plan.moves.append((prefix + start, temp))
+            chain = []
+            old = next_of[start]
+            while old != start:
+                chain.append(old)
+                old = next_of[old]
+            add_chain(chain)
+            plan.moves.append((temp, prefix + pending[start]))
+            done.add(start)
+        return plan
+
+class RenamePattern:
+    """A bulk rename pattern, applied to a whole batch of files at once
+
+    Patterns use str.format syntax with these fields:
+
+        {name} {ext}    the old name without its extension, and the extension
+        {num}           position in the batch, from 1
+        {counter}       position within the file's own subfolder, from 1
+        {folder}        name of the file's subfolder
+        {date}          modification time, formatted like {date:%Y-%m-%d}
+        {exif}          when a photo was taken, or else its modification time
+        {0} {1} ...     the match of the match regex and its groups, also
+                        by name; files it does not match keep their names
+
+    Files are numbered in folder and name order.
+    """
+    class Date(datetime):
+        def __format__(self, spec):
+            return self.strftime(spec or '%Y-%m-%d')
+
+    def __init__(self, pattern, match=None):
+        self.pattern = pattern
+        self.regex = re.compile(match) if match else None
+        self.uses_exif = re.search(r'\{exif[:!}]', pattern) is not None
+
+    def new_names(self, root, entries, exif_dates=None):
+        """Return ({relative path: new name}, {relative path: problem}) for the entries"""
+        root = os.path.join(os.path.abspath(root), '')
+        new_names = {}
+        problems = {}
+        counters = defaultdict(int)
+        exif_dates = exif_dates or {}
+        files = sorted((entry.path[len(root):], entry) for entry in entries)
+        for num, (relative, entry) in enumerate(files, 1):
+            subfolder = os.path.dirname(relative)
+            counters[subfolder] += 1
+            groups = ()
+            named = {}
+            if self.regex is not None:
+                match = self.regex.search(entry.name)
+                if match is None:
+                    problems[relative] = "does not match"
+                    continue
+                groups = (match.group(0),) + match.groups(default='')
+                named = match.groupdict(default='')
+            stem, ext = os.path.splitext(entry.name)
+            date = self.Date.fromtimestamp(entry.mtime)
+            taken = exif_dates.get(entry.path)
+            named.update(name=stem, ext=ext, num=num, counter=counters[subfolder],
+                         folder=os.path.basename(os.path.dirname(entry.path)), date=date,
+                         exif=self.Date.fromtimestamp(taken) if taken is not None else date)
+            try:
+                new_names[relative] = self.pattern.format(*groups, **named)
+            except KeyError as e:
+                problems[relative] = f"unknown field {{{e.args[0]}}}"
+            except (IndexError, ValueError, AttributeError) as e:
+                problems[relative] = f"pattern error: {e}"
+        return new_names, problems
+
+class MoveJournal:
+    """Write-ahead journal of move runs, kept in SQLite
+
+    The complete plan of a run is committed before the first file moves and
+    progress is committed after every batch, so an interrupted run can be
+    resumed and a finished one undone by replaying it backwards. Each move
+    is PENDING, DONE, UNDONE or SKIPPED; a run is 'running', 'done',
+    'undoing' or 'undone'.
+    """
+    PENDING, DONE, UNDONE, SKIPPED = 0, 1, 2, 3
+
+    def __init__(self, db_path=DATABASE_FILE):
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        # The journal has to survive a power cut, not just a crash
+        self.conn.execute('PRAGMA synchronous=FULL')
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS move_runs (
+                id INTEGER PRIMARY KEY, folder TEXT, kind TEXT, created REAL, state TEXT);
+            CREATE TABLE IF NOT EXISTS move_steps (
+                run INTEGER, seq INTEGER, source TEXT, target TEXT, state INTEGER DEFAULT 0,
+                PRIMARY KEY (run, seq)) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS move_folders (run INTEGER, path TEXT);
+        ''')
+        self.conn.commit()
+
+    def create(self, plan, kind='organize'):
+        """Record a plan as a new run and return its id"""
+        with self._lock, self.conn:
+            run = self.conn.execute('INSERT INTO move_runs (folder, kind, created, state) '
+                                    'VALUES (?, ?, ?, ?)',
+                                    (plan.folder, kind, time.time(), 'running')).lastrowid
+            self.conn.executemany('INSERT INTO move_steps (run, seq, source, target) VALUES (?, ?, ?, ?)',
+                                  [(run, seq, source, target)
+                                   for seq, (source, target) in enumerate(plan.moves)])
+            self.conn.executemany('INSERT INTO move_folders VALUES (?, ?)',
+                                  [(run, path) for path in plan.folders])
+        return run
+
+    def run_info(self, run):
+        """Return (folder, kind, state, {move state: count}) of a run"""
+        with self._lock:
+            folder, kind, state = self.conn.execute('SELECT folder, kind, state FROM move_runs '
+                                                    'WHERE id=?', (run,)).fetchone()
+            counts = dict(self.conn.execute('SELECT state, COUNT(*) FROM move_steps WHERE run=? '
+                                            'GROUP BY state', (run,)))
+        return folder, kind, state, counts
+
+    def unfinished(self):
+        """Ids of runs that were interrupted while running or undoing"""
+        with self._lock:
+            return [row[0] for row in self.conn.execute(
+                "SELECT id FROM move_runs WHERE state IN ('running', 'undoing') ORDER BY id")]
+
+    def last_done(self, folder, kind=None):
+        """Id of the latest finished run on folder, or None"""
+        with self._lock:
+            row = self.conn.execute("SELECT id FROM move_runs WHERE folder=? AND state='done' "
+                                    "AND (? IS NULL OR kind=?) ORDER BY id DESC LIMIT 1",
+                                    (folder, kind, kind)).fetchone()
+        return row[0] if row else None
+
+    def steps(self, run, state):
+        """[(seq, source, target)] of a run's moves in the given state, in order"""
+        with self._lock:
+            return self.conn.execute('SELECT seq, source, target FROM move_steps '
+                                     'WHERE run=? AND state=? ORDER BY seq', (run, state)).fetchall()
+
+    def folders(self, run):
+        """Folders the run had to create"""
+        with self._lock:
+            return [row[0] for row in self.conn.execute('SELECT path FROM move_folders WHERE run=?',
+                                                        (run,))]
+
+    def mark(self, run, seqs, state):
+        """Commit the new state of a batch of moves"""
+        if not seqs:
+            return
+        with self._lock, self.conn:
+            self.conn.executemany('UPDATE move_steps SET state=? WHERE run=? AND seq=?',
+                                  [(state, run, seq) for seq in seqs])
+
+    def retarget(self, run, seq, target):
+        """Commit a changed target before the move is made"""
+        with self._lock, self.conn:
+            self.conn.execute('UPDATE move_steps SET target=? WHERE run=? AND seq=?', (target, run, seq))
+
+    def set_state(self, run, state):
+        with self._lock, self.conn:
+            self.conn.execute('UPDATE move_runs SET state=? WHERE id=?', (state, run))
+
+    def close(self):
+        self.conn.close()
+
+class MoveEngine:
+    """Carry out, resume and undo the runs of a MoveJournal
+
+    Moves are plain os.rename calls and their progress is committed in
+    batches. Moves to another file system are collected and handed to a
+    TransferEngine a batch at a time, so they are copied in parallel and
+    verified before their sources are deleted. Running or
+    undoing a run again after an interruption picks up where it stopped: a
+    move whose source is gone but whose target exists counts as made, and
+    so does one whose target on another device has the same contents as
+    its source, which is then deleted.
+    Existing files are never overwritten; a forward move to a name that
+    appeared since planning gets a free name instead, and a move that
+    cannot be undone because its old name is taken is skipped.
+
+    progress, if given, is a dict updated with 'done', 'total', 'skipped'
+    and 'errors' (a list of messages), plus the TransferEngine counters
+    once data has to be copied.
+    """
+    def __init__(self, journal, batch_size=500, transfer=None):
+        self.journal = journal
+        self.batch_size = batch_size
+        self.transfer = transfer or TransferEngine()
+
+    def run(self, run, cancelled=None, progress=None):
+        """Make the pending moves of a run"""
+        self.journal.set_state(run, 'running')
+        for folder in self.journal.folders(run):
+            os.makedirs(folder, exist_ok=True)
+        self._replay(run, self.journal.steps(run, MoveJournal.PENDING), True, cancelled, progress)
+        self.journal.set_state(run, 'done')
+
+    def undo(self, run, cancelled=None, progress=None):
+        """Move the files of a run back, last move first"""
+        self.journal.set_state(run, 'undoing')
+        steps = self.journal.steps(run, MoveJournal.DONE)
+        self._replay(run, reversed(steps), False, cancelled, progress, total=len(steps))
+        for folder in reversed(self.journal.folders(run)):
+            try:
+                os.rmdir(folder)
+            except OSError:
+                # Not empty: something else was put there since
+                pass
+        self.journal.set_state(run, 'undone')
+
+    def _replay(self, run, steps, forward, cancelled, progress, total=None):
+        if progress is None:
+            progress = {}
+        steps = list(steps) if total is None else steps
+        progress.update(done=0, total=len(steps) if total is None else total, skipped=0, errors=[])
+        new_state = MoveJournal.DONE if forward else MoveJournal.UNDONE
+        finished = []
+        skipped = []
+        copies = []
+        self.transfer.cancelled = cancelled
+
+        def copy_batch():
+            errors = self.transfer.transfer([(src, dst) for _, src, dst in copies],
+                                            move=True, progress=progress)
+            for seq, src, _ in copies:
+                if src in errors:
+                    skipped.append(seq)
+                    progress['skipped'] += 1
+                    progress['errors'].append(f"{src}: {errors[src].strerror or errors[src]}")
+                else:
+                    finished.append(seq)
+                    progress['done'] += 1
+            copies.clear()
+
+        try:
+            for seq, source, target in steps:
+                if cancelled is not None and cancelled.is_set():
+                    raise OperationCancelled()
+                src, dst = (source, target) if forward else (target, source)
+                if os.path.lexists(dst):
+                    if not os.path.lexists(src):
+                        # Made before an interruption, but not yet committed
+                        finished.append(seq)
+                        progress['done'] += 1
+                        continue
+                    if self.transfer.is_verified_copy(src, dst):
+                        # Copied to another device, but the source was not yet deleted
+                        os.remove(src)
+                        finished.append(seq)
+                        progress['done'] += 1
+                        continue
+                    if not forward:
+                        skipped.append(seq)
+                        progress['skipped'] += 1
+                        continue
+                    dst = os.path.join(os.path.dirname(dst),
+                                       MovePlan.free_name(os.path.basename(dst),
+                                                          set(os.listdir(os.path.dirname(dst)))))
+                    self.journal.retarget(run, seq, dst)
                 try:
-                    contents = []
-                    valid_files = [target_file]
-                    
-                    for f in files:
-                        if f.endswith(('.txt', '.pdf', '.docx')):
-                            valid_files.append(os.path.join(folder_path, f))
-                    
-                    vectorizer = TfidfVectorizer()
-                    for f in valid_files:
-                        with open(f, 'r', encoding='utf-8', errors='ignore') as file:
-                            contents.append(file.read())
-                    
-                    tfidf = vectorizer.fit_transform(contents)
-                    similarities = cosine_similarity(tfidf[0:1], tfidf)[0]
-                    
-                    for i, sim in enumerate(similarities[1:], 1):
-                        if sim > threshold:
-                            similar.append(os.path.basename(valid_files[i]))
-                except Exception:
-                    pass
-            
-            return list(set(similar))
-        except Exception:
-            return []
+                    os.rename(src, dst)
+                except OSError as e:
+                    if e.errno == errno.EXDEV:
+                        copies.append((seq, src, dst))
+                        if len(copies) >= self.batch_size:
+                            copy_batch()
+                    else:
+                        skipped.append(seq)
+                        progress['skipped'] += 1
+                        progress['errors'].append(f"{src}: {e.strerror or e}")
+                else:
+                    finished.append(seq)
+                    progress['done'] += 1
+                if len(finished) >= self.batch_size:
+                    self.journal.mark(run, finished, new_state)
+                    finished.clear()
+            if copies:
+                copy_batch()
+        finally:
+            self.journal.mark(run, finished, new_state)
+            self.journal.mark(run, skipped, MoveJournal.SKIPPED)
+
+class StorageStats:
+    """Counts and bytes of a folder listing by category and by size, from one pass
+
+    Sizes go into decade buckets (0 B, 1-9 B, 10-99 B, ... 1 TB and up),
+    so a histogram of them reads like one on a log scale.
+    """
+    SIZE_EDGES = 10 ** np.arange(13, dtype=np.int64)
+    SIZE_LABELS = ['0', '1 B', '10 B', '100 B', '1 KB', '10 KB', '100 KB', '1 MB', '10 MB',
+                   '100 MB', '1 GB', '10 GB', '100 GB', '1 TB+']
+
+    def __init__(self, entries):
+        files = [entry for entry in entries if entry.is_file]
+        sizes = np.fromiter(map(operator.attrgetter('size'), files), dtype=np.int64, count=len(files))
+        codes = {}
+        category_of = np.fromiter((codes.setdefault(entry.category, len(codes)) for entry in files),
+                                  dtype=np.intp, count=len(files))
+        self.categories = list(codes)
+        self.category_counts = np.bincount(category_of, minlength=len(codes))
+        self.category_bytes = np.bincount(category_of, weights=sizes, minlength=len(codes))
+        buckets = np.searchsorted(self.SIZE_EDGES, sizes, side='right')
+        self.size_counts = np.bincount(buckets, minlength=len(self.SIZE_LABELS))
+        self.size_bytes = np.bincount(buckets, weights=sizes, minlength=len(self.SIZE_LABELS))
+        self.files = len(files)
+        self.total_size = int(sizes.sum())
+
+class StorageHistory:
+    """Persistent time series of folder sizes in the local SQLite database
+
+    Samples land in fixed-interval buckets, keeping the latest sample of
+    each, so a burst of samples adds one point. As buckets age past the
+    retention of their level they are averaged into the next coarser level
+    (5 minutes, then hourly, then daily) and daily buckets are dropped
+    after five years, so the table stays small however long it runs.
+    """
+    # (bucket seconds, how long buckets of that size are kept)
+    LEVELS = ((300, 2 * 86400), (3600, 60 * 86400), (86400, 5 * 365 * 86400))
+    COMPACT_EVERY = 3600
+
+    def __init__(self, db_path=DATABASE_FILE):
+        self._lock = threading.Lock()
+        self._compacted = 0
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS storage_history (
+                                 path TEXT, interval INTEGER, bucket INTEGER, size REAL, samples INTEGER,
+                                 PRIMARY KEY (path, interval, bucket)
+                             ) WITHOUT ROWID''')
+        self.conn.commit()
+
+    def add(self, path, size, when=None):
+        """Record the size of path now (or at when)"""
+        when = time.time() if when is None else when
+        interval = self.LEVELS[0][0]
+        with self._lock, self.conn:
+            self.conn.execute('INSERT INTO storage_history VALUES (?, ?, ?, ?, 1) '
+                              'ON CONFLICT(path, interval, bucket) '
+                              'DO UPDATE SET size=excluded.size, samples=samples+1',
+                              (path, interval, int(when // interval) * interval, size))
+        if when - self._compacted >= self.COMPACT_EVERY:
+            self.compact(when)
+
+    def compact(self, now=None):
+        """Downsample buckets past their retention and drop expired ones"""
+        now = time.time() if now is None else now
+        with self._lock, self.conn:
+            for (interval, keep), (coarse, _) in zip(self.LEVELS, self.LEVELS[1:]):
+                # Whole coarse buckets move at once, so none is split across levels
+                cutoff = int((now - keep) // coarse) * coarse
+                self.conn.execute('INSERT OR REPLACE INTO storage_history '
+                                  'SELECT path, ?, (bucket / ?) * ?, AVG(size), SUM(samples) '
+                                  'FROM storage_history WHERE interval = ? AND bucket < ? '
+                                  'GROUP BY path, bucket / ?',
+                                  (coarse, coarse, coarse, interval, cutoff, coarse))
+                self.conn.execute('DELETE FROM storage_history WHERE interval = ? AND bucket < ?',
+                                  (interval, cutoff))
+            interval, keep = self.LEVELS[-1]
+            self.conn.execute('DELETE FROM storage_history WHERE interval = ? AND bucket < ?',
+                              (interval, now - keep))
+        self._compacted = now
+
+    def series(self, path):
+        """[(bucket start, bucket seconds, size)] of path, oldest first"""
+        with self._lock:
+            return self.conn.execute('SELECT bucket, interval, size FROM storage_history '
+                                     'WHERE path = ? ORDER BY bucket', (path,)).fetchall()
+
+    def paths(self, since=0):
+        """Folders with samples newer than since"""
+        with self._lock:
+            return [row[0] for row in self.conn.execute(
+                'SELECT DISTINCT path FROM storage_history WHERE bucket >= ?', (since,))]
+
+    def close(self):
+        self.conn.close()
 
 class StoragePredictor:
-    def __init__(self):
-        self.history = defaultdict(list)
-        
+    """Linear forecast of folder sizes from their StorageHistory"""
+    # Shorter histories only measure noise
+    MIN_SPAN = 86400
+
+    def __init__(self, history=None):
+        self.history = history if history is not None else StorageHistory()
+
     def add_record(self, path, size):
         """Add storage usage record"""
-        timestamp = datetime.now()
-        self.history[path].append((timestamp, size))
-        
+        self.history.add(path, size)
+
+    def records(self, path):
+        """[(datetime, size)] recorded for path, oldest first"""
+        return [(datetime.fromtimestamp(bucket), size) for bucket, _, size in self.history.series(path)]
+
     def predict_usage(self, path, days=90):
-        """Predict future storage usage"""
-        if path not in self.history or len(self.history[path]) < 2:
+        """Predict storage usage days from now, or None without enough history"""
+        series = self.history.series(path)
+        if len(series) < 2 or series[-1][0] - series[0][0] < self.MIN_SPAN:
             return None
-            
-        records = self.history[path]
-        x = [(r[0] - records[0][0]).days for r in records]
-        y = [r[1] for r in records]
-        
-        # Simple linear regression
-        n = len(x)
-        sum_x = sum(x)
-        sum_y = sum(y)
-        sum_xy = sum(x[i] * y[i] for i in range(n))
-        sum_x2 = sum(xi**2 for xi in x)
-        
-        slope = (n * sum_xy - sum_x * sum_y) / (n * sum_x2 - sum_x**2)
-        intercept = (sum_y - slope * sum_x) / n
-        
-        future_day = (datetime.now() - records[0][0]).days + days
-        predicted = slope * future_day + intercept
-        
-        return max(0, predicted)
+        buckets, intervals, sizes = (np.array(column, dtype=np.float64) for column in zip(*series))
+        x = (buckets - buckets[0]) / 86400
+        # Weight each point by the time it covers, so the many recent
+        # 5-minute buckets do not outvote the daily ones
+        slope, intercept = np.polyfit(x, sizes, 1, w=np.sqrt(intervals))
+        future_day = (time.time() - buckets[0]) / 86400 + days
+        return max(0.0, slope * future_day + intercept)
 
 # ========== MAIN APPLICATION ==========
 class ModernFileManager(tk.Tk):
@@ -190,7 +4032,25 @@ class ModernFileManager(tk.Tk):
             'ai_enabled': True,
             'auto_clean': False,
             'notifications': True,
-            'dark_mode': True
+            'dark_mode': True,
+            'hash_workers': min(8, os.cpu_count() or 4),
+            'walk_workers': 8,
+            'transfer_workers': 8,
+            'verify_transfers': True,
+            'watch_folder': True,
+            'folder_sizes': True,
+            'sample_storage': False,
+            'sample_minutes': 60,
+            'watch_interval': 2.0,
+            'search_result_limit': 10000,
+            'ignore_rules': list(DEFAULT_IGNORE_RULES),
+            'organize_rules': list(DEFAULT_ORGANIZE_RULES),
+            'organize_recursive': False,
+            'unused_days': 365,
+            'unused_clock': 'mtime',
+            'cold_storage_folder': '',
+            'archive_format': '.tar.xz',
+            'archive_workers': os.cpu_count() or 4
         }
         
         self.current_folder = ""
@@ -198,14 +4058,33 @@ class ModernFileManager(tk.Tk):
         self.file_tags = {}
         self.file_history = {}
         self.storage_predictor = StoragePredictor()
+        self.snapshot_cache = SnapshotCache()
+        self.tree_model = TreeModel()
+        self.folder_sizes = FolderSizes(self.tree_model)
+        self.hash_cache = None
+        self.metadata_cache = None
+        self.storage_charts = None
+        self.access_history = None
+        self.file_index = None
+        self.move_journal = None
+        self.listing_job = None
+        self.size_job = None
+        self.sample_job = None
+        self.watch_job = None
+        self.name_filter = None
+        self.filter_query = None
+        self.filter_after_id = None
         self.pygame_initialized = False
         
         # Load data
         self.load_config()
+        self.ignore_rules = IgnoreRules(self.settings['ignore_rules'])
         
         # Setup UI
         self.setup_ui()
         self.apply_theme()
+        self.after(500, self.resume_interrupted_moves)
+        self.after(60000, self.sample_storage)
         
     def setup_ui(self):
         """Setup the modern UI"""
@@ -318,6 +4197,7 @@ class ModernFileManager(tk.Tk):
         
         tools = [
             ("Organize Files", "🗂️", self.start_organizing),
+            ("Undo", "↩️", self.undo_organizing),
             ("Find Duplicates", "🔍", self.find_duplicates),
             ("Clean Unused", "🧹", self.clean_unused_files),
             ("Bulk Rename", "✏️", self.bulk_rename_files),
@@ -366,9 +4246,10 @@ class ModernFileManager(tk.Tk):
         ttk.Button(search_frame, text="Search", command=self.filter_files,
                   style='Accent.TButton').pack(side=tk.LEFT)
         
-        # File list with modern styling
-        self.file_list = ttk.Treeview(browser_frame, columns=('name', 'size', 'type', 'modified', 'tags'), 
-                                     selectmode='extended', style='Treeview')
+        # File list with modern styling; only the visible rows are materialized
+        self.file_list = VirtualFileList(browser_frame, row_values=self.file_row_values,
+                                         columns=('name', 'size', 'type', 'modified', 'tags'), 
+                                         selectmode='extended', style='Treeview')
         self.file_list.heading('#0', text='')
         self.file_list.heading('name', text='File Name')
         self.file_list.heading('size', text='Size')
@@ -493,6 +4374,8 @@ class ModernFileManager(tk.Tk):
             ("Open With...", self.open_with),
             ("Rename", self.rename_file),
             ("Delete", self.delete_file),
+            ("Copy To...", lambda: self.transfer_selected(move=False)),
+            ("Move To...", lambda: self.transfer_selected(move=True)),
             ("Copy Path", self.copy_path),
             ("Show in Explorer", self.show_in_explorer),
             ("Properties", self.show_properties)
@@ -661,9 +4544,8 @@ class ModernFileManager(tk.Tk):
         """Set the current working folder"""
         if os.path.isdir(path):
             self.current_folder = path
-            self.update_file_list()
-            self.update_storage_stats()
             self.update_folder_info()
+            self.update_file_list()
             self.path_display.config(text=path)
     
     def select_folder(self):
@@ -672,62 +4554,231 @@ class ModernFileManager(tk.Tk):
         if folder:
             self.set_folder(folder)
     
-    def go_home(self):
-        """Navigate to home directory"""
-        self.set_folder(os.path.expanduser("~"))
+    def go_home(self):
+        """Navigate to home directory"""
+        self.set_folder(os.path.expanduser("~"))
+    
+    def go_up(self):
+        """Navigate up one directory level"""
+        if self.current_folder and os.path.dirname(self.current_folder) != self.current_folder:
+            self.set_folder(os.path.dirname(self.current_folder))
+    
+    def update_file_list(self):
+        """Update the file list view
+        
+        The folder is listed on a worker thread and the rows are streamed into
+        the view in batches, so large folders never block the window.
+        """
+        path = self.current_folder
+        if not path or not os.path.isdir(path):
+            return
+        
+        # Navigating away cancels the listing that is still running
+        if self.listing_job:
+            self.listing_job.cancel()
+        if self.watch_job:
+            self.watch_job.cancel()
+            self.watch_job = None
+        if self.size_job:
+            self.size_job.cancel()
+            self.size_job = None
+        self.name_filter = None
+        
+        self.file_list.clear()
+        
+        # Add ".." for parent directory
+        if os.path.dirname(path) != path:
+            self.file_list.insert('', tk.END, 
+                                values=("..", "", "Parent Directory", "", ""))
+        
+        loaded = [0]
+        
+        def list_folder(job):
+            snapshot = self.snapshot_cache.lookup(path)
+            if snapshot is not None:
+                for i in range(0, len(snapshot.entries), 1000):
+                    if job.is_cancelled:
+                        return
+                    job.post('batch', snapshot.entries[i:i + 1000])
+            else:
+                snapshot = DirectorySnapshot.scan(
+                    path, on_batch=lambda batch: job.post('batch', batch),
+                    cancelled=job.cancelled)
+                if snapshot is None:
+                    return
+                self.snapshot_cache.put(snapshot)
+            job.post('snapshot', snapshot)
+            # The filter index is built off the main thread as well
+            job.post('filter', NameFilter(snapshot.entries))
+        
+        def on_message(kind, payload):
+            if kind == 'batch':
+                self.file_list.extend(payload)
+                loaded[0] += len(payload)
+                self.status_text.set(f"Loading... {loaded[0]} items")
+            elif kind == 'snapshot':
+                self.update_folder_info(len(payload.files), len(payload.folders))
+                self.status_text.set("Ready")
+                
+                # Record storage usage for prediction
+                self.storage_predictor.add_record(path, payload.total_size)
+                self.update_storage_stats()
+                self.watch_folder(payload)
+                if self.settings.get('folder_sizes', True) and payload.folders:
+                    self.compute_folder_sizes(path)
+            elif kind == 'filter':
+                self.name_filter = payload
+                if self.search_var.get():
+                    self.filter_files()
+            elif kind == 'error':
+                self.status_text.set(f"Error: {str(payload)}")
+        
+        self.status_text.set("Loading...")
+        self.listing_job = BackgroundJob(self, list_folder, on_message).start()
+    
+    def compute_folder_sizes(self, path, on_done=None):
+        """Total up the folders below path in the background
+        
+        The tree model is refreshed incrementally, so only folders that
+        changed since the last time are listed again. Like du -x, the walk
+        stays on path's file system. The file list's folder rows and the
+        storage stats pick the totals up when done; on_done, if given, is
+        called with the totals of path.
+        """
+        progress = {}
+        
+        def work(job):
+            self.tree_model.refresh(path, job.cancelled, progress, workers=self.settings['walk_workers'],
+                                    rules=self.ignore_rules, one_device=True)
+            job.post('sizes', self.folder_sizes.update(path))
+        
+        def show_progress():
+            if job.finished or job.is_cancelled:
+                return
+            if progress.get('dirs'):
+                self.status_text.set(f"Sizing folders... {progress['dirs']} folders")
+            self.after(250, show_progress)
+        
+        def on_message(kind, payload):
+            if kind == 'sizes':
+                if path == self.current_folder:
+                    for i, row in enumerate(self.file_list.rows):
+                        if isinstance(row, FileEntry) and not row.is_file:
+                            self.file_list.set_row(i, row)
+                    self.update_storage_stats()
+                if on_done:
+                    on_done(payload)
+            elif kind == 'error':
+                self.status_text.set(f"Error: {str(payload)}")
+        
+        job = BackgroundJob(self, work, on_message).start()
+        if on_done is None:
+            self.size_job = job
+        show_progress()
+        return job
+    
+    def watch_folder(self, snapshot):
+        """Keep the listing of the shown folder in sync with the disk
+        
+        Changes are applied to the caches and the file index on the watcher
+        thread and to the file list row by row, so a change to one file
+        never reloads the whole folder. The list is updated before the
+        index, which may be busy with a refresh.
+        """
+        if self.watch_job:
+            self.watch_job.cancel()
+            self.watch_job = None
+        if not self.settings.get('watch_folder', True):
+            return
+        
+        path = snapshot.path
+        watcher = FolderWatcher(path, snapshot.mtime_ns, self.settings.get('watch_interval', 2.0))
+        
+        def watch(job):
+            def on_changes(names):
+                try:
+                    update = None if names is None else FolderUpdate.resolve(path, names)
+                except OSError:
+                    update = None
+                if update is None:
+                    job.post('reload')
+                    return
+                self.sync_caches(update)
+                job.post('update', update)
+                if self.file_index is not None:
+                    self.file_index.apply(update)
+            
+            watcher.run(job.cancelled, on_changes)
+        
+        def on_message(kind, payload):
+            if kind == 'update':
+                self.show_folder_update(payload)
+            elif kind == 'reload':
+                self.snapshot_cache.invalidate(path)
+                self.update_file_list()
+            elif kind == 'error':
+                self.status_text.set(f"Stopped watching folder: {str(payload)}")
+        
+        self.watch_job = BackgroundJob(self, watch, on_message, interval=100).start()
+    
+    def sync_caches(self, update):
+        """Apply a FolderUpdate to the in-memory folder caches"""
+        self.snapshot_cache.apply(update)
+        self.tree_model.apply(update)
     
-    def go_up(self):
-        """Navigate up one directory level"""
-        if self.current_folder and os.path.dirname(self.current_folder) != self.current_folder:
-            self.set_folder(os.path.dirname(self.current_folder))
+    def refresh_entries(self, names):
+        """Re-read the named entries of the current folder after changing them"""
+        try:
+            update = FolderUpdate.resolve(self.current_folder, names)
+        except OSError:
+            self.update_file_list()
+            return
+        self.sync_caches(update)
+        self.show_folder_update(update)
     
-    def update_file_list(self):
-        """Update the file list view"""
-        path = self.current_folder
-        if not path or not os.path.isdir(path):
+    def show_folder_update(self, update):
+        """Apply a FolderUpdate to the file list, touching only the affected rows"""
+        if update.path != self.current_folder:
+            return
+        if self.listing_job and not self.listing_job.finished:
+            # The listing still running picks the change up from disk
             return
         
-        self.file_list.delete(*self.file_list.get_children())
+        if self.name_filter is not None:
+            self.name_filter.apply(update)
+        if self.search_var.get():
+            self.filter_files()
+        else:
+            index = {row.name: i for i, row in enumerate(self.file_list.rows)
+                     if isinstance(row, FileEntry)}
+            added = []
+            for entry in update.changed:
+                if entry.name in index:
+                    self.file_list.set_row(index[entry.name], entry)
+                else:
+                    added.append(entry)
+            self.file_list.delete(*(index[name] for name in update.removed if name in index))
+            self.file_list.extend(added)
         
         try:
-            files = 0
-            folders = 0
-            total_size = 0
-            
-            # Add ".." for parent directory
-            if os.path.dirname(path) != path:
-                self.file_list.insert('', tk.END, 
-                                    values=("..", "", "Parent Directory", "", ""))
-            
-            for item in os.listdir(path):
-                item_path = os.path.join(path, item)
-                
-                if os.path.isfile(item_path):
-                    size = os.path.getsize(item_path)
-                    total_size += size
-                    date = datetime.fromtimestamp(os.path.getmtime(item_path))
-                    created = datetime.fromtimestamp(os.path.getctime(item_path))
-                    ext = os.path.splitext(item)[1].lower()
-                    tags = self.file_tags.get(item, "")
-                    
-                    self.file_list.insert('', tk.END, 
-                                        values=(item, self.format_size(size), 
-                                                EXTENSION_FOLDERS.get(ext, 'Other'), 
-                                                date.strftime('%d.%m.%Y %H:%M'),
-                                                tags))
-                    files += 1
-                else:
-                    self.file_list.insert('', tk.END, 
-                                       values=(item, "", "Folder", "", ""))
-                    folders += 1
-            
-            self.update_folder_info(files, folders)
-            self.status_text.set("Ready")
-            
-            # Record storage usage for prediction
-            self.storage_predictor.add_record(path, total_size)
-        except Exception as e:
-            self.status_text.set(f"Error: {str(e)}")
+            snapshot = self.snapshot_cache.lookup(update.path)
+        except OSError:
+            snapshot = None
+        if snapshot is not None:
+            self.update_folder_info(len(snapshot.files), len(snapshot.folders))
+    
+    def file_row_values(self, row):
+        """Format a file list model row (a FileEntry or a literal value tuple)"""
+        return row if isinstance(row, tuple) else self.entry_values(row)
+    
+    def entry_values(self, entry):
+        """Build the file list row for a snapshot entry"""
+        if not entry.is_file:
+            totals = self.folder_sizes.get(os.path.abspath(entry.path))
+            return (entry.name, self.format_size(totals[0]) if totals else "", "Folder", "", "")
+        date = datetime.fromtimestamp(entry.mtime)
+        return (entry.name, self.format_size(entry.size), entry.category,
+                date.strftime('%d.%m.%Y %H:%M'), self.file_tags.get(entry.name, ""))
     
     def update_folder_info(self, files=0, folders=0):
         """Update folder information display"""
@@ -752,75 +4803,324 @@ class ModernFileManager(tk.Tk):
             self.folder_stats.config(text=f"Files: {files} | Folders: {folders}")
     
     def start_organizing(self):
-        """Start organizing files into categorized folders"""
+        """Plan sorting the files of the folder into category folders and preview it"""
         path = self.current_folder
         if not path or not os.path.isdir(path):
             messagebox.showwarning("Warning", "Please select a valid folder")
             return
         
         try:
-            for item in os.listdir(path):
-                item_path = os.path.join(path, item)
-                if os.path.isfile(item_path):
-                    ext = os.path.splitext(item)[1].lower()
-                    folder_name = EXTENSION_FOLDERS.get(ext, 'Other')
-                    target_dir = os.path.join(path, folder_name)
-                    
-                    os.makedirs(target_dir, exist_ok=True)
-                    shutil.move(item_path, os.path.join(target_dir, item))
-            
-            messagebox.showinfo("Success", "Files organized successfully!")
-            self.update_file_list()
-            self.update_storage_stats()
-        except Exception as e:
-            messagebox.showerror("Error", f"Error while organizing:\n{str(e)}")
+            rules = OrganizeRules(self.settings['organize_rules'])
+        except ValueError as e:
+            messagebox.showerror("Error", f"Invalid organize rules:\n{str(e)}")
+            return
+        recursive = self.settings['organize_recursive']
+        
+        def plan_moves(job):
+            if recursive:
+                files = self.tree_model.walk_files([path], job.cancelled,
+                                                   workers=self.settings['walk_workers'],
+                                                   rules=self.ignore_rules)
+            else:
+                files = self.snapshot_cache.get(path).files
+            job.post('plan', MovePlan.organize(path, files, rules))
+        
+        def on_message(kind, payload):
+            if kind == 'plan':
+                self.status_text.set("Ready")
+                self.show_move_plan(payload)
+            elif kind == 'error':
+                messagebox.showerror("Error", f"Error while organizing:\n{str(payload)}")
+        
+        self.status_text.set("Planning...")
+        BackgroundJob(self, plan_moves, on_message).start()
+    
+    def show_move_plan(self, plan):
+        """Preview a move plan (a dry run) and run it when confirmed"""
+        if not plan.moves:
+            messagebox.showinfo("Organize", "There are no files to organize")
+            return
+        
+        dialog = tk.Toplevel(self)
+        dialog.title("Organize Preview")
+        dialog.geometry("700x450")
+        
+        summary = f"{len(plan.moves)} files will be moved into {len(plan.folders)} new folders"
+        if plan.renamed:
+            summary += f", {plan.renamed} renamed to avoid overwriting existing files"
+        if plan.skipped:
+            summary += f", {len(plan.skipped)} skipped"
+        ttk.Label(dialog, text=summary).pack(anchor=tk.W, padx=10, pady=10)
+        
+        frame = ttk.Frame(dialog)
+        frame.pack(fill=tk.BOTH, expand=True, padx=10)
+        
+        def move_values(move):
+            source, target = move
+            note = " (renamed)" if os.path.basename(source) != os.path.basename(target) else ""
+            return (os.path.relpath(source, plan.folder), os.path.relpath(target, plan.folder) + note)
+        
+        moves_list = VirtualFileList(frame, columns=('file', 'target'), show='headings',
+                                     row_values=move_values)
+        moves_list.heading('file', text='File')
+        moves_list.heading('target', text='Moves To')
+        moves_list.column('file', width=300)
+        moves_list.column('target', width=350)
+        scroll_y = ttk.Scrollbar(frame, orient=tk.VERTICAL, command=moves_list.yview)
+        scroll_y.pack(side=tk.RIGHT, fill=tk.Y)
+        moves_list.configure(yscrollcommand=scroll_y.set)
+        moves_list.pack(fill=tk.BOTH, expand=True)
+        moves_list.extend(plan.moves)
+        
+        def run_plan():
+            dialog.destroy()
+            run = self.get_move_journal().create(plan)
+            self.run_moves(run)
+        
+        btn_frame = ttk.Frame(dialog)
+        btn_frame.pack(fill=tk.X, padx=10, pady=10)
+        
+        ttk.Button(btn_frame, text="Organize", command=run_plan,
+                  style='Accent.TButton').pack(side=tk.LEFT)
+        ttk.Button(btn_frame, text="Cancel", command=dialog.destroy).pack(side=tk.RIGHT)
+    
+    def get_metadata_cache(self):
+        """Return the file metadata cache, opening it on first use"""
+        if self.metadata_cache is None:
+            self.metadata_cache = MetadataCache()
+        return self.metadata_cache
+    
+    def get_access_history(self):
+        """Return the history of files opened from the app, opening it on first use"""
+        if self.access_history is None:
+            self.access_history = AccessHistory()
+        return self.access_history
+    
+    def get_move_journal(self):
+        """Return the move journal, opening it on first use"""
+        if self.move_journal is None:
+            self.move_journal = MoveJournal()
+        return self.move_journal
+    
+    def run_moves(self, run, undo=False):
+        """Run (or undo) a journaled move run in the background"""
+        journal = self.get_move_journal()
+        engine = MoveEngine(journal, transfer=self.get_transfer_engine())
+        folder, kind = journal.run_info(run)[:2]
+        progress = {'done': 0, 'total': 0, 'skipped': 0, 'errors': []}
+        failed = []
+        verb = "Undoing" if undo else "Renaming" if kind == 'rename' else "Moving"
+        done_verb = "renamed" if kind == 'rename' else "moved"
+        
+        def work(job):
+            if undo:
+                engine.undo(run, job.cancelled, progress)
+            else:
+                engine.run(run, job.cancelled, progress)
+        
+        def show_progress():
+            if job.finished:
+                return
+            status = f"{verb} files... {progress['done']} of {progress['total']}"
+            if progress.get('bytes_total'):
+                status += f" ({self.format_size(TransferEngine.throughput(progress))}/s)"
+            self.status_text.set(status)
+            self.after(250, show_progress)
+        
+        def on_message(kind, payload):
+            if kind == 'error':
+                failed.append(payload)
+                messagebox.showerror("Error", f"{verb} stopped:\n{str(payload)}\n\n"
+                                              "It can be resumed the next time the app starts.")
+            elif kind == 'done':
+                self.status_text.set("Ready")
+                self.snapshot_cache.invalidate(folder)
+                if folder == self.current_folder:
+                    self.update_file_list()
+                if failed:
+                    return
+                message = f"{progress['done']} files {done_verb}{' back' if undo else ''}"
+                if progress['skipped']:
+                    message += f", {progress['skipped']} skipped"
+                    message += "\n\n" + "\n".join(progress['errors'][:10])
+                messagebox.showinfo("Success", message)
+        
+        job = BackgroundJob(self, work, on_message).start()
+        show_progress()
+    
+    def get_transfer_engine(self):
+        """Return a TransferEngine configured from the settings"""
+        return TransferEngine(workers=self.settings['transfer_workers'],
+                              verify=self.settings['verify_transfers'],
+                              walk_workers=self.settings['walk_workers'], rules=self.ignore_rules)
+    
+    def transfer_selected(self, move=False):
+        """Copy or move the selected files and folders to another folder"""
+        names = [self.file_list.item(item)['values'][0] for item in self.file_list.selection()]
+        if not names:
+            return
+        target = filedialog.askdirectory(title="Move To" if move else "Copy To")
+        if not target:
+            return
+        folder = self.current_folder
+        pairs = [(os.path.join(folder, name), os.path.join(target, name)) for name in names]
+        taken = [name for name in names if os.path.lexists(os.path.join(target, name))]
+        if taken:
+            messagebox.showerror("Error", "These already exist in the target folder:\n" +
+                                 "\n".join(taken[:10]))
+            return
+        
+        engine = self.get_transfer_engine()
+        progress = {}
+        verb = "Moving" if move else "Copying"
+        
+        def work(job):
+            engine.cancelled = job.cancelled
+            failed = engine.transfer(pairs, move=move, progress=progress)
+            if failed:
+                job.post('failed', failed)
+        
+        def show_progress():
+            if job.finished:
+                return
+            self.status_text.set(f"{verb}... {progress.get('files_done', 0)} of "
+                                 f"{progress.get('files_total', 0)} files, "
+                                 f"{self.format_size(progress.get('bytes_done', 0))} "
+                                 f"({self.format_size(TransferEngine.throughput(progress))}/s)")
+            self.after(250, show_progress)
+        
+        def on_message(kind, payload):
+            if kind == 'error':
+                messagebox.showerror("Error", f"{verb} stopped:\n{str(payload)}")
+            elif kind == 'failed':
+                messagebox.showerror("Error", f"{len(payload)} could not be "
+                                              f"{'moved' if move else 'copied'}:\n" +
+                                     "\n".join(f"{path}: {e.strerror or e}"
+                                               for path, e in list(payload.items())[:10]))
+            elif kind == 'done':
+                rate = TransferEngine.throughput(progress)
+                self.status_text.set(f"{progress.get('files_done', 0)} files "
+                                     f"{'moved' if move else 'copied'} "
+                                     f"({self.format_size(rate)}/s)")
+                self.snapshot_cache.invalidate(target)
+                if move:
+                    self.refresh_entries(names)
+        
+        job = BackgroundJob(self, work, on_message).start()
+        show_progress()
+    
+    def run_renames(self, plan, dialog=None):
+        """Confirm a RenamePlan, listing its conflicts, and run it in the background"""
+        if not plan.renames:
+            reasons = "\n".join(f"{old}: {reason}" for old, reason in list(plan.conflicts.items())[:10])
+            messagebox.showinfo("Bulk Rename", "There is nothing to rename" +
+                                (f"\n\n{reasons}" if reasons else ""))
+            return
+        question = f"Rename {len(plan.renames)} files?"
+        if plan.conflicts:
+            question += (f"\n\n{len(plan.conflicts)} files will keep their names:\n" +
+                         "\n".join(f"{old}: {reason}"
+                                   for old, reason in list(plan.conflicts.items())[:10]))
+        if not messagebox.askyesno("Confirm", question):
+            return
+        if dialog is not None:
+            dialog.destroy()
+        run = self.get_move_journal().create(plan, 'rename')
+        self.run_moves(run)
+    
+    def undo_organizing(self):
+        """Undo the last organize or bulk rename run on this folder"""
+        path = self.current_folder
+        run = self.get_move_journal().last_done(path) if path else None
+        if run is None:
+            messagebox.showinfo("Undo", "There is nothing to undo for this folder")
+            return
+        kind = self.move_journal.run_info(run)[1]
+        if messagebox.askyesno("Undo", f"Undo the last {kind} of this folder and put "
+                                       f"the files back the way they were?"):
+            self.run_moves(run, undo=True)
+    
+    def resume_interrupted_moves(self):
+        """Offer to finish runs that were interrupted by a crash or a closed window"""
+        try:
+            runs = self.get_move_journal().unfinished()
+        except sqlite3.Error:
+            return
+        for run in runs:
+            folder, kind, state, counts = self.move_journal.run_info(run)
+            if state == 'undoing':
+                if messagebox.askyesno("Resume", f"Undoing the {kind} of {folder} was interrupted.\n"
+                                                 "Finish moving the files back?"):
+                    self.run_moves(run, undo=True)
+                continue
+            done = counts.get(MoveJournal.DONE, 0)
+            total = sum(counts.values())
+            answer = messagebox.askyesnocancel(
+                "Resume", f"The {kind} of {folder} was interrupted after {done} of {total} files.\n\n"
+                          "Yes resumes it, No moves the files already moved back.")
+            if answer:
+                self.run_moves(run)
+            elif answer is False:
+                self.run_moves(run, undo=True)
     
     def find_duplicates(self):
-        """Find duplicate files in current folder"""
+        """Find duplicate files in one or more folders"""
         path = self.current_folder
         if not path or not os.path.isdir(path):
             messagebox.showwarning("Warning", "Please select a valid folder")
             return
         
-        # Group files by size first (quick check)
-        size_groups = defaultdict(list)
-        for item in os.listdir(path):
-            item_path = os.path.join(path, item)
-            if os.path.isfile(item_path):
-                size = os.path.getsize(item_path)
-                size_groups[size].append(item_path)
-        
-        # Then check hash for files with same size
-        duplicates = []
-        for size, files in size_groups.items():
-            if len(files) > 1:
-                hash_groups = defaultdict(list)
-                for file in files:
-                    with open(file, 'rb') as f:
-                        file_hash = hashlib.md5(f.read()).hexdigest()
-                    hash_groups[file_hash].append(file)
-                
-                for hash, same_files in hash_groups.items():
-                    if len(same_files) > 1:
-                        duplicates.append(same_files)
-        
-        if not duplicates:
-            messagebox.showinfo("Info", "No duplicate files found")
-            return
-        
-        # Show duplicates in a new window
+        # Show duplicates in a new window that fills in while hashing runs
         dialog = tk.Toplevel(self)
         dialog.title("Duplicate Files")
-        dialog.geometry("600x400")
+        dialog.geometry("750x550")
+        
+        # Scan options: several roots can be scanned together
+        roots = [path]
+        options_frame = ttk.Frame(dialog)
+        options_frame.pack(fill=tk.X, padx=10, pady=(10, 0))
+        
+        roots_label = ttk.Label(options_frame, text=f"Folders: {path}")
+        roots_label.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        recursive_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(options_frame, text="Include subfolders",
+                        variable=recursive_var).pack(side=tk.LEFT, padx=5)
+        
+        def add_root():
+            folder = filedialog.askdirectory(parent=dialog)
+            if folder and folder not in roots:
+                roots.append(folder)
+                recursive_var.set(True)
+                roots_label.config(text="Folders: " + "; ".join(roots))
+        
+        ttk.Button(options_frame, text="Add Folder...", command=add_root).pack(side=tk.LEFT, padx=5)
+        scan_button = ttk.Button(options_frame, text="Scan", style='Accent.TButton')
+        scan_button.pack(side=tk.LEFT)
+        
+        progress_frame = ttk.Frame(dialog)
+        progress_frame.pack(fill=tk.X, padx=10, pady=(10, 5))
+        
+        progress_label = ttk.Label(progress_frame, text="Scanning...")
+        progress_label.pack(fill=tk.X)
+        progress_bar = ttk.Progressbar(progress_frame, mode='determinate', maximum=100)
+        progress_bar.pack(side=tk.LEFT, fill=tk.X, expand=True, pady=5)
+        cancel_button = ttk.Button(progress_frame, text="Cancel")
+        cancel_button.pack(side=tk.RIGHT, padx=(5, 0))
+        
+        # Action buttons are packed before the tree so they keep their space
+        btn_frame = ttk.Frame(dialog)
+        btn_frame.pack(side=tk.BOTTOM, fill=tk.X, padx=10, pady=10)
         
-        tree = ttk.Treeview(dialog, columns=('file', 'size'), selectmode='browse')
+        tree = ttk.Treeview(dialog, columns=('file', 'size', 'reclaimable'), selectmode='extended')
         tree.heading('#0', text='Group')
         tree.heading('file', text='File')
         tree.heading('size', text='Size')
+        tree.heading('reclaimable', text='Reclaimable')
         
-        tree.column('#0', width=50, stretch=tk.NO)
-        tree.column('file', width=400)
-        tree.column('size', width=100)
+        tree.column('#0', width=70, stretch=tk.NO)
+        tree.column('file', width=450)
+        tree.column('size', width=90)
+        tree.column('reclaimable', width=90)
         
         scroll_y = ttk.Scrollbar(dialog, orient=tk.VERTICAL, command=tree.yview)
         scroll_y.pack(side=tk.RIGHT, fill=tk.Y)
@@ -828,93 +5128,476 @@ class ModernFileManager(tk.Tk):
         
         tree.pack(fill=tk.BOTH, expand=True)
         
-        for i, group in enumerate(duplicates, 1):
-            for file in group:
-                size = os.path.getsize(file)
-                tree.insert('', tk.END, values=(file, self.format_size(size)), text=str(i))
+        # Groups are kept ranked by reclaimable bytes as they stream in
+        group_items = {}
+        ranking = []
+        
+        def add_group(group):
+            index = bisect.bisect_right(ranking, -group.reclaimable)
+            ranking.insert(index, -group.reclaimable)
+            iid = tree.insert('', index, open=True, text=f"{len(group.paths)} files",
+                              values=("", self.format_size(group.size),
+                                      self.format_size(group.reclaimable)))
+            group_items[iid] = group
+            for copy in group.copies:
+                for file in copy:
+                    note = "hardlinked" if len(copy) > 1 else ""
+                    tree.insert(iid, tk.END, values=(file, self.format_size(group.size), note))
+        
+        def remove_group(iid):
+            del ranking[tree.index(iid)]
+            del group_items[iid]
+            tree.delete(iid)
+        
+        def update_group(iid):
+            # The group shrank: show its new totals and move it to its new rank
+            group = group_items[iid]
+            del ranking[tree.index(iid)]
+            index = bisect.bisect_right(ranking, -group.reclaimable)
+            ranking.insert(index, -group.reclaimable)
+            tree.item(iid, text=f"{len(group.paths)} files",
+                      values=("", self.format_size(group.size), self.format_size(group.reclaimable)))
+            tree.move(iid, '', index)
+        
+        # Size, then partial hashes, then a full streaming hash on a thread pool
+        if self.hash_cache is None:
+            self.hash_cache = HashCache()
+        state = {'job': None, 'finder': None, 'started': 0.0, 'status': "", 'hashed': ""}
+        
+        def start_scan():
+            if state['job']:
+                state['job'].cancel()
+            for iid in list(group_items):
+                remove_group(iid)
+            finder = DuplicateFinder(workers=self.settings['hash_workers'], cache=self.hash_cache)
+            scan_roots = list(roots)
+            recursive = recursive_var.get()
+            
+            def scan(job):
+                finder.cancelled = job.cancelled
+                if recursive:
+                    files = TreeWalker.iter_files(scan_roots, cancelled=job.cancelled,
+                                                  workers=self.settings['walk_workers'],
+                                                  rules=self.ignore_rules)
+                else:
+                    files = (entry for root in scan_roots
+                             for entry in self.snapshot_cache.get(root).files)
+                try:
+                    finder.find(files, on_group=lambda group: job.post('group', group))
+                except OperationCancelled:
+                    pass
+            
+            state.update(finder=finder, started=time.perf_counter(), status="")
+            state['job'] = BackgroundJob(dialog, scan, on_message).start()
+            cancel_button.config(command=state['job'].cancel, state=tk.NORMAL)
+            update_progress(state['job'])
+        
+        def on_message(kind, payload):
+            if kind == 'group':
+                add_group(payload)
+            elif kind == 'error':
+                messagebox.showerror("Error", f"Duplicate scan failed:\n{str(payload)}", parent=dialog)
+        
+        def update_progress(job):
+            if not dialog.winfo_exists() or job is not state['job']:
+                return
+            finder = state['finder']
+            elapsed = max(time.perf_counter() - state['started'], 1e-6)
+            rate = self.format_size(finder.bytes_hashed / elapsed)
+            if job.finished or job.is_cancelled:
+                state['status'] = "Cancelled" if job.is_cancelled else "Done"
+                state['hashed'] = f"{self.format_size(finder.bytes_hashed)} hashed ({rate}/s)"
+                show_summary()
+                progress_bar['value'] = 100
+                cancel_button.config(state=tk.DISABLED)
+                return
+            if finder.files_total:
+                progress_bar['value'] = 100 * finder.files_done / finder.files_total
+            progress_label.config(text=f"{finder.stage}: {finder.files_done}/{finder.files_total} files | "
+                                       f"{self.format_size(finder.bytes_hashed)} hashed ({rate}/s)")
+            dialog.after(250, update_progress, job)
+        
+        def show_summary():
+            # Only once the scan is over; until then update_progress owns the label
+            if state['status']:
+                found = len(group_items) or "No"
+                total = self.format_size(sum(g.reclaimable for g in group_items.values()))
+                progress_label.config(text=f"{state['status']}: {found} duplicate groups, {total} "
+                                           f"reclaimable | {state['hashed']}")
+        
+        def close():
+            if state['job']:
+                state['job'].cancel()
+            dialog.destroy()
+        
+        scan_button.config(command=start_scan)
+        dialog.protocol("WM_DELETE_WINDOW", close)
+        start_scan()
         
         def delete_selected():
-            selected = tree.selection()
+            selected = [iid for iid in tree.selection() if tree.parent(iid)]
             if selected:
-                item = tree.item(selected[0])
-                file = item['values'][0]
-                if messagebox.askyesno("Confirm", f"Delete '{os.path.basename(file)}'?"):
+                file = tree.item(selected[0])['values'][0]
+                if messagebox.askyesno("Confirm", f"Delete '{os.path.basename(file)}'?", parent=dialog):
                     try:
                         os.remove(file)
+                        parent = tree.parent(selected[0])
                         tree.delete(selected[0])
+                        group_items[parent].discard(file)
+                        if len(group_items[parent].copies) < 2:
+                            remove_group(parent)
+                        else:
+                            update_group(parent)
+                        show_summary()
                     except Exception as e:
-                        messagebox.showerror("Error", f"Delete failed:\n{str(e)}")
+                        messagebox.showerror("Error", f"Delete failed:\n{str(e)}", parent=dialog)
         
-        btn_frame = ttk.Frame(dialog)
-        btn_frame.pack(fill=tk.X, padx=10, pady=10)
+        # Reclaim replaces every copy but the first with a link to it
+        link_modes = {"Reflink, else hardlink": 'auto', "Hardlink": 'hardlink', "Reflink": 'reflink'}
+        mode_var = tk.StringVar(value="Reflink, else hardlink")
+        
+        def reclaim(items):
+            items = [iid for iid in items if iid in group_items]
+            if not items:
+                return
+            total = sum(group_items[iid].reclaimable for iid in items)
+            if not messagebox.askyesno("Confirm", f"Replace duplicates in {len(items)} groups with links "
+                                                  f"and reclaim {self.format_size(total)}?", parent=dialog):
+                return
+            groups = [(iid, group_items[iid]) for iid in items]
+            mode = link_modes[mode_var.get()]
+            freed = [0]
+            failures = []
+            
+            def run(job):
+                for iid, group in groups:
+                    if job.is_cancelled:
+                        return
+                    try:
+                        job.post('reclaimed', (iid, group.reclaim(mode)))
+                    except OSError as e:
+                        job.post('failed', (iid, str(e)))
+            
+            def on_reclaim(kind, payload):
+                if kind == 'reclaimed':
+                    freed[0] += payload[1]
+                    if payload[0] in group_items:
+                        remove_group(payload[0])
+                    progress_label.config(text=f"Reclaimed {self.format_size(freed[0])}...")
+                elif kind == 'failed':
+                    failures.append(payload[1])
+                elif kind == 'done':
+                    show_summary()
+                    message = f"Reclaimed {self.format_size(freed[0])}"
+                    if failures:
+                        message += f"\n{len(failures)} groups skipped:\n" + "\n".join(failures[:5])
+                    messagebox.showinfo("Reclaim", message, parent=dialog)
+            
+            BackgroundJob(dialog, run, on_reclaim).start()
+        
+        def reclaim_selected():
+            reclaim({tree.parent(iid) or iid for iid in tree.selection()})
         
         ttk.Button(btn_frame, text="Delete Selected", command=delete_selected,
                   style='Accent.TButton').pack(side=tk.LEFT)
-        ttk.Button(btn_frame, text="Close", command=dialog.destroy).pack(side=tk.RIGHT)
+        ttk.Button(btn_frame, text="Reclaim Selected", command=reclaim_selected).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="Reclaim All",
+                   command=lambda: reclaim(tree.get_children())).pack(side=tk.LEFT)
+        ttk.Combobox(btn_frame, textvariable=mode_var, values=list(link_modes), state='readonly',
+                     width=22).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="Close", command=close).pack(side=tk.RIGHT)
     
     def clean_unused_files(self):
-        """Clean unused files (not accessed in 1 year)"""
+        """Find files not used for a while below the current folder and act on them in bulk"""
         path = self.current_folder
         if not path or not os.path.isdir(path):
             messagebox.showwarning("Warning", "Please select a valid folder")
             return
         
-        threshold_date = datetime.now() - timedelta(days=365)
-        unused_files = []
-        
-        for item in os.listdir(path):
-            item_path = os.path.join(path, item)
-            if os.path.isfile(item_path):
-                last_accessed = datetime.fromtimestamp(os.path.getatime(item_path))
-                if last_accessed < threshold_date:
-                    unused_files.append((item, last_accessed.strftime('%Y-%m-%d')))
-        
-        if not unused_files:
-            messagebox.showinfo("Info", "No unused files found (not accessed in 1 year)")
-            return
-        
-        # Show unused files in a new window
         dialog = tk.Toplevel(self)
         dialog.title("Unused Files")
-        dialog.geometry("600x400")
-        
-        tree = ttk.Treeview(dialog, columns=('file', 'last_accessed'), selectmode='browse')
-        tree.heading('#0', text='')
-        tree.heading('file', text='File')
-        tree.heading('last_accessed', text='Last Accessed')
-        
-        tree.column('#0', width=0, stretch=tk.NO)
-        tree.column('file', width=400)
-        tree.column('last_accessed', width=150)
-        
-        scroll_y = ttk.Scrollbar(dialog, orient=tk.VERTICAL, command=tree.yview)
+        dialog.geometry("800x650")
+        
+        form = ttk.Frame(dialog)
+        form.pack(fill=tk.X, padx=10, pady=5)
+        
+        clock_names = list(StaleFileScan.CLOCKS.values())
+        clock_keys = list(StaleFileScan.CLOCKS)
+        days_var = tk.IntVar(value=self.settings['unused_days'])
+        clock_var = tk.StringVar(value=StaleFileScan.CLOCKS.get(self.settings['unused_clock'],
+                                                                clock_names[0]))
+        recursive_var = tk.BooleanVar(value=True)
+        ttk.Label(form, text="Not used for").pack(side=tk.LEFT)
+        ttk.Spinbox(form, from_=1, to=36500, textvariable=days_var, width=6).pack(side=tk.LEFT, padx=5)
+        ttk.Label(form, text="days, by").pack(side=tk.LEFT)
+        ttk.Combobox(form, textvariable=clock_var, values=clock_names, state='readonly',
+                     width=18).pack(side=tk.LEFT, padx=5)
+        ttk.Checkbutton(form, text="Include Subfolders", variable=recursive_var).pack(side=tk.LEFT, padx=5)
+        scan_button = ttk.Button(form, text="Scan", command=lambda: start_scan())
+        scan_button.pack(side=tk.RIGHT)
+        
+        ttk.Label(dialog, text="Access times are often updated lazily or not at all (relatime, "
+                               "noatime); 'Opened in this app' uses the files opened from here.",
+                  wraplength=760).pack(anchor=tk.W, padx=10)
+        
+        colors = THEMES[self.settings['theme']]
+        histogram = tk.Canvas(dialog, height=20 * len(StaleFileScan.AGE_BUCKETS) + 10,
+                              bg=colors['bg'], highlightthickness=0)
+        histogram.pack(fill=tk.X, padx=10, pady=5)
+        histogram.bind('<Configure>', lambda e: state['scan'] and draw_histogram(state['scan']))
+        
+        summary_var = tk.StringVar(value="")
+        ttk.Label(dialog, textvariable=summary_var).pack(anchor=tk.W, padx=10)
+        
+        def file_values(row):
+            entry, used = row
+            return (os.path.relpath(entry.path, path), self.format_size(entry.size),
+                    datetime.fromtimestamp(used).strftime('%Y-%m-%d'))
+        
+        frame = ttk.Frame(dialog)
+        frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        file_list = VirtualFileList(frame, columns=('file', 'size', 'used'), show='headings',
+                                    selectmode='extended', row_values=file_values)
+        file_list.heading('file', text='File')
+        file_list.heading('size', text='Size')
+        file_list.heading('used', text='Last Used')
+        file_list.column('file', width=500)
+        file_list.column('size', width=100)
+        file_list.column('used', width=120)
+        scroll_y = ttk.Scrollbar(frame, orient=tk.VERTICAL, command=file_list.yview)
         scroll_y.pack(side=tk.RIGHT, fill=tk.Y)
-        tree.configure(yscrollcommand=scroll_y.set)
+        file_list.configure(yscrollcommand=scroll_y.set)
+        file_list.pack(fill=tk.BOTH, expand=True)
+        
+        state = {'job': None, 'scan': None, 'action': False}
+        
+        def draw_histogram(scan):
+            histogram.delete('all')
+            width = max(histogram.winfo_width(), 400)
+            bar_room = width - 300
+            largest = max(int(scan.counts.max()), 1)
+            for i, (_, label) in enumerate(StaleFileScan.AGE_BUCKETS):
+                y = 5 + 20 * i
+                count = int(scan.counts[i])
+                histogram.create_text(5, y + 8, text=label, anchor=tk.W, fill=colors['fg'])
+                if count:
+                    histogram.create_rectangle(100, y + 2, 100 + max(2, bar_room * count // largest),
+                                               y + 15, fill=colors['button'], outline='')
+                histogram.create_text(width - 5, y + 8, anchor=tk.E, fill=colors['fg'],
+                                      text=f"{count} files, {self.format_size(int(scan.sizes[i]))}")
+        
+        def show_summary(scan, status=""):
+            summary_var.set(f"{status}{scan.stale_count} of {scan.files_seen} files unused, "
+                            f"{self.format_size(scan.stale_size)}")
+        
+        def set_busy(job, action=False):
+            # A running scan may be restarted, a running batch action not: its
+            # results would be dropped with its messages
+            state['job'] = job
+            state['action'] = action
+            for button in action_buttons:
+                button.configure(state=tk.DISABLED if job else tk.NORMAL)
+            scan_button.configure(state=tk.DISABLED if action else tk.NORMAL)
+        
+        def start_scan():
+            if state['job'] is not None:
+                if state['action']:
+                    return
+                state['job'].cancel()
+            try:
+                days = int(days_var.get())
+            except (tk.TclError, ValueError):
+                messagebox.showerror("Error", "Enter the number of days", parent=dialog)
+                return
+            clock = clock_keys[clock_names.index(clock_var.get())]
+            self.settings['unused_days'] = days
+            self.settings['unused_clock'] = clock
+            opened = self.get_access_history().below(path) if clock == 'opened' else None
+            scan = state['scan'] = StaleFileScan(days, clock, opened)
+            recursive = recursive_var.get()
+            file_list.clear()
+            summary_var.set("Scanning...")
+            failed = []
+            
+            def work(job):
+                batches = scan.scan([path], recursive, job.cancelled, self.settings['walk_workers'],
+                                    self.ignore_rules)
+                for batch in batches:
+                    job.post('batch', batch)
+            
+            def on_message(kind, payload):
+                if kind == 'batch':
+                    file_list.extend(payload)
+                    draw_histogram(scan)
+                    show_summary(scan, "Scanning... ")
+                elif kind == 'error':
+                    failed.append(payload)
+                    summary_var.set(f"Scan failed: {payload}")
+                elif kind == 'done':
+                    set_busy(None)
+                    draw_histogram(scan)
+                    if not failed:
+                        show_summary(scan)
+            
+            set_busy(BackgroundJob(dialog, work, on_message).start())
         
-        tree.pack(fill=tk.BOTH, expand=True)
+        def selected_rows():
+            rows = [file_list.rows[int(item)] for item in file_list.selection()]
+            if not rows:
+                messagebox.showinfo("Unused Files", "Select the files first", parent=dialog)
+            return rows
         
-        for file, date in unused_files:
-            tree.insert('', tk.END, values=(file, date))
+        def run_action(rows, verb, done_verb, action):
+            """Run action(job, rows, progress) in the background, then drop the files that are gone"""
+            progress = {'done': 0, 'total': len(rows)}
+            
+            def work(job):
+                try:
+                    failed = action(job, rows, progress)
+                    if failed:
+                        job.post('failed', failed)
+                finally:
+                    job.post('gone', {entry.path for entry, _ in rows
+                                      if not os.path.lexists(entry.path)})
+            
+            def show_progress():
+                if job.finished or state['job'] is not job:
+                    return
+                done = progress.get('files_done', progress['done'])
+                summary_var.set(f"{verb}... {done} of {progress['total']} files")
+                dialog.after(250, show_progress)
+            
+            def on_message(kind, payload):
+                if kind == 'error':
+                    messagebox.showerror("Error", f"{verb} stopped:\n{str(payload)}", parent=dialog)
+                elif kind == 'failed':
+                    messagebox.showerror("Error", f"{len(payload)} files failed:\n" +
+                                         "\n".join(f"{p}: {getattr(e, 'strerror', None) or e}"
+                                                    for p, e in list(payload.items())[:10]),
+                                         parent=dialog)
+                elif kind == 'report':
+                    messagebox.showinfo("Unused Files", payload, parent=dialog)
+                elif kind == 'gone':
+                    scan = state['scan']
+                    gone = [(entry, used) for entry, used in file_list.rows if entry.path in payload]
+                    remaining = [row for row in file_list.rows if row[0].path not in payload]
+                    file_list.clear()
+                    file_list.extend(remaining)
+                    scan.stale_count -= len(gone)
+                    scan.stale_size -= sum(entry.size for entry, _ in gone)
+                    self.get_access_history().forget(payload)
+                    folders = {os.path.dirname(p) for p in payload}
+                    for folder in folders:
+                        self.snapshot_cache.invalidate(folder)
+                    if self.current_folder in folders:
+                        self.update_file_list()
+                    show_summary(scan, f"{len(gone)} files {done_verb}. ")
+                elif kind == 'done':
+                    set_busy(None)
+            
+            job = BackgroundJob(dialog, work, on_message).start()
+            set_busy(job, action=True)
+            show_progress()
         
         def delete_selected():
-            selected = tree.selection()
-            if selected:
-                item = tree.item(selected[0])
-                file = item['values'][0]
-                filepath = os.path.join(path, file)
-                if messagebox.askyesno("Confirm", f"Delete '{file}'?"):
+            rows = selected_rows()
+            if not rows or not messagebox.askyesno(
+                    "Confirm", f"Delete {len(rows)} files "
+                               f"({self.format_size(sum(e.size for e, _ in rows))})?", parent=dialog):
+                return
+            
+            def action(job, rows, progress):
+                failed = {}
+                for entry, _ in rows:
+                    if job.cancelled.is_set():
+                        raise OperationCancelled()
                     try:
-                        os.remove(filepath)
-                        tree.delete(selected[0])
-                    except Exception as e:
-                        messagebox.showerror("Error", f"Delete failed:\n{str(e)}")
+                        os.remove(entry.path)
+                    except OSError as e:
+                        failed[entry.path] = e
+                    progress['done'] += 1
+                return failed
+            
+            run_action(rows, "Deleting", "deleted", action)
+        
+        def move_selected():
+            rows = selected_rows()
+            if not rows:
+                return
+            target = filedialog.askdirectory(title="Cold Storage Folder", parent=dialog,
+                                             initialdir=self.settings['cold_storage_folder'] or None)
+            if not target:
+                return
+            self.settings['cold_storage_folder'] = target
+            # Files keep their place in the tree below the scanned folder
+            pairs = [(entry.path, os.path.join(target, os.path.relpath(entry.path, path)))
+                     for entry, _ in rows]
+            engine = self.get_transfer_engine()
+            
+            def action(job, rows, progress):
+                failed = {source: FileExistsError(errno.EEXIST, "Already exists in cold storage")
+                          for source, dest in pairs if os.path.lexists(dest)}
+                engine.cancelled = job.cancelled
+                failed.update(engine.transfer([p for p in pairs if p[0] not in failed], move=True,
+                                              progress=progress))
+                return failed
+            
+            run_action(rows, "Moving", "moved", action)
+        
+        def compress_selected():
+            rows = selected_rows()
+            if not rows:
+                return
+            formats = ArchiveJob.formats()
+            default = self.settings['archive_format']
+            if default not in formats:
+                default = formats[0]
+            archive = filedialog.asksaveasfilename(
+                title="Compress To", parent=dialog, initialdir=self.settings['cold_storage_folder'] or path,
+                initialfile=f"unused-{datetime.now():%Y%m%d}{default}",
+                filetypes=[(f"{ext[1:]} archive", f"*{ext}") for ext in
+                           [default] + [ext for ext in formats if ext != default]])
+            if not archive:
+                return
+            try:
+                self.settings['archive_format'] = ArchiveJob.format_for(archive)
+            except ValueError:
+                archive += default
+            
+            def action(job, rows, progress):
+                archiver = ArchiveJob(self.settings['archive_workers'], job.cancelled)
+                result = archiver.archive([(entry.path, os.path.relpath(entry.path, path))
+                                           for entry, _ in rows], archive, progress)
+                if result['archives']:
+                    saved = result['saved']
+                    job.post('report', f"{len(result['removed'])} files packed into "
+                                       f"{len(result['archives'])} archives, " +
+                                       (f"{self.format_size(saved)} saved" if saved >= 0 else
+                                        f"{self.format_size(-saved)} larger than the files"))
+                return result['failed']
+            
+            run_action(rows, "Compressing", "compressed", action)
+        
+        def on_destroy(event):
+            if event.widget is dialog and state['job']:
+                state['job'].cancel()
+        
+        dialog.bind('<Destroy>', on_destroy, add='+')
         
         btn_frame = ttk.Frame(dialog)
         btn_frame.pack(fill=tk.X, padx=10, pady=10)
         
-        ttk.Button(btn_frame, text="Delete Selected", command=delete_selected,
-                  style='Accent.TButton').pack(side=tk.LEFT)
+        action_buttons = [
+            ttk.Button(btn_frame, text="Select All",
+                       command=lambda: file_list.selection_set(file_list.get_children())),
+            ttk.Button(btn_frame, text="Delete", command=delete_selected, style='Accent.TButton'),
+            ttk.Button(btn_frame, text="Move to Cold Storage...", command=move_selected),
+            ttk.Button(btn_frame, text="Compress...", command=compress_selected),
+        ]
+        for button in action_buttons:
+            button.pack(side=tk.LEFT, padx=(0, 5))
         ttk.Button(btn_frame, text="Close", command=dialog.destroy).pack(side=tk.RIGHT)
+        start_scan()
     
     def bulk_rename_files(self):
         """Bulk rename files with pattern"""
@@ -923,61 +5606,155 @@ class ModernFileManager(tk.Tk):
             messagebox.showwarning("Warning", "Please select a valid folder")
             return
         
-        files = [f for f in os.listdir(path) if os.path.isfile(os.path.join(path, f))]
-        if not files:
+        if not self.snapshot_cache.get(path).files:
             messagebox.showwarning("Warning", "No files found in selected folder")
             return
         
         # Create dialog for bulk rename
         dialog = tk.Toplevel(self)
         dialog.title("Bulk Rename")
-        dialog.geometry("500x400")
+        dialog.geometry("750x550")
         
-        ttk.Label(dialog, text="Pattern:").pack(pady=5)
+        form = ttk.Frame(dialog)
+        form.pack(fill=tk.X, padx=10, pady=5)
         
+        ttk.Label(form, text="Pattern:").grid(row=0, column=0, sticky=tk.W, pady=2)
         pattern_var = tk.StringVar(value="file_{num:03d}{ext}")
-        pattern_entry = ttk.Entry(dialog, textvariable=pattern_var, width=40)
-        pattern_entry.pack(pady=5)
-        
-        ttk.Label(dialog, text="Preview:").pack(pady=5)
-        
-        preview_text = scrolledtext.ScrolledText(dialog, height=10, wrap=tk.WORD)
-        preview_text.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
-        
-        def update_preview():
-            preview_text.delete(1.0, tk.END)
-            pattern = pattern_var.get()
+        pattern_entry = ttk.Entry(form, textvariable=pattern_var, width=60)
+        pattern_entry.grid(row=0, column=1, sticky=tk.EW, padx=5)
+        
+        ttk.Label(form, text="Match (regex):").grid(row=1, column=0, sticky=tk.W, pady=2)
+        match_var = tk.StringVar()
+        ttk.Entry(form, textvariable=match_var, width=60).grid(row=1, column=1, sticky=tk.EW, padx=5)
+        form.columnconfigure(1, weight=1)
+        
+        recursive_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(form, text="Include Subfolders", variable=recursive_var,
+                        command=lambda: schedule_preview(0)).grid(row=2, column=1, sticky=tk.W)
+        
+        ttk.Label(dialog, text="Fields: {name} {ext} {num} {counter} (per folder) {folder} "
+                               "{date:%Y-%m-%d} {exif:%Y%m%d_%H%M%S} (photo taken) {1} {group} "
+                               "(regex)", wraplength=720).pack(anchor=tk.W, padx=10)
+        
+        summary_var = tk.StringVar(value="Preview:")
+        ttk.Label(dialog, textvariable=summary_var).pack(anchor=tk.W, padx=10, pady=5)
+        
+        frame = ttk.Frame(dialog)
+        frame.pack(fill=tk.BOTH, expand=True, padx=10)
+        preview_list = VirtualFileList(frame, columns=('old', 'new', 'status'), show='headings')
+        preview_list.heading('old', text='File')
+        preview_list.heading('new', text='New Name')
+        preview_list.heading('status', text='Problem')
+        preview_list.column('old', width=250)
+        preview_list.column('new', width=250)
+        preview_list.column('status', width=200)
+        preview_list.tag_configure('conflict', foreground='#e06c75')
+        scroll_y = ttk.Scrollbar(frame, orient=tk.VERTICAL, command=preview_list.yview)
+        scroll_y.pack(side=tk.RIGHT, fill=tk.Y)
+        preview_list.configure(yscrollcommand=scroll_y.set)
+        preview_list.pack(fill=tk.BOTH, expand=True)
+        
+        # The preview is computed on a background job a moment after the
+        # last keystroke; its plan is what Apply runs
+        state = {'job': None, 'timer': None, 'inputs': None, 'plan': None, 'apply': False}
+        
+        def inputs():
+            return (pattern_var.get(), match_var.get(), recursive_var.get())
+        
+        def schedule_preview(delay=250):
+            if state['timer'] is not None:
+                dialog.after_cancel(state['timer'])
+            state['timer'] = dialog.after(delay, start_preview)
+        
+        def start_preview():
+            state['timer'] = None
+            if state['job'] is not None:
+                state['job'].cancel()
+            state['plan'] = None
+            state['inputs'] = current = inputs()
+            pattern, match, recursive = current
+            try:
+                renamer = RenamePattern(pattern, match)
+            except re.error as e:
+                summary_var.set(f"Invalid regex: {e}")
+                return
+            summary_var.set("Computing preview...")
+            progress = {}
             
-            for i, file in enumerate(files[:10], 1):  # Show first 10 for preview
-                name, ext = os.path.splitext(file)
-                try:
-                    new_name = pattern.format(num=i, name=name, ext=ext)
-                    preview_text.insert(tk.END, f"{file} → {new_name}\n")
-                except:
-                    preview_text.insert(tk.END, f"Error with pattern for {file}\n")
+            def work(job):
+                if recursive:
+                    entries = list(self.tree_model.walk_files(
+                        [path], job.cancelled, workers=self.settings['walk_workers'],
+                        rules=self.ignore_rules))
+                else:
+                    entries = self.snapshot_cache.get(path).files
+                exif = None
+                if renamer.uses_exif:
+                    exif = self.get_metadata_cache().exif_dates(
+                        entries, self.settings['hash_workers'], job.cancelled, progress)
+                new_names, problems = renamer.new_names(path, entries, exif)
+                existing = None
+                if recursive:
+                    existing = set()
+                    for folder in {os.path.dirname(relative) for relative in new_names}:
+                        names = os.listdir(os.path.join(path, folder))
+                        existing.update(os.path.join(folder, name) if folder else name
+                                        for name in names)
+                plan = RenamePlan.build(path, new_names, existing)
+                problems.update(plan.conflicts)
+                rows = [(relative, new_names.get(relative, ''), problems.get(relative, ''))
+                        for relative in sorted(set(new_names) | set(problems))]
+                job.post('preview', (plan, rows))
+            
+            def show_progress():
+                if job.finished or state['job'] is not job:
+                    return
+                if progress.get('total'):
+                    summary_var.set(f"Reading photo dates... {progress['done']} of {progress['total']}")
+                dialog.after(250, show_progress)
+            
+            def on_message(kind, payload):
+                if kind == 'error':
+                    summary_var.set(f"Preview failed: {payload}")
+                    state['apply'] = False
+                elif kind == 'preview':
+                    plan, rows = payload
+                    state['plan'] = plan
+                    preview_list.clear()
+                    preview_list.extend(rows)
+                    for i, row in enumerate(rows):
+                        if row[2]:
+                            preview_list.item(str(i), tags=('conflict',))
+                    summary = f"{len(plan.renames)} of {len(rows)} files will be renamed"
+                    if len(rows) > len(plan.renames):
+                        summary += f", {len(rows) - len(plan.renames)} keep their names"
+                    if plan.cycles:
+                        summary += f" ({plan.cycles} name cycles resolved)"
+                    summary_var.set(summary)
+                    if state['apply']:
+                        state['apply'] = False
+                        self.run_renames(plan, dialog)
+            
+            job = state['job'] = BackgroundJob(dialog, work, on_message).start()
+            show_progress()
         
         def apply_rename():
-            pattern = pattern_var.get()
-            confirm = messagebox.askyesno("Confirm", f"Rename {len(files)} files?")
-            
-            if confirm:
-                try:
-                    for i, file in enumerate(files, 1):
-                        old_path = os.path.join(path, file)
-                        name, ext = os.path.splitext(file)
-                        new_name = pattern.format(num=i, name=name, ext=ext)
-                        new_path = os.path.join(path, new_name)
-                        
-                        os.rename(old_path, new_path)
-                    
-                    messagebox.showinfo("Success", "Files renamed successfully!")
-                    dialog.destroy()
-                    self.update_file_list()
-                except Exception as e:
-                    messagebox.showerror("Error", f"Error while renaming:\n{str(e)}")
+            if state['plan'] is not None and state['inputs'] == inputs():
+                self.run_renames(state['plan'], dialog)
+            else:
+                # Run the plan as soon as the preview for these inputs is ready
+                state['apply'] = True
+                if state['timer'] is not None or state['inputs'] != inputs():
+                    schedule_preview(0)
         
-        pattern_var.trace_add('write', lambda *args: update_preview())
-        update_preview()
+        def on_destroy(event):
+            if event.widget is dialog and state['job']:
+                state['job'].cancel()
+        
+        for var in (pattern_var, match_var):
+            var.trace_add('write', lambda *args: schedule_preview())
+        dialog.bind('<Destroy>', on_destroy, add='+')
+        schedule_preview(0)
         
         btn_frame = ttk.Frame(dialog)
         btn_frame.pack(fill=tk.X, padx=10, pady=10)
@@ -987,7 +5764,12 @@ class ModernFileManager(tk.Tk):
         ttk.Button(btn_frame, text="Cancel", command=dialog.destroy).pack(side=tk.RIGHT)
     
     def show_storage_stats(self):
-        """Show detailed storage statistics"""
+        """Show detailed storage statistics
+        
+        The folder listing is aggregated once in the background. Each chart
+        is rendered off the main thread when its tab is first shown and kept
+        until the folder's snapshot changes.
+        """
         path = self.current_folder
         if not path or not os.path.isdir(path):
             messagebox.showwarning("Warning", "Please select a valid folder")
@@ -1000,67 +5782,123 @@ class ModernFileManager(tk.Tk):
         notebook = ttk.Notebook(dialog)
         notebook.pack(fill=tk.BOTH, expand=True)
         
-        # File type distribution
-        type_frame = ttk.Frame(notebook)
-        notebook.add(type_frame, text="File Types")
-        
-        fig1 = plt.Figure(figsize=(6, 4), dpi=100)
-        ax1 = fig1.add_subplot(111)
-        
-        file_types = defaultdict(int)
-        for item in os.listdir(path):
-            if os.path.isfile(os.path.join(path, item)):
-                ext = os.path.splitext(item)[1].lower()
-                file_types[EXTENSION_FOLDERS.get(ext, 'Other')] += 1
-        
-        if file_types:
-            ax1.pie(file_types.values(), labels=file_types.keys(), autopct='%1.1f%%')
-            ax1.set_title("File Type Distribution")
-        else:
-            ax1.text(0.5, 0.5, "No files found", ha='center', va='center')
-        
-        canvas1 = FigureCanvasTkAgg(fig1, master=type_frame)
-        canvas1.get_tk_widget().pack(fill=tk.BOTH, expand=True)
-        
-        # Size distribution
-        size_frame = ttk.Frame(notebook)
-        notebook.add(size_frame, text="Size Distribution")
-        
-        fig2 = plt.Figure(figsize=(6, 4), dpi=100)
-        ax2 = fig2.add_subplot(111)
-        
-        sizes = []
-        for item in os.listdir(path):
-            item_path = os.path.join(path, item)
-            if os.path.isfile(item_path):
-                sizes.append(os.path.getsize(item_path) / (1024 * 1024))  # in MB
-        
-        if sizes:
-            ax2.hist(sizes, bins=20, edgecolor='black')
-            ax2.set_xlabel("File Size (MB)")
-            ax2.set_ylabel("Count")
-            ax2.set_title("File Size Distribution")
-        else:
-            ax2.text(0.5, 0.5, "No files found", ha='center', va='center')
-        
-        canvas2 = FigureCanvasTkAgg(fig2, master=size_frame)
-        canvas2.get_tk_widget().pack(fill=tk.BOTH, expand=True)
-        
-        # Storage prediction
-        pred_frame = ttk.Frame(notebook)
-        notebook.add(pred_frame, text="Storage Prediction")
-        
-        fig3 = plt.Figure(figsize=(6, 4), dpi=100)
-        ax3 = fig3.add_subplot(111)
+        charts = {'File Types': self.plot_file_types, 'Size Distribution': self.plot_size_distribution,
+                  'Storage Prediction': self.plot_storage_prediction}
+        frames = {}
+        for name in list(charts) + ['Treemap']:
+            frames[name] = ttk.Frame(notebook)
+            notebook.add(frames[name], text=name)
+        state = {'stats': None, 'shown': set()}
+        
+        def show_image(name, image):
+            photo = ImageTk.PhotoImage(image)
+            label = ttk.Label(frames[name], image=photo, anchor=tk.CENTER)
+            label.image = photo
+            label.pack(fill=tk.BOTH, expand=True)
+        
+        def render(name):
+            cache = self.storage_charts
+            if name in cache['images']:
+                show_image(name, cache['images'][name])
+                return
+            placeholder = ttk.Label(frames[name], text="Rendering...", anchor=tk.CENTER)
+            placeholder.pack(fill=tk.BOTH, expand=True)
+            stats = cache['stats']
+            
+            def work(job):
+                job.post('image', self.render_figure(charts[name], path, stats))
+            
+            def on_message(kind, payload):
+                if kind == 'image':
+                    placeholder.destroy()
+                    if self.storage_charts is cache:
+                        cache['images'][name] = payload
+                    show_image(name, payload)
+                elif kind == 'error':
+                    placeholder.configure(text=f"Could not draw the chart:\n{str(payload)}")
+            
+            BackgroundJob(dialog, work, on_message).start()
         
+        def on_tab_changed(event=None):
+            name = notebook.tab(notebook.select(), 'text')
+            if name in state['shown'] or (name in charts and state['stats'] is None):
+                return
+            state['shown'].add(name)
+            if name == 'Treemap':
+                self.create_treemap(frames[name], path)
+            else:
+                render(name)
+        
+        def load(job):
+            snapshot = self.snapshot_cache.get(path)
+            cache = self.storage_charts
+            if cache is None or cache['path'] != path or cache['snapshot'] is not snapshot:
+                cache = {'path': path, 'snapshot': snapshot, 'stats': StorageStats(snapshot.entries),
+                         'images': {}}
+            job.post('stats', cache)
+        
+        def on_message(kind, payload):
+            if kind == 'stats':
+                self.storage_charts = payload
+                state['stats'] = payload['stats']
+                on_tab_changed()
+            elif kind == 'error':
+                messagebox.showerror("Error", f"Could not read the folder:\n{str(payload)}", parent=dialog)
+        
+        notebook.bind('<<NotebookTabChanged>>', on_tab_changed)
+        BackgroundJob(dialog, load, on_message).start()
+    
+    @staticmethod
+    def render_figure(plot, path, stats):
+        """Draw a chart into a PIL image; safe to call off the main thread"""
+        fig = plt.Figure(figsize=(7.5, 5), dpi=100)
+        plot(fig, path, stats)
+        fig.tight_layout()
+        canvas = FigureCanvasAgg(fig)
+        canvas.draw()
+        return Image.frombuffer('RGBA', canvas.get_width_height(), canvas.buffer_rgba(), 'raw', 'RGBA', 0, 1).copy()
+    
+    def plot_file_types(self, fig, path, stats):
+        """Pie of file counts and bars of bytes per category"""
+        if not stats.files:
+            fig.add_subplot(111).text(0.5, 0.5, "No files found", ha='center', va='center')
+            return
+        ax1, ax2 = fig.subplots(1, 2)
+        ax1.pie(stats.category_counts, labels=stats.categories, autopct='%1.1f%%')
+        ax1.set_title("Files by Type")
+        order = np.argsort(stats.category_bytes)
+        ax2.barh([stats.categories[i] for i in order], stats.category_bytes[order] / (1024 * 1024))
+        ax2.set_xlabel("Size (MB)")
+        ax2.set_title("Space by Type")
+    
+    def plot_size_distribution(self, fig, path, stats):
+        """Histograms of file counts and bytes over log-scale size buckets"""
+        if not stats.files:
+            fig.add_subplot(111).text(0.5, 0.5, "No files found", ha='center', va='center')
+            return
+        used = np.flatnonzero(stats.size_counts)
+        labels = [StorageStats.SIZE_LABELS[i] for i in range(used[0], used[-1] + 1)]
+        ax1, ax2 = fig.subplots(2, 1, sharex=True)
+        ax1.bar(labels, stats.size_counts[used[0]:used[-1] + 1], edgecolor='black')
+        ax1.set_ylabel("Count")
+        ax1.set_title("File Size Distribution")
+        ax2.bar(labels, stats.size_bytes[used[0]:used[-1] + 1] / (1024 * 1024), edgecolor='black')
+        ax2.set_ylabel("Size (MB)")
+        ax2.set_xlabel("File Size (at least)")
+        ax2.tick_params(axis='x', labelrotation=45)
+    
+    def plot_storage_prediction(self, fig, path, stats):
+        """Recorded usage of the folder and the linear prediction"""
+        ax3 = fig.add_subplot(111)
         prediction = self.storage_predictor.predict_usage(path)
-        if prediction and len(self.storage_predictor.history[path]) >= 2:
-            records = self.storage_predictor.history[path]
-            x = [(r[0] - records[0][0]).days for r in records]
+        if prediction is not None:
+            records = self.storage_predictor.records(path)
+            x = [(r[0] - records[0][0]).total_seconds() / 86400 for r in records]
             y = [r[1] / (1024 * 1024) for r in records]  # Convert to MB
+            now = (datetime.now() - records[0][0]).total_seconds() / 86400
             
-            ax3.plot(x, y, 'bo-', label='History')
-            ax3.plot([x[-1], 90], [y[-1], prediction / (1024 * 1024)], 'r--', label='Prediction')
+            ax3.plot(x, y, 'b.-', label='History')
+            ax3.plot([x[-1], now + 90], [y[-1], prediction / (1024 * 1024)], 'r--', label='Prediction')
             ax3.set_xlabel("Days")
             ax3.set_ylabel("Storage Usage (MB)")
             ax3.set_title("Storage Usage Prediction (Next 90 Days)")
@@ -1068,9 +5906,102 @@ class ModernFileManager(tk.Tk):
             ax3.grid(True)
         else:
             ax3.text(0.5, 0.5, "Not enough data for prediction", ha='center', va='center')
-        
-        canvas3 = FigureCanvasTkAgg(fig3, master=pred_frame)
-        canvas3.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+    
+    def create_treemap(self, parent, path):
+        """Squarified treemap of the folder sizes below path
+        
+        Folders are nested a few levels deep and the files directly in a
+        folder form one block, so the number of rectangles depends on the
+        window size rather than on the number of files. Double-click zooms
+        into a folder.
+        """
+        root = os.path.abspath(path)
+        colors = THEMES[self.settings['theme']]
+        palette = ['#4e79a7', '#f28e2b', '#59a14f', '#e15759', '#76b7b2', '#edc948', '#b07aa1',
+                   '#9c755f']
+        state = {'folder': root, 'items': {}, 'redraw': None}
+        
+        bar = ttk.Frame(parent)
+        bar.pack(fill=tk.X, padx=5, pady=5)
+        up_button = ttk.Button(bar, text="Up", command=lambda: zoom(os.path.dirname(state['folder'])))
+        up_button.pack(side=tk.LEFT)
+        ttk.Button(bar, text="Open", command=lambda: self.set_folder(state['folder'])).pack(side=tk.LEFT, padx=5)
+        measure_var = tk.StringVar(value="Apparent size")
+        measure = ttk.Combobox(bar, textvariable=measure_var, state='readonly', width=14,
+                               values=["Apparent size", "Size on disk"])
+        measure.pack(side=tk.RIGHT)
+        measure.bind('<<ComboboxSelected>>', lambda e: draw())
+        info_var = tk.StringVar(value="Computing folder sizes...")
+        ttk.Label(parent, textvariable=info_var).pack(anchor=tk.W, padx=5)
+        canvas = tk.Canvas(parent, bg=colors['bg'], highlightthickness=0)
+        canvas.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        
+        def layout(folder, x, y, width, height, depth, color):
+            column = 2 if measure_var.get() == "Size on disk" else 1
+            parts = [part for part in self.folder_sizes.breakdown(folder) if part[column] > 0]
+            parts.sort(key=lambda part: part[column], reverse=True)
+            rects = Treemap.squarify([part[column] for part in parts], x, y, width, height)
+            for i, (part, (rx, ry, rw, rh)) in enumerate(zip(parts, rects)):
+                if rw < 2 or rh < 2:
+                    continue
+                fill = palette[i % len(palette)] if depth == 0 else color
+                item = canvas.create_rectangle(rx, ry, rx + rw, ry + rh, fill=fill, outline=colors['bg'],
+                                               stipple='' if part[3] else 'gray50')
+                label = os.path.basename(part[0]) if part[3] else "(files)"
+                state['items'][item] = (part[0] if part[3] else folder, part[column], part[3], label)
+                nested = part[3] and depth < 3 and rw > 40 and rh > 40
+                if rw > 50 and rh > 16:
+                    text = canvas.create_text(rx + 3, ry + 2, text=label, anchor=tk.NW, fill='#ffffff',
+                                              width=rw - 6)
+                    state['items'][text] = state['items'][item]
+                if nested:
+                    layout(part[0], rx + 3, ry + 18, rw - 6, rh - 21, depth + 1, fill)
+        
+        def draw():
+            state['redraw'] = None
+            canvas.delete('all')
+            state['items'] = {}
+            totals = self.folder_sizes.get(state['folder'])
+            if not totals:
+                return
+            info_var.set(f"{state['folder']}: {self.format_size(totals[0])} "
+                         f"({self.format_size(totals[1])} on disk) in {totals[2]} files")
+            up_button.configure(state=tk.NORMAL if state['folder'] != root else tk.DISABLED)
+            layout(state['folder'], 0, 0, canvas.winfo_width(), canvas.winfo_height(), 0, None)
+        
+        def zoom(folder):
+            if folder == root or folder.startswith(os.path.join(root, '')):
+                state['folder'] = folder
+                draw()
+        
+        def hovered():
+            found = canvas.find_withtag('current')
+            return state['items'].get(found[0]) if found else None
+        
+        def on_motion(event):
+            item = hovered()
+            if item:
+                info_var.set(f"{item[0] if item[2] else os.path.join(item[0], item[3])}: "
+                             f"{self.format_size(item[1])}")
+        
+        def on_double_click(event):
+            item = hovered()
+            if item and item[2]:
+                zoom(item[0])
+        
+        def on_configure(event):
+            # Redraw once the resizing settles
+            if state['redraw'] is not None:
+                canvas.after_cancel(state['redraw'])
+            state['redraw'] = canvas.after(100, draw)
+        
+        canvas.bind('<Motion>', on_motion)
+        canvas.bind('<Double-Button-1>', on_double_click)
+        canvas.bind('<Configure>', on_configure)
+        
+        # Cached totals are drawn as soon as the canvas is laid out and
+        # redrawn once they were brought up to date
+        self.compute_folder_sizes(root, on_done=lambda totals: draw())
     
     # ========== FILE PREVIEW AND SELECTION ==========
     def on_file_select(self, event):
@@ -1175,6 +6106,7 @@ class ModernFileManager(tk.Tk):
                 os.startfile(path)
                 # Record file access
                 self.file_history[filename] = datetime.now()
+                self.get_access_history().record(path)
             except:
                 messagebox.showerror("Error", "Could not open file!")
     
@@ -1209,7 +6141,7 @@ class ModernFileManager(tk.Tk):
                     if old_name in self.file_tags:
                         self.file_tags[new_name] = self.file_tags.pop(old_name)
                     
-                    self.update_file_list()
+                    self.refresh_entries([old_name, new_name])
                 except Exception as e:
                     messagebox.showerror("Error", f"Rename failed:\n{str(e)}")
     
@@ -1233,9 +6165,9 @@ class ModernFileManager(tk.Tk):
                         del self.file_tags[filename]
                     if filename in self.file_history:
                         del self.file_history[filename]
+                    self.get_access_history().forget([path])
                     
-                    self.update_file_list()
-                    self.update_storage_stats()
+                    self.refresh_entries([filename])
                 except Exception as e:
                     messagebox.showerror("Error", f"Delete failed:\n{str(e)}")
     
@@ -1315,56 +6247,54 @@ class ModernFileManager(tk.Tk):
                 updated_tags = new_tag
             
             self.file_tags[filename] = updated_tags
-            self.file_list.item(selected[0], values=(
-                item['values'][0],
-                item['values'][1],
-                item['values'][2],
-                item['values'][3],
-                updated_tags
-            ))
+            # The tag column is formatted from file_tags, so a redraw is enough
+            self.file_list.set_row(selected[0], self.file_list.rows[int(selected[0])])
             self.tag_entry.delete(0, tk.END)
     
     # ========== SEARCH AND FILTER ==========
+    def get_file_index(self):
+        """Return the persistent file index, opening it on first use"""
+        if self.file_index is None:
+            self.file_index = FileIndex()
+        return self.file_index
+    
     def on_search(self, event=None):
-        """Handle search box updates"""
-        self.filter_files()
+        """Handle search box updates, filtering once typing pauses"""
+        if self.search_var.get() == self.filter_query:
+            return
+        if self.filter_after_id:
+            self.after_cancel(self.filter_after_id)
+        self.filter_after_id = self.after(150, self.filter_files)
     
     def filter_files(self):
-        """Filter files based on search query"""
-        query = self.search_var.get().lower()
+        """Filter the loaded folder by the search query, without touching the disk"""
+        self.filter_after_id = None
         path = self.current_folder
         
         if not path:
             return
         
-        self.file_list.delete(*self.file_list.get_children())
+        if self.name_filter is None:
+            # The listing applies the filter once it has loaded the folder
+            if not self.listing_job or self.listing_job.finished:
+                self.update_file_list()
+            return
         
-        try:
-            # Add parent directory link
-            if os.path.dirname(path) != path:
-                self.file_list.insert('', tk.END, 
-                                    values=("..", "", "Parent Directory", "", ""))
-            
-            for item in os.listdir(path):
-                item_path = os.path.join(path, item)
-                
-                if not query or query in item.lower():
-                    if os.path.isfile(item_path):
-                        size = os.path.getsize(item_path)
-                        date = datetime.fromtimestamp(os.path.getmtime(item_path))
-                        ext = os.path.splitext(item)[1].lower()
-                        tags = self.file_tags.get(item, "")
-                        
-                        self.file_list.insert('', tk.END, 
-                                            values=(item, self.format_size(size), 
-                                                    EXTENSION_FOLDERS.get(ext, 'Other'), 
-                                                    date.strftime('%d.%m.%Y %H:%M'),
-                                                    tags))
-                    else:
-                        self.file_list.insert('', tk.END, 
-                                           values=(item, "", "Folder", "", ""))
-        except Exception as e:
-            self.status_text.set(f"Error: {str(e)}")
+        self.filter_query = self.search_var.get()
+        matches = self.name_filter.filter(self.filter_query)
+        
+        self.file_list.clear()
+        
+        # Add parent directory link
+        if os.path.dirname(path) != path:
+            self.file_list.insert('', tk.END, 
+                                values=("..", "", "Parent Directory", "", ""))
+        
+        self.file_list.extend(matches)
+        if self.filter_query:
+            self.status_text.set(f"{len(matches)} of {len(self.name_filter)} items match")
+        else:
+            self.status_text.set("Ready")
     
     def show_search(self):
         """Show advanced search dialog"""
@@ -1377,7 +6307,7 @@ class ModernFileManager(tk.Tk):
         criteria_frame = ttk.Frame(dialog)
         criteria_frame.pack(fill=tk.X, padx=10, pady=5)
         
-        ttk.Label(criteria_frame, text="Name contains:").grid(row=0, column=0, sticky=tk.W)
+        ttk.Label(criteria_frame, text="Name contains (* ?):").grid(row=0, column=0, sticky=tk.W)
         name_entry = ttk.Entry(criteria_frame)
         name_entry.grid(row=0, column=1, sticky=tk.EW, padx=5)
         
@@ -1402,8 +6332,9 @@ class ModernFileManager(tk.Tk):
         results_frame = ttk.LabelFrame(dialog, text="Results", padding=10)
         results_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
         
-        results_tree = ttk.Treeview(results_frame, columns=('name', 'size', 'type'), 
-                                  selectmode='browse')
+        results_tree = VirtualFileList(results_frame, columns=('name', 'size', 'type'),
+                                       selectmode='browse',
+                                       row_values=lambda row: (row[1], self.format_size(row[2]), row[3]))
         results_tree.heading('#0', text='')
         results_tree.heading('name', text='File Name')
         results_tree.heading('size', text='Size')
@@ -1420,54 +6351,153 @@ class ModernFileManager(tk.Tk):
         
         results_tree.pack(fill=tk.BOTH, expand=True)
         
+        current = {'job': None, 'show_counts': None}
+        
+        def parse_size(entry):
+            """Size bound in bytes from a MB entry; invalid input is ignored"""
+            try:
+                return float(entry.get()) * 1024 * 1024 if entry.get() else None
+            except ValueError:
+                return None
+        
         def perform_search():
-            """Perform the advanced search"""
-            name_query = name_entry.get().lower()
-            type_query = type_combobox.get()
-            min_size = size_min.get()
-            max_size = size_max.get()
+            """Run the search in the background, streaming results as they are found
             
-            results_tree.delete(*results_tree.get_children())
+            An indexed tree is searched through the file index. The first
+            search of a tree matches every folder while it is being indexed,
+            so results show up before the crawl has finished.
+            """
+            root = self.current_folder
+            if not root or not os.path.isdir(root):
+                messagebox.showwarning("Warning", "Please select a valid folder", parent=dialog)
+                return
             
-            for root, dirs, files in os.walk(self.current_folder):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    
-                    # Check name
-                    if name_query and name_query not in file.lower():
-                        continue
-                    
-                    # Check type
-                    ext = os.path.splitext(file)[1].lower()
-                    file_type = EXTENSION_FOLDERS.get(ext, 'Other')
-                    if type_query and file_type != type_query:
-                        continue
-                    
-                    # Check size
-                    size_mb = os.path.getsize(file_path) / (1024 * 1024)
-                    if min_size:
-                        try:
-                            if size_mb < float(min_size):
-                                continue
-                        except ValueError:
-                            pass
-                    if max_size:
-                        try:
-                            if size_mb > float(max_size):
-                                continue
-                        except ValueError:
-                            pass
-                    
-                    # Add to results
-                    results_tree.insert('', tk.END, 
-                                      values=(file, self.format_size(os.path.getsize(file_path)), 
-                                              file_type))
+            stop_search()
+            results_tree.clear()
+            index = self.get_file_index()
+            indexed = index.is_indexed(root)
+            criteria = dict(name=name_entry.get() or None, category=type_combobox.get() or None,
+                            min_size=parse_size(size_min), max_size=parse_size(size_max))
+            limit = self.settings.get('search_result_limit', 10000)
+            counts = {'found': 0, 'scanned': 0}
+            started = time.perf_counter()
+            
+            def search(job):
+                if indexed:
+                    counts['scanned'] = index.count(root)
+                    batch = []
+                    for row in index.iter_search(root, limit=limit, **criteria):
+                        if job.is_cancelled:
+                            return
+                        batch.append(row)
+                        if len(batch) >= 500:
+                            job.post('batch', batch)
+                            batch = []
+                    job.post('batch', batch)
+                    return
+                
+                match = FileIndex.entry_matcher(**criteria)
+                
+                def on_files(folder, files):
+                    counts['scanned'] += len(files)
+                    room = limit - counts['found']
+                    if room <= 0:
+                        # Past the cap the crawl only keeps indexing
+                        return
+                    found = [(e.path, e.name, e.size, e.category) for e in files if match(e)]
+                    if found:
+                        counts['found'] += min(room, len(found))
+                        job.post('batch', found[:room])
+                
+                index.refresh(root, cancelled=job.cancelled, on_files=on_files,
+                              workers=self.settings['walk_workers'], rules=self.ignore_rules)
+            
+            def on_message(kind, payload):
+                if kind == 'batch':
+                    results_tree.extend(payload)
+                    if indexed:
+                        counts['found'] += len(payload)
+                elif kind == 'error':
+                    status_label.config(text=f"Search failed: {payload}")
+                elif kind == 'done':
+                    show_counts(done=True)
+            
+            def show_counts(done=False):
+                elapsed = time.perf_counter() - started
+                text = f"{counts['found']} found / {counts['scanned']} scanned"
+                if counts['found'] >= limit:
+                    text += " (limit reached)"
+                if done:
+                    text += f" in {elapsed:.1f} s"
+                elif job.is_cancelled:
+                    text = "Stopped: " + text
+                else:
+                    text = "Searching... " + text
+                status_label.config(text=text)
+            
+            def show_progress():
+                if job.finished or job.is_cancelled or not dialog.winfo_exists():
+                    return
+                show_counts()
+                dialog.after(250, show_progress)
+            
+            job = BackgroundJob(dialog, search, on_message).start()
+            current.update(job=job, show_counts=show_counts)
+            show_progress()
+        
+        def stop_search():
+            """Cancel the search that is still running"""
+            job = current['job']
+            if job and not job.finished and not job.is_cancelled:
+                job.cancel()
+                current['show_counts']()
+        
+        def refresh_index():
+            """Update the index for the current folder, re-reading only changed folders"""
+            root = self.current_folder
+            if not root or not os.path.isdir(root):
+                return
+            index = self.get_file_index()
+            progress = {'dirs': 0, 'rescanned': 0}
+            
+            def crawl(job):
+                index.refresh(root, cancelled=job.cancelled, progress=progress,
+                              workers=self.settings['walk_workers'], rules=self.ignore_rules)
+            
+            def on_message(kind, payload):
+                if kind == 'error':
+                    status_label.config(text=f"Indexing failed: {payload}")
+                elif kind == 'done':
+                    status_label.config(text=f"Index updated: {progress['dirs']} folders checked, "
+                                             f"{progress['rescanned']} re-read")
+            
+            def show_progress():
+                if job.finished or not dialog.winfo_exists():
+                    return
+                status_label.config(text=f"Indexing... {progress['dirs']} folders checked, "
+                                         f"{progress['rescanned']} re-read")
+                dialog.after(250, show_progress)
+            
+            job = BackgroundJob(dialog, crawl, on_message).start()
+            dialog.bind('<Destroy>', lambda e: job.cancel() if e.widget is dialog else None, add='+')
+            show_progress()
+        
+        def on_destroy(event):
+            if event.widget is dialog and current['job']:
+                current['job'].cancel()
+        
+        dialog.bind('<Destroy>', on_destroy, add='+')
+        name_entry.bind('<Return>', lambda e: perform_search())
         
         btn_frame = ttk.Frame(dialog)
         btn_frame.pack(fill=tk.X, padx=10, pady=10)
         
         ttk.Button(btn_frame, text="Search", command=perform_search,
                   style='Accent.TButton').pack(side=tk.LEFT)
+        ttk.Button(btn_frame, text="Stop", command=stop_search).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="Refresh Index", command=refresh_index).pack(side=tk.LEFT)
+        status_label = ttk.Label(btn_frame, text="")
+        status_label.pack(side=tk.LEFT, padx=5)
         ttk.Button(btn_frame, text="Close", command=dialog.destroy).pack(side=tk.RIGHT)
     
     # ========== MEDIA PLAYBACK ==========
@@ -1538,6 +6568,98 @@ class ModernFileManager(tk.Tk):
                             command=lambda: self.toggle_setting('auto_clean', auto_var.get()))
         cb.pack(anchor=tk.W, padx=20, pady=5)
         
+        watch_var = tk.BooleanVar(value=self.settings['watch_folder'])
+        cb = ttk.Checkbutton(features_tab, text="Watch Folder for Changes", variable=watch_var,
+                            command=lambda: self.toggle_setting('watch_folder', watch_var.get()))
+        cb.pack(anchor=tk.W, padx=20, pady=5)
+        
+        sizes_var = tk.BooleanVar(value=self.settings['folder_sizes'])
+        cb = ttk.Checkbutton(features_tab, text="Show Folder Sizes", variable=sizes_var,
+                            command=lambda: self.toggle_setting('folder_sizes', sizes_var.get()))
+        cb.pack(anchor=tk.W, padx=20, pady=5)
+        
+        sample_frame = ttk.Frame(features_tab)
+        sample_frame.pack(anchor=tk.W, padx=20, pady=5)
+        sample_var = tk.BooleanVar(value=self.settings['sample_storage'])
+        ttk.Checkbutton(sample_frame, text="Record Folder Sizes Every", variable=sample_var,
+                        command=lambda: self.toggle_setting('sample_storage', sample_var.get())
+                        ).pack(side=tk.LEFT)
+        minutes_var = tk.IntVar(value=self.settings['sample_minutes'])
+        ttk.Spinbox(sample_frame, from_=5, to=1440, width=5, textvariable=minutes_var,
+                    command=lambda: self.toggle_setting('sample_minutes', minutes_var.get())
+                    ).pack(side=tk.LEFT, padx=5)
+        ttk.Label(sample_frame, text="minutes").pack(side=tk.LEFT)
+        
+        verify_var = tk.BooleanVar(value=self.settings['verify_transfers'])
+        cb = ttk.Checkbutton(features_tab, text="Verify Copies Before Deleting Originals",
+                            variable=verify_var,
+                            command=lambda: self.toggle_setting('verify_transfers', verify_var.get()))
+        cb.pack(anchor=tk.W, padx=20, pady=5)
+        
+        workers_frame = ttk.Frame(features_tab)
+        workers_frame.pack(anchor=tk.W, padx=20, pady=5)
+        ttk.Label(workers_frame, text="Hashing threads:").pack(side=tk.LEFT)
+        workers_var = tk.IntVar(value=self.settings['hash_workers'])
+        ttk.Spinbox(workers_frame, from_=1, to=64, width=5, textvariable=workers_var,
+                    command=lambda: self.toggle_setting('hash_workers', workers_var.get())
+                    ).pack(side=tk.LEFT, padx=5)
+        
+        walk_frame = ttk.Frame(features_tab)
+        walk_frame.pack(anchor=tk.W, padx=20, pady=5)
+        ttk.Label(walk_frame, text="Folder scan threads:").pack(side=tk.LEFT)
+        walk_var = tk.IntVar(value=self.settings['walk_workers'])
+        ttk.Spinbox(walk_frame, from_=1, to=64, width=5, textvariable=walk_var,
+                    command=lambda: self.toggle_setting('walk_workers', walk_var.get())
+                    ).pack(side=tk.LEFT, padx=5)
+        
+        transfer_frame = ttk.Frame(features_tab)
+        transfer_frame.pack(anchor=tk.W, padx=20, pady=5)
+        ttk.Label(transfer_frame, text="Copy threads:").pack(side=tk.LEFT)
+        transfer_var = tk.IntVar(value=self.settings['transfer_workers'])
+        ttk.Spinbox(transfer_frame, from_=1, to=64, width=5, textvariable=transfer_var,
+                    command=lambda: self.toggle_setting('transfer_workers', transfer_var.get())
+                    ).pack(side=tk.LEFT, padx=5)
+        
+        archive_frame = ttk.Frame(features_tab)
+        archive_frame.pack(anchor=tk.W, padx=20, pady=5)
+        ttk.Label(archive_frame, text="Compression processes:").pack(side=tk.LEFT)
+        archive_var = tk.IntVar(value=self.settings['archive_workers'])
+        ttk.Spinbox(archive_frame, from_=1, to=64, width=5, textvariable=archive_var,
+                    command=lambda: self.toggle_setting('archive_workers', archive_var.get())
+                    ).pack(side=tk.LEFT, padx=5)
+        
+        # Ignore rules tab
+        ignore_tab = ttk.Frame(notebook)
+        notebook.add(ignore_tab, text="Ignore")
+        
+        ttk.Label(ignore_tab, text=f"Skipped by recursive scans (gitignore syntax, "
+                                   f"folders can add a {IGNORE_FILE}):").pack(anchor=tk.W, padx=10, pady=5)
+        ignore_text = scrolledtext.ScrolledText(ignore_tab, height=10, wrap=tk.NONE)
+        ignore_text.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        ignore_text.insert(tk.END, '\n'.join(self.settings['ignore_rules']))
+        ignore_text.bind('<KeyRelease>',
+                         lambda e: self.set_ignore_rules(ignore_text.get('1.0', tk.END).splitlines()))
+        
+        # Organize rules tab
+        organize_tab = ttk.Frame(notebook)
+        notebook.add(organize_tab, text="Organize")
+        
+        ttk.Label(organize_tab, text="One rule per line, first match wins, e.g. "
+                                     "'ext:.jpg,.png size>1M -> Photos/{year}/{month}':"
+                  ).pack(anchor=tk.W, padx=10, pady=5)
+        rules_text = scrolledtext.ScrolledText(organize_tab, height=10, wrap=tk.NONE)
+        rules_text.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        rules_text.insert(tk.END, '\n'.join(self.settings['organize_rules']))
+        rules_text.bind('<KeyRelease>', lambda e: self.toggle_setting(
+            'organize_rules', [line for line in rules_text.get('1.0', tk.END).splitlines()
+                               if line.strip()]))
+        
+        recursive_var = tk.BooleanVar(value=self.settings['organize_recursive'])
+        ttk.Checkbutton(organize_tab, text="Include Subfolders", variable=recursive_var,
+                        command=lambda: self.toggle_setting('organize_recursive',
+                                                            recursive_var.get())
+                        ).pack(anchor=tk.W, padx=10, pady=5)
+        
         # Save button
         btn_frame = ttk.Frame(dialog)
         btn_frame.pack(fill=tk.X, padx=10, pady=10)
@@ -1556,6 +6678,11 @@ class ModernFileManager(tk.Tk):
         """Toggle a boolean setting"""
         self.settings[setting] = value
     
+    def set_ignore_rules(self, patterns):
+        """Replace the ignore rules and compile them for the next scans"""
+        self.settings['ignore_rules'] = [p for p in patterns if p.strip()]
+        self.ignore_rules = IgnoreRules(self.settings['ignore_rules'])
+    
     def save_settings(self, dialog):
         """Save settings to config file"""
         try:
@@ -1582,22 +6709,51 @@ class ModernFileManager(tk.Tk):
             return
         
         try:
-            total_size = 0
-            for item in os.listdir(path):
-                item_path = os.path.join(path, item)
-                if os.path.isfile(item_path):
-                    total_size += os.path.getsize(item_path)
+            totals = self.folder_sizes.get(os.path.abspath(path))
+            if totals:
+                used = f"{self.format_size(totals[0])} used ({self.format_size(totals[1])} on disk)"
+            else:
+                used = f"{self.format_size(self.snapshot_cache.get(path).total_size)} used"
             
             # Show storage prediction
             prediction = self.storage_predictor.predict_usage(path)
-            if prediction:
+            if prediction is not None:
                 pred_text = f"Predicted: {self.format_size(prediction)} in 3 months"
-                self.status_text.set(f"{self.format_size(total_size)} used | {pred_text}")
+                self.status_text.set(f"{used} | {pred_text}")
             else:
-                self.status_text.set(f"{self.format_size(total_size)} used")
+                self.status_text.set(used)
         except Exception as e:
             print(f"Error updating storage stats: {str(e)}")
     
+    def sample_storage(self):
+        """Record the size of every folder with recent history, then reschedule
+        
+        Runs in the background when enabled in the settings, so the
+        predictions get regular samples and not just the ones taken when a
+        folder happens to be opened.
+        """
+        interval = max(5, int(self.settings.get('sample_minutes', 60))) * 60000
+        self.after(interval, self.sample_storage)
+        if not self.settings.get('sample_storage') or self.sample_job and not self.sample_job.finished:
+            return
+        history = self.storage_predictor.history
+        
+        def work(job):
+            for path in history.paths(since=time.time() - 30 * 86400):
+                if job.is_cancelled:
+                    return
+                try:
+                    snapshot = self.snapshot_cache.lookup(path) or DirectorySnapshot.scan(path)
+                except OSError:
+                    continue
+                history.add(path, snapshot.total_size)
+        
+        def on_message(kind, payload):
+            if kind == 'error':
+                self.status_text.set(f"Error sampling storage: {str(payload)}")
+        
+        self.sample_job = BackgroundJob(self, work, on_message).start()
+    
     def format_size(self, size):
         """Format file size in human-readable format"""
         for unit in ['B', 'KB', 'MB', 'GB']:
@@ -1630,6 +6786,21 @@ class ModernFileManager(tk.Tk):
     
     def on_closing(self):
         """Handle window closing"""
+        if self.watch_job:
+            self.watch_job.cancel()
+        if self.sample_job:
+            self.sample_job.cancel()
+        self.storage_predictor.history.close()
+        if self.hash_cache is not None:
+            self.hash_cache.close()
+        if self.metadata_cache is not None:
+            self.metadata_cache.close()
+        if self.access_history is not None:
+            self.access_history.close()
+        if self.file_index is not None:
+            self.file_index.close()
+        if self.move_journal is not None:
+            self.move_journal.close()
         self.save_settings(self)
         self.destroy()
 
@@ -0,0 +1,34 @@
+import importlib.util
+import os
+
+import pytest
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'SmartArrange2.1.py')
+
+
+@pytest.fixture(scope='module')
+def app():
+    spec = importlib.util.spec_from_file_location('smartarrange', APP)
+    module = importlib.util.module_from_spec(spec)
+    try:
+        spec.loader.exec_module(module)
+    except Exception as e:
+        # The app imports its GUI dependencies at module level
+        pytest.skip(f"SmartArrange cannot be imported here: {e}")
+    return module
+
+
+def entry(app, root, name):
+    return app.FileEntry(name, os.path.join(root, name), True, 1, 0)
+
+
+def test_padded_number_template(app):
+    root = os.path.abspath('photos')
+    rules = app.OrganizeRules([r'regex:_(\w+)\. -> shots/{1:04d}'])
+    targets = rules.classify(root, [entry(app, root, 'shot_7.png'), entry(app, root, 'shot_x.png')])
+    assert targets == [os.path.join(root, 'shots', '0007'), os.path.join(root, 'shots', 'x')]
+
+
+def test_invalid_format_spec_is_rejected(app):
+    with pytest.raises(ValueError, match='invalid format spec'):
+        app.OrganizeRules(['regex:(\\d+) -> {1:q}'])